@@ -0,0 +1,121 @@
+"""Control de admisión y contrapresión para /upload-process.
+
+Limita los trabajos de procesamiento simultáneos y el total de bytes subidos
+en proceso, con una cola de espera acotada. Cuando el servicio está saturado
+responde 429/503 con Retry-After en lugar de arriesgar un OOM del contenedor.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+MAX_INFLIGHT_UPLOAD_BYTES = int(os.getenv("MAX_INFLIGHT_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "10"))
+UPLOAD_QUEUE_TIMEOUT = float(os.getenv("UPLOAD_QUEUE_TIMEOUT", "30"))
+# Segundos sugeridos al cliente en Retry-After
+UPLOAD_RETRY_AFTER = int(os.getenv("UPLOAD_RETRY_AFTER", "10"))
+
+class UploadAdmission:
+    """Semáforo de trabajos y presupuesto de bytes con cola de espera acotada"""
+
+    def __init__(self, max_jobs: int, max_bytes: int, max_queue: int, queue_timeout: float, retry_after: int):
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._condition = None
+        self.active_jobs = 0
+        self.inflight_bytes = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def _get_condition(self):
+        # La condición se crea dentro del event loop que la usa
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _fits(self, size: int):
+        return self.active_jobs < self.max_jobs and self.inflight_bytes + size <= self.max_bytes
+
+    def _reject(self, status_code: int, detail: str):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    def reject_too_large(self):
+        self.rejected += 1
+        raise HTTPException(status_code=413, detail="El archivo excede el tamaño máximo permitido")
+
+    def check_size(self, size: int):
+        """413 si un archivo de size bytes nunca cabría en el presupuesto"""
+        if size > self.max_bytes:
+            self.reject_too_large()
+
+    async def acquire(self, size: int):
+        self.check_size(size)
+
+        condition = self._get_condition()
+        async with condition:
+            if not self._fits(size):
+                if self.waiting >= self.max_queue:
+                    self._reject(429, "Servidor ocupado: demasiados archivos en proceso, intenta más tarde")
+                self.waiting += 1
+                self.queued += 1
+                try:
+                    await asyncio.wait_for(condition.wait_for(lambda: self._fits(size)), self.queue_timeout)
+                except asyncio.TimeoutError:
+                    self._reject(503, "Servidor ocupado: tiempo de espera agotado en la cola de procesamiento")
+                finally:
+                    self.waiting -= 1
+            self.active_jobs += 1
+            self.inflight_bytes += size
+            self.admitted += 1
+
+    async def release(self, size: int):
+        condition = self._get_condition()
+        async with condition:
+            self.active_jobs -= 1
+            self.inflight_bytes -= size
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def admit(self, size: int):
+        """Reserva un lugar para un trabajo de size bytes mientras dure el bloque"""
+        await self.acquire(size)
+        try:
+            yield
+        finally:
+            await self.release(size)
+
+    def stats(self):
+        return {
+            "max_concurrent_jobs": self.max_jobs,
+            "max_inflight_bytes": self.max_bytes,
+            "max_queue": self.max_queue,
+            "active_jobs": self.active_jobs,
+            "inflight_bytes": self.inflight_bytes,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+upload_admission = UploadAdmission(
+    MAX_CONCURRENT_JOBS,
+    MAX_INFLIGHT_UPLOAD_BYTES,
+    UPLOAD_QUEUE_SIZE,
+    UPLOAD_QUEUE_TIMEOUT,
+    UPLOAD_RETRY_AFTER,
+)
@@ -0,0 +1,321 @@
+"""Particionado mensual y archivo en frío de processing_history.
+
+Uso:
+    python archive.py            # una pasada
+    python archive.py --loop     # cada ARCHIVE_INTERVAL_HOURS
+
+En MySQL la tabla se particiona por rango mensual sobre created_at
+(PARTITION BY RANGE (TO_DAYS(created_at)), una partición pAAAAMM por mes más
+pmax) y cada pasada agrega las particiones de los próximos meses. Las
+consultas filtradas por fecha solo leen las particiones del rango.
+
+Para ello la llave primaria de processing_history pasa a ser (id,
+created_at), como exige MySQL; la unicidad del id ya no la garantiza la base
+sino quien inserta (p. ej. el 409 de /upload-process para un job_id usado).
+
+SQLite (la base por omisión y la de desarrollo) no tiene particiones ni
+poda de particiones: solo se crea el índice sobre created_at, y es el mismo
+ciclo de archivo por mes el que mantiene la tabla viva acotada. Las
+consultas por rango de fechas usan el índice en lugar de descartar meses.
+
+Los meses más antiguos que HISTORY_RETENTION_MONTHS se escriben como JSON
+Lines comprimido en ARCHIVE_DIR, se registran en history_archives y se
+eliminan de la tabla viva (DROP PARTITION en MySQL). Siguen disponibles en
+/archive/search. Las filas de payment_index (duplicates.py) de esos meses se
+eliminan en la misma pasada.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import engine, SessionLocal, create_tables, bump_table_version, ProcessingHistory, HistoryArchive
+from history_cache import HISTORY_TABLE, HISTORY_DELETIONS
+from logging_config import setup_logging
+import duplicates
+
+# Cargar variables de entorno
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HISTORY_RETENTION_MONTHS = int(os.getenv("HISTORY_RETENTION_MONTHS", "12"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Particiones que se crean por adelantado en MySQL
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+
+_PARTITION_RE = re.compile(r"^p(\d{4})(\d{2})$")
+_ARCHIVE_COLUMNS = [column.name for column in ProcessingHistory.__table__.columns]
+
+def month_start(value: datetime):
+    return datetime(value.year, value.month, 1)
+
+def add_months(value: datetime, months: int):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def month_key(value: datetime):
+    return f"{value:%Y-%m}"
+
+def partition_name(value: datetime):
+    return f"p{value:%Y%m}"
+
+def retention_cutoff(now: datetime = None):
+    """Primer mes que se conserva en la tabla viva"""
+    return add_months(month_start(now or datetime.utcnow()), -HISTORY_RETENTION_MONTHS)
+
+def _is_mysql():
+    return engine.dialect.name == "mysql"
+
+def _partition_definition(month: datetime):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN (TO_DAYS('{add_months(month, 1):%Y-%m-%d}'))"
+
+def list_partitions(connection):
+    """Meses con partición propia en processing_history, en orden"""
+    rows = connection.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table": HISTORY_TABLE}).scalars().all()
+    months = []
+    for name in rows:
+        match = _PARTITION_RE.match(name)
+        if match:
+            months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+    return rows, months
+
+def ensure_partitions(now: datetime = None):
+    """Particiona processing_history la primera vez y agrega los meses siguientes"""
+    now = now or datetime.utcnow()
+    last_month = add_months(month_start(now), PARTITION_MONTHS_AHEAD)
+
+    if not _is_mysql():
+        with engine.begin() as connection:
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{HISTORY_TABLE}_created_at ON {HISTORY_TABLE} (created_at)"
+            ))
+        return
+
+    with engine.begin() as connection:
+        names, months = list_partitions(connection)
+        if not names:
+            oldest = connection.execute(text(f"SELECT MIN(created_at) FROM {HISTORY_TABLE}")).scalar()
+            first_month = month_start(min(oldest or now, now))
+            definitions = []
+            month = first_month
+            while month <= last_month:
+                definitions.append(_partition_definition(month))
+                month = add_months(month, 1)
+            definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+            logger.info(f"Particionando {HISTORY_TABLE} desde {month_key(first_month)} ({len(definitions)} particiones)")
+            connection.execute(text(f"UPDATE {HISTORY_TABLE} SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL"))
+            # Toda llave única de una tabla particionada debe incluir la columna de partición
+            connection.execute(text(
+                f"ALTER TABLE {HISTORY_TABLE} MODIFY created_at DATETIME NOT NULL, "
+                f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)"
+            ))
+            connection.execute(text(
+                f"ALTER TABLE {HISTORY_TABLE} PARTITION BY RANGE (TO_DAYS(created_at)) ({', '.join(definitions)})"
+            ))
+            return
+
+        month = add_months(months[-1], 1) if months else month_start(now)
+        while month <= last_month:
+            connection.execute(text(
+                f"ALTER TABLE {HISTORY_TABLE} REORGANIZE PARTITION pmax INTO "
+                f"({_partition_definition(month)}, PARTITION pmax VALUES LESS THAN MAXVALUE)"
+            ))
+            logger.info(f"Partición {partition_name(month)} creada")
+            month = add_months(month, 1)
+
+def archive_path(month: datetime):
+    return os.path.join(ARCHIVE_DIR, f"{HISTORY_TABLE}-{month_key(month)}.jsonl.gz")
+
+def _serialize(record: ProcessingHistory):
+    entry = {}
+    for name in _ARCHIVE_COLUMNS:
+        value = getattr(record, name)
+        entry[name] = value.isoformat() if isinstance(value, datetime) else value
+    return entry
+
+def _drop_rows(db: Session, month: datetime):
+    """Elimina el mes de la tabla viva; en MySQL descarta su partición si es la primera"""
+    if _is_mysql():
+        names, months = list_partitions(db.connection())
+        # La primera partición guarda todo lo anterior a su límite: solo se
+        # descarta cuando coincide con el mes que se acaba de archivar
+        if months and names[0] == partition_name(month):
+            db.execute(text(f"ALTER TABLE {HISTORY_TABLE} DROP PARTITION {partition_name(month)}"))
+            return
+    db.query(ProcessingHistory).filter(
+        ProcessingHistory.created_at >= month,
+        ProcessingHistory.created_at < add_months(month, 1)
+    ).delete(synchronize_session=False)
+
+def _write_archive(path: str, records, live_ids):
+    """Escribe el archivo del mes en un temporal y lo renombra sobre path.
+
+    Conserva las líneas de un archivo anterior cuyos ids no están en la tabla
+    viva (meses archivados antes) y reemplaza las que sí (un intento anterior
+    que se interrumpió antes de eliminarlas). Regresa (filas, monto total)
+    del archivo resultante.
+    """
+    row_count = 0
+    total_amount = 0.0
+    temp_path = f"{path}.tmp"
+    with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as previous:
+                for line in previous:
+                    entry = json.loads(line)
+                    if entry["id"] in live_ids:
+                        continue
+                    f.write(line)
+                    row_count += 1
+                    total_amount += entry.get("total_amount") or 0.0
+        for record in records:
+            f.write(json.dumps(_serialize(record), ensure_ascii=False) + "\n")
+            row_count += 1
+            total_amount += record.total_amount or 0.0
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return row_count, total_amount
+
+def archive_month(db: Session, month: datetime):
+    """Escribe los registros del mes en el archivo frío y los quita de la tabla viva.
+
+    Es idempotente: el archivo se reescribe completo (temporal + rename) y el
+    catálogo guarda los conteos del archivo, no un acumulado. Si una pasada se
+    interrumpe antes de eliminar las filas, la siguiente produce el mismo
+    archivo y los mismos conteos.
+    """
+    end = add_months(month, 1)
+    in_month = (ProcessingHistory.created_at >= month, ProcessingHistory.created_at < end)
+    live_ids = {row.id for row in db.query(ProcessingHistory.id).filter(*in_month)}
+    if not live_ids:
+        return 0
+
+    records = db.query(ProcessingHistory).filter(*in_month).order_by(ProcessingHistory.created_at).yield_per(1000)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(month)
+    row_count, total_amount = _write_archive(path, records, live_ids)
+
+    entry = db.query(HistoryArchive).filter(HistoryArchive.month == month_key(month)).first()
+    if entry is None:
+        entry = HistoryArchive(month=month_key(month), path=path, period_start=month, period_end=end)
+        db.add(entry)
+    entry.path = path
+    entry.row_count = row_count
+    entry.total_amount = total_amount
+    entry.archived_at = datetime.utcnow()
+
+    # En SQLite el catálogo y el DELETE van en la misma transacción; en MySQL el
+    # DROP PARTITION hace commit implícito del catálogo, que ya coincide con el archivo
+    _drop_rows(db, month)
+    bump_table_version(db, HISTORY_TABLE)
+    bump_table_version(db, HISTORY_DELETIONS)
+    db.commit()
+    logger.info(f"Mes {month_key(month)} archivado: {len(live_ids)} registros en {path} ({row_count} en total)")
+    return len(live_ids)
+
+def archive_expired(db: Session, now: datetime = None):
+    """Archiva, del más antiguo al más reciente, los meses fuera de la retención"""
+    cutoff = retention_cutoff(now)
+    oldest = db.query(ProcessingHistory.created_at).filter(
+        ProcessingHistory.created_at < cutoff
+    ).order_by(ProcessingHistory.created_at).limit(1).scalar()
+    archived = {}
+    if oldest is None:
+        return archived
+    month = month_start(oldest)
+    while month < cutoff:
+        count = archive_month(db, month)
+        if count:
+            archived[month_key(month)] = count
+        month = add_months(month, 1)
+    return archived
+
+def list_archives(db: Session):
+    return db.query(HistoryArchive).order_by(HistoryArchive.month.desc()).all()
+
+def search_archive(db: Session, date_from: datetime = None, date_to: datetime = None,
+                   search: str = None, status: str = None, processing_id: str = None, limit: int = 100):
+    """Busca registros archivados; solo abre los archivos de los meses del rango"""
+    query = db.query(HistoryArchive)
+    if date_from:
+        query = query.filter(HistoryArchive.period_end > date_from)
+    if date_to:
+        query = query.filter(HistoryArchive.period_start <= date_to)
+    archives = query.order_by(HistoryArchive.month.desc()).all()
+
+    needle = search.lower() if search else None
+    results = []
+    for archive in archives:
+        if not os.path.exists(archive.path):
+            logger.warning(f"Archivo de {archive.month} no encontrado: {archive.path}")
+            continue
+        with gzip.open(archive.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                created_at = datetime.fromisoformat(entry["created_at"])
+                if date_from and created_at < date_from:
+                    continue
+                if date_to and created_at > date_to:
+                    continue
+                if processing_id and entry["id"] != processing_id:
+                    continue
+                if status and entry["processing_status"] != status:
+                    continue
+                if needle and needle not in entry["filename"].lower() and needle not in entry["original_filename"].lower():
+                    continue
+                entry["created_at"] = created_at
+                results.append(entry)
+                if len(results) >= limit:
+                    return results
+    return results
+
+def run_once():
+    ensure_partitions()
+    db = SessionLocal()
+    try:
+        archived = archive_expired(db)
+        # El índice de duplicados conserva los mismos meses que la tabla viva
+        pruned = duplicates.prune(db, month_key(retention_cutoff()))
+        if pruned:
+            logger.info(f"Índice de pagos: {pruned} filas anteriores a {month_key(retention_cutoff())} eliminadas")
+    finally:
+        db.close()
+    if archived:
+        logger.info(f"Archivo completado: {archived}")
+    return archived
+
+def main():
+    parser = argparse.ArgumentParser(description="Particiona y archiva processing_history")
+    parser.add_argument("--loop", action="store_true", help=f"repetir cada ARCHIVE_INTERVAL_HOURS ({ARCHIVE_INTERVAL_HOURS} h)")
+    args = parser.parse_args()
+
+    setup_logging()
+    create_tables()
+    while True:
+        try:
+            run_once()
+        except Exception as e:
+            logger.error(f"Error archivando historial: {e}")
+            if not args.loop:
+                raise
+        if not args.loop:
+            break
+        time.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Catálogo de bancos por código CLABE.
+
+Los tres primeros dígitos de una CLABE identifican a la institución
+(catálogo de participantes SPEI de Banxico). Se usa para separar la
+plantilla de dispersión en un archivo por banco destino.
+"""
+
+# Código de 3 dígitos -> nombre corto del banco
+BANK_CATALOG = {
+    "002": "BANAMEX",
+    "006": "BANCOMEXT",
+    "009": "BANOBRAS",
+    "012": "BBVA MEXICO",
+    "014": "SANTANDER",
+    "019": "BANJERCITO",
+    "021": "HSBC",
+    "030": "BAJIO",
+    "036": "INBURSA",
+    "042": "MIFEL",
+    "044": "SCOTIABANK",
+    "058": "BANREGIO",
+    "059": "INVEX",
+    "060": "BANSI",
+    "062": "AFIRME",
+    "072": "BANORTE",
+    "106": "BANK OF AMERICA",
+    "108": "MUFG",
+    "110": "JP MORGAN",
+    "112": "BMONEX",
+    "113": "VE POR MAS",
+    "127": "AZTECA",
+    "128": "AUTOFIN",
+    "129": "BARCLAYS",
+    "130": "COMPARTAMOS",
+    "132": "MULTIVA BANCO",
+    "133": "ACTINVER",
+    "136": "INTERCAM BANCO",
+    "137": "BANCOPPEL",
+    "138": "ABC CAPITAL",
+    "140": "CONSUBANCO",
+    "141": "VOLKSWAGEN",
+    "143": "CIBANCO",
+    "145": "BBASE",
+    "147": "BANKAOOL",
+    "148": "PAGATODO",
+    "150": "INMOBILIARIO",
+    "151": "DONDE",
+    "152": "BANCREA",
+    "154": "BANCO COVALTO",
+    "155": "ICBC",
+    "156": "SABADELL",
+    "157": "SHINHAN",
+    "158": "MIZUHO BANK",
+    "159": "BANK OF CHINA",
+    "160": "BANCO S3",
+    "166": "BANCO DEL BIENESTAR",
+    "168": "HIPOTECARIA FEDERAL",
+    "600": "MONEXCB",
+    "601": "GBM",
+    "602": "MASARI",
+    "605": "VALUE",
+    "608": "VECTOR",
+    "616": "FINAMEX",
+    "617": "VALMEX",
+    "620": "PROFUTURO",
+    "630": "CB INTERCAM",
+    "631": "CI BOLSA",
+    "634": "FINCOMUN",
+    "638": "NU MEXICO",
+    "646": "STP",
+    "652": "CREDICAPITAL",
+    "653": "KUSPIT",
+    "656": "UNAGRA",
+    "659": "ASP INTEGRA OPC",
+    "670": "LIBERTAD",
+    "677": "CAJA POP MEXICA",
+    "680": "CRISTOBAL COLON",
+    "683": "CAJA TELEFONIST",
+    "684": "TRANSFER",
+    "685": "FONDO FIRA",
+    "686": "INVERCAP",
+    "689": "FOMPED",
+    "699": "FONDEADORA",
+    "703": "TESORED",
+    "706": "ARCUS",
+    "710": "NVIO",
+    "722": "MERCADO PAGO",
+    "723": "CUENCA",
+    "728": "SPIN BY OXXO",
+    "902": "INDEVAL",
+}
+
+def bank_name(code: str):
+    """Nombre del banco para un código CLABE; los desconocidos conservan el código"""
+    if not code:
+        return "SIN CLABE"
+    return BANK_CATALOG.get(code, f"DESCONOCIDO {code}")
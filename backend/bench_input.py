@@ -0,0 +1,57 @@
+"""Benchmark de lectura y limpieza: ANEXO en Excel vs. el mismo ANEXO en CSV.
+
+Uso:
+    python bench_input.py [filas]
+
+Genera un ANEXO sintético (7 filas de encabezado antes de los títulos, como
+la hoja "ADMON. PENSION"), lo guarda como .xlsx y como CSV separado por
+punto y coma en cp1252, y mide read_source + clean_dataframe para cada uno.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import pandas as pd
+
+from pipeline import read_source, clean_dataframe
+
+BANK_CODES = ["002", "012", "014", "021", "072", "127", "137", "646"]
+
+def build_anexo(rows: int):
+    random.seed(7)
+    data = pd.DataFrame({
+        "NO.": range(1, rows + 1),
+        "NOMBRE COMPLETO": [f"PENSIONADO {i} MUÑOZ" for i in range(rows)],
+        "CLABE INTERBANCARIA": [random.choice(BANK_CODES) + f"{random.randrange(10**15):015d}" for _ in range(rows)],
+        "NETO A DEPOSITAR": [round(random.uniform(500, 30000), 2) for _ in range(rows)],
+    })
+    preamble = pd.DataFrame([[f"ENCABEZADO {i}", "", "", ""] for i in range(7)], columns=data.columns)
+    header = pd.DataFrame([list(data.columns)], columns=data.columns)
+    return pd.concat([preamble, header, data.astype(str)], ignore_index=True)
+
+def measure(label: str, path: str):
+    started = time.perf_counter()
+    df = read_source(path)
+    read_done = time.perf_counter()
+    df_clean = clean_dataframe(df)
+    clean_done = time.perf_counter()
+    print(f"{label:<8} lectura {read_done - started:8.3f} s   limpieza {clean_done - read_done:7.3f} s   "
+          f"total {clean_done - started:8.3f} s   ({len(df_clean)} filas)")
+    return clean_done - started
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    anexo = build_anexo(rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        xlsx_path = os.path.join(tmp, "anexo.xlsx")
+        csv_path = os.path.join(tmp, "anexo.csv")
+        anexo.to_excel(xlsx_path, sheet_name="ADMON. PENSION", header=False, index=False)
+        anexo.to_csv(csv_path, sep=";", header=False, index=False, encoding="cp1252")
+
+        excel_time = measure("Excel", xlsx_path)
+        csv_time = measure("CSV", csv_path)
+        print(f"CSV es {excel_time / csv_time:.1f}x más rápido")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark del costo de logging por petición: handler síncrono vs. cola.
+
+Uso:
+    python bench_logging.py [peticiones]
+
+Simula el logging de una petición a /upload-process como era antes
+(echo=True de SQLAlchemy, lista completa de columnas en INFO, StreamHandler
+síncrono) y como queda con logging_config (cola + listener, sin echo SQL).
+Mide solo el tiempo que pasa el hilo de la petición dentro de las llamadas
+de logging.
+"""
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import tempfile
+import time
+
+from logging_config import JsonFormatter, _StructuredQueueHandler
+
+# Una petición típica: ~30 sentencias SQL con echo, unos cuantos mensajes de la app
+SQL_STATEMENTS_PER_REQUEST = 30
+APP_MESSAGES_PER_REQUEST = 6
+COLUMNS = [f"COLUMNA {i}" for i in range(60)]
+
+def simulate_request(sql_logger, app_logger, sql_echo: bool):
+    if sql_echo:
+        for i in range(SQL_STATEMENTS_PER_REQUEST):
+            sql_logger.info("SELECT processing_history.id, processing_history.filename FROM processing_history WHERE processing_history.id = %s", i)
+            sql_logger.info("[cached since %.4gs ago] %r", 0.001, (i,))
+    app_logger.info("Archivo leído con header en fila 8, %d filas", 20000)
+    app_logger.log(logging.INFO if sql_echo else logging.DEBUG, "Columnas normalizadas: %s", COLUMNS)
+    for _ in range(APP_MESSAGES_PER_REQUEST - 2):
+        app_logger.info("Datos procesados: %d filas válidas", 19998)
+
+def run(label: str, handler, sql_echo: bool, requests: int, listener=None):
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    sql_logger = logging.getLogger("sqlalchemy.engine.Engine")
+    app_logger = logging.getLogger("pipeline")
+    if listener:
+        listener.start()
+
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        simulate_request(sql_logger, app_logger, sql_echo)
+        latencies.append(time.perf_counter() - started)
+
+    if listener:
+        listener.stop()
+    root.removeHandler(handler)
+    latencies.sort()
+    avg = sum(latencies) / len(latencies) * 1e6
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1e6
+    print(f"{label:<42} promedio {avg:9.1f} µs   p99 {p99:9.1f} µs")
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        before_stream = open(os.path.join(tmp, "before.log"), "w")
+        before = logging.StreamHandler(before_stream)
+        before.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        run("Antes (síncrono, echo SQL, columnas INFO)", before, True, requests)
+
+        after_stream = open(os.path.join(tmp, "after.log"), "w")
+        sink = logging.StreamHandler(after_stream)
+        sink.setFormatter(JsonFormatter())
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, sink)
+        run("Después (cola + JSON, sin echo SQL)", _StructuredQueueHandler(log_queue), False, requests, listener)
+
+        same_stream = open(os.path.join(tmp, "same.log"), "w")
+        sink = logging.StreamHandler(same_stream)
+        sink.setFormatter(JsonFormatter())
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, sink)
+        run("Cola con echo SQL (misma carga que antes)", _StructuredQueueHandler(log_queue), True, requests, listener)
+
+        for stream in (before_stream, after_stream, same_stream):
+            stream.close()
+
+if __name__ == "__main__":
+    main()
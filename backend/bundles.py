@@ -0,0 +1,139 @@
+"""Descarga de varios archivos procesados en un solo ZIP generado al vuelo.
+
+El ZIP se escribe sobre un sumidero no buscable y cada bloque se entrega a
+la respuesta en cuanto se produce: no hay archivo temporal y la memoria no
+depende del tamaño del paquete. Los .xlsx ya vienen comprimidos, así que se
+guardan sin recomprimir (ZIP_STORED); solo el manifiesto CSV se comprime.
+"""
+import csv
+import io
+import os
+import zipfile
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import ProcessingHistory
+from storage import processed_file_path
+
+# Cargar variables de entorno
+load_dotenv()
+
+BUNDLE_MAX_FILES = int(os.getenv("BUNDLE_MAX_FILES", "500"))
+BUNDLE_CHUNK_SIZE = 64 * 1024
+
+MANIFEST_NAME = "manifiesto.csv"
+
+class _StreamSink:
+    """Destino de escritura para ZipFile que acumula bytes hasta que se drenan.
+
+    No implementa seek, por lo que ZipFile escribe descriptores de datos en
+    lugar de regresar a corregir los encabezados locales.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def select_bundle_records(db: Session, ids=None, date_from: datetime = None, date_to: datetime = None):
+    """Registros completados a incluir, por lista de ids o por rango de fechas"""
+    if not ids and not date_from and not date_to:
+        raise HTTPException(status_code=400, detail="Indica los ids o un rango de fechas")
+
+    query = db.query(ProcessingHistory).filter(
+        ProcessingHistory.processing_status == "completed",
+        ProcessingHistory.processed_filename.isnot(None)
+    )
+    if ids:
+        query = query.filter(ProcessingHistory.id.in_(ids))
+    if date_from:
+        query = query.filter(ProcessingHistory.created_at >= date_from)
+    if date_to:
+        query = query.filter(ProcessingHistory.created_at <= date_to)
+
+    records = query.order_by(ProcessingHistory.created_at).limit(BUNDLE_MAX_FILES + 1).all()
+    if not records:
+        raise HTTPException(status_code=404, detail="No hay archivos procesados para descargar")
+    if len(records) > BUNDLE_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"El paquete excede el máximo de {BUNDLE_MAX_FILES} archivos")
+
+    # Solo datos simples: el generador corre después de cerrar la sesión
+    return [
+        {
+            "id": record.id,
+            "filename": record.filename,
+            "original_filename": record.original_filename,
+            "path": processed_file_path(record.id, record.filename),
+            "name": f"{record.created_at:%Y-%m-%d}_{record.id[:8]}_{record.filename}",
+            "rows": record.rows_processed,
+            "total_amount": record.total_amount,
+            "created_at": record.created_at,
+        }
+        for record in records
+    ]
+
+def _manifest(entries, included):
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(["processing_id", "archivo", "archivo_original", "fecha", "filas", "monto_total", "estado"])
+    total_rows = 0
+    total_amount = 0.0
+    for entry in entries:
+        present = entry["id"] in included
+        if present:
+            total_rows += entry["rows"] or 0
+            total_amount += entry["total_amount"] or 0.0
+        writer.writerow([
+            entry["id"],
+            entry["name"],
+            entry["original_filename"],
+            entry["created_at"].isoformat(),
+            entry["rows"],
+            f"{entry['total_amount']:.2f}" if entry["total_amount"] is not None else "",
+            "incluido" if present else "faltante",
+        ])
+    writer.writerow(["", "TOTAL", "", "", total_rows, f"{total_amount:.2f}", f"{len(included)} archivos"])
+    return manifest.getvalue()
+
+def stream_bundle(entries):
+    """Generador de bloques del ZIP con los archivos de entries y el manifiesto"""
+    sink = _StreamSink()
+    included = set()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as bundle:
+        for entry in entries:
+            try:
+                source = open(entry["path"], "rb")
+            except FileNotFoundError:
+                continue
+            with source:
+                info = zipfile.ZipInfo(entry["name"], date_time=entry["created_at"].timetuple()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                with bundle.open(info, "w") as target:
+                    for chunk in iter(lambda: source.read(BUNDLE_CHUNK_SIZE), b""):
+                        target.write(chunk)
+                        yield sink.drain()
+            included.add(entry["id"])
+            yield sink.drain()
+
+        info = zipfile.ZipInfo(MANIFEST_NAME, date_time=datetime.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        bundle.writestr(info, _manifest(entries, included))
+    # El directorio central se escribe al cerrar el ZipFile
+    yield sink.drain()
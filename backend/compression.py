@@ -0,0 +1,119 @@
+"""Middleware ASGI que comprime respuestas JSON grandes.
+
+Usa brotli si el cliente lo acepta y el paquete está instalado; si no, gzip.
+Solo comprime respuestas completas (un solo mensaje de cuerpo) cuyo tipo
+esté en COMPRESSIBLE_TYPES, así que no toca descargas de archivos ni el
+stream SSE.
+
+El Vary de la respuesta (p. ej. Origin de CORS) se conserva y se le agrega
+Accept-Encoding. Un ETag fuerte se vuelve débil en el cuerpo comprimido: los
+bytes ya no son los de la representación original, y las comparaciones de
+If-None-Match (débiles) siguen funcionando.
+"""
+import gzip
+import os
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional
+    brotli = None
+
+# Cargar variables de entorno
+load_dotenv()
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSIBLE_TYPES = ("application/json",)
+
+def choose_encoding(accept_encoding: str):
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def compress(body: bytes, encoding: str):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+def merge_vary(values, extra: str = "Accept-Encoding"):
+    """Une los valores de Vary existentes con extra, sin duplicados"""
+    fields = []
+    for value in values:
+        for field in value.decode("latin-1").split(","):
+            field = field.strip()
+            if field and field.lower() not in {f.lower() for f in fields}:
+                fields.append(field)
+    if "*" in fields:
+        return b"*"
+    if extra.lower() not in {f.lower() for f in fields}:
+        fields.append(extra)
+    return ", ".join(fields).encode("latin-1")
+
+def weaken_etag(value: bytes):
+    return value if value.startswith(b"W/") else b"W/" + value
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope["headers"])
+        encoding = choose_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                # p. ej. http.response.pathsend de FileResponse
+                if not passthrough and start_message is not None:
+                    passthrough = True
+                    await send(start_message)
+                await send(message)
+                return
+
+            headers = {key.lower(): value for key, value in start_message["headers"]}
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or b"content-encoding" in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+                or len(body) < self.minimum_size
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            vary = [value for key, value in start_message["headers"] if key.lower() == b"vary"]
+            new_headers = [
+                (key, weaken_etag(value) if key.lower() == b"etag" else value)
+                for key, value in start_message["headers"]
+                if key.lower() not in (b"content-length", b"vary")
+            ]
+            new_headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", merge_vary(vary)),
+            ]
+            await send({**start_message, "headers": new_headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
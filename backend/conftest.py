@@ -0,0 +1,52 @@
+"""Configuración común de las pruebas del backend.
+
+Los módulos leen su configuración del entorno al importarse, así que aquí
+se fija antes de cualquier import: cada sesión usa una base SQLite y
+directorios temporales propios, nunca la base ni los archivos del .env.
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+_TEST_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_DIR, 'app.db')}"
+os.environ.pop("READ_REPLICA_URL", None)
+for variable, subdir in [
+    ("PROCESSED_FILES_DIR", "processed_files"),
+    ("UPLOADS_DIR", "uploads"),
+    ("INTERMEDIATES_DIR", "intermediates"),
+    ("ARCHIVE_DIR", "archive"),
+    ("PROFILES_DIR", "profiles"),
+]:
+    os.environ[variable] = os.path.join(_TEST_DIR, subdir)
+# Los trabajos inline corren en hilos: las pruebas no levantan el forkserver
+os.environ["INLINE_JOB_PROCESSES"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openpyxl import Workbook
+from database import SessionLocal, create_tables
+
+create_tables()
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def payroll_xlsx(tmp_path):
+    """Libro con las columnas que reconoce pipeline.clean_dataframe"""
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["NOMBRE", "CLABE", "IMPORTE"])
+    sheet.append(["Juan Pérez", "012180001234567891", 1500.5])
+    sheet.append(["María López", "002180009876543210", 2300])
+    sheet.append(["TOTAL", None, 3800.5])
+    path = tmp_path / "nomina.xlsx"
+    workbook.save(path)
+    return path
@@ -1,21 +1,52 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float, text
+from sqlalchemy import create_engine, inspect, Column, Integer, BigInteger, Boolean, String, DateTime, Text, Float, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+import logging
 import os
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuración de la base de datos
 # Usar DATABASE_URL del archivo .env, por defecto SQLite
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 
+# Registrar cada sentencia SQL solo si se pide explícitamente (SQL_ECHO=true)
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+
+# Réplica de lectura opcional para consultas de solo lectura (ver read_routing.py)
+READ_REPLICA_URL = os.getenv("READ_REPLICA_URL", "")
+
+# Tamaño de pool por engine: las lecturas del tablero no compiten por las
+# conexiones de las escrituras del procesamiento
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "10"))
+READ_MAX_OVERFLOW = int(os.getenv("READ_MAX_OVERFLOW", "20"))
+
+def _pool_options(url: str, pool_size: int, max_overflow: int):
+    # SQLite (desarrollo local) usa el pool por omisión de SQLAlchemy
+    if url.startswith("sqlite"):
+        return {}
+    return {"pool_size": pool_size, "max_overflow": max_overflow}
+
 # Crear engine y sesión
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO, **_pool_options(DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Sin réplica configurada las lecturas usan el primario
+if READ_REPLICA_URL:
+    read_engine = create_engine(READ_REPLICA_URL, echo=SQL_ECHO,
+                                **_pool_options(READ_REPLICA_URL, READ_POOL_SIZE, READ_MAX_OVERFLOW))
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+else:
+    read_engine = engine
+    ReadSessionLocal = SessionLocal
+
 # Base para los modelos
 Base = declarative_base()
 
@@ -42,10 +73,87 @@ class ProcessingHistory(Base):
     processing_status = Column(String(50), nullable=False, default="completed")
     error_message = Column(Text, nullable=True)
     file_size = Column(Integer, nullable=True)  # Tamaño del archivo en bytes
+    file_hash = Column(String(64), nullable=True, index=True)  # SHA-256 del archivo original
+    source = Column(String(20), nullable=True)  # "watcher" para la ingesta por carpeta; NULL para la API
+    output_hash = Column(String(64), nullable=True)  # SHA-256 del archivo procesado (ETag)
     processing_time = Column(Float, nullable=True)  # Tiempo de procesamiento en segundos
+    profile_filename = Column(String(255), nullable=True)  # Perfil de ejecución, si se pidió
+    reconciliation_summary = Column(Text, nullable=True)  # JSON de la última conciliación con el banco
+    reconciled_at = Column(DateTime, nullable=True)
+    duplicate_rows = Column(Integer, nullable=True)  # Filas que ya se habían pagado en la ventana (duplicates.py)
+    duplicate_summary = Column(Text, nullable=True)  # JSON con el detalle de la revisión de duplicados
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # Llave de partición mensual (archive.py)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Cola de trabajos de procesamiento compartida entre réplicas y workers
+class ProcessingJob(Base):
+    __tablename__ = "processing_jobs"
+    
+    id = Column(String(36), primary_key=True, index=True)  # Mismo id que ProcessingHistory
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued, running, completed, dead
+    input_path = Column(String(512), nullable=False)
+    original_filename = Column(String(255), nullable=False)
+    output_filename = Column(String(255), nullable=False)
+    output_mode = Column(String(20), nullable=False, default="single")  # single, by_bank
+    output_format = Column(String(50), nullable=False, default="xlsx")  # xlsx o un formato de layouts.py
+    profile = Column(Boolean, nullable=False, default=False)  # Perfilar la ejecución (profiling.py)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)  # Para reintentos con backoff
+    locked_by = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True, index=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+# Catálogo de meses de processing_history movidos a archivo frío (archive.py)
+class HistoryArchive(Base):
+    __tablename__ = "history_archives"
+    
+    month = Column(String(7), primary_key=True)  # "AAAA-MM"
+    path = Column(String(512), nullable=False)  # Archivo JSON Lines comprimido con gzip
+    row_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=True)
+    period_start = Column(DateTime, nullable=False, index=True)
+    period_end = Column(DateTime, nullable=False, index=True)  # Exclusivo
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+# Índice de pagos procesados para detectar duplicados entre archivos
+class PaymentIndex(Base):
+    __tablename__ = "payment_index"
+    __table_args__ = (
+        # Llave de búsqueda de duplicates.py: CLABE + monto + periodo
+        Index("ix_payment_index_lookup", "clabe", "amount_cents", "period"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    processing_id = Column(String(36), nullable=False, index=True)
+    clabe = Column(String(18), nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)
+    period = Column(String(7), nullable=False)  # "AAAA-MM" del procesamiento
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Contador de versión por tabla: cambia en cada escritura y permite validar
+# cachés (ETag de historial) con una lectura por llave primaria
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+    
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+def bump_table_version(db, name: str):
+    """Incrementa la versión de la tabla dentro de la transacción actual"""
+    updated = db.query(TableVersion).filter(TableVersion.name == name).update(
+        {TableVersion.version: TableVersion.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.add(TableVersion(name=name, version=1))
+
+def get_table_version(db, name: str):
+    version = db.query(TableVersion.version).filter(TableVersion.name == name).scalar()
+    return version or 0
+
 # Función para obtener sesión de base de datos
 def get_db():
     db = SessionLocal()
@@ -54,9 +162,77 @@ def get_db():
     finally:
         db.close()
 
+def replica_enabled():
+    return read_engine is not engine
+
+def _default_literal(column):
+    """DEFAULT en SQL para el valor por omisión escalar de la columna, o None"""
+    if column.default is None or not column.default.is_scalar:
+        return None
+    value = column.default.arg
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+# Columnas agregadas a tablas que ya existían: (tabla, columna). create_all
+# solo crea tablas nuevas; cada cambio de esquema agrega aquí sus columnas, y
+# también los índices nuevos sobre columnas que ya existían.
+SCHEMA_MIGRATIONS = [
+    # Ingesta por carpeta (watcher.py): deduplicación por hash y origen
+    ("processing_history", "file_hash"),
+    ("processing_history", "source"),
+    # Perfilado opcional (profiling.py), también para los trabajos en cola
+    ("processing_history", "profile_filename"),
+    ("processing_jobs", "profile"),
+    # ETag de las descargas (downloads.py)
+    ("processing_history", "output_hash"),
+    # Llave del particionado y archivo mensual (archive.py)
+    ("processing_history", "created_at"),
+    # Última conciliación con el archivo del banco (reconciliation.py)
+    ("processing_history", "reconciliation_summary"),
+    ("processing_history", "reconciled_at"),
+    # Revisión de pagos duplicados entre procesamientos (duplicates.py)
+    ("processing_history", "duplicate_rows"),
+    ("processing_history", "duplicate_summary"),
+]
+
+def _add_missing_columns(connection):
+    """Aplica SCHEMA_MIGRATIONS: agrega las columnas que faltan y sus índices.
+
+    Sin esto, una base creada con una versión anterior falla en la primera
+    consulta que use una columna nueva. Es idempotente.
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    columns = {}
+    for table_name, column_name in SCHEMA_MIGRATIONS:
+        if table_name not in existing_tables:
+            continue
+        if table_name not in columns:
+            columns[table_name] = {column["name"] for column in inspector.get_columns(table_name)}
+        table = Base.metadata.tables[table_name]
+        column = table.columns[column_name]
+        if column_name not in columns[table_name]:
+            ddl = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column.type.compile(dialect=connection.dialect)}"
+            default = _default_literal(column)
+            if default is not None:
+                ddl += f" DEFAULT {default}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            connection.execute(text(ddl))
+            columns[table_name].add(column_name)
+            logger.info(f"Columna agregada: {table_name}.{column_name}")
+        for index in table.indexes:
+            if column_name in index.columns:
+                index.create(connection, checkfirst=True)
+
 # Función para crear las tablas
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        _add_missing_columns(connection)
 
 # Función para verificar conexión
 def test_connection():
@@ -0,0 +1,156 @@
+"""Descargas condicionales y por rangos de archivos procesados.
+
+Los metadatos de cada processing_id (ruta, ETag, fecha, stat) se guardan en
+un LRU para que las descargas repetidas no vuelvan a consultar el registro
+ni a calcular el hash. Cada acierto se valida solo con un os.stat (un
+archivo borrado o reemplazado se recarga), sin tocar la base. Los registros
+no cambian después de guardarse y solo archive.py los elimina, en otro
+proceso: cuando sube la versión HISTORY_DELETIONS el caché se vacía. Esa
+versión se consulta a lo más cada DOWNLOAD_VERSION_CHECK_SECONDS, así que
+un registro archivado puede descargarse durante ese lapso. El ETag es
+fuerte: el SHA-256 del archivo procesado.
+
+download_response hace E/S bloqueante (consulta, stat y, para registros
+anteriores a output_hash, el hash del archivo): se llama en el threadpool.
+
+FileResponse atiende Range/If-Range. En el despliegue por omisión (uvicorn)
+el archivo se envía desde Python por bloques: uvicorn no implementa la
+extensión ASGI http.response.pathsend, que permitiría enviarlo sin copiarlo.
+El envío sin copia requiere definir DOWNLOAD_ACCEL_REDIRECT_PREFIX: la
+respuesta delega el envío a nginx (X-Accel-Redirect), que lo sirve con
+sendfile.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from cache import LRUCache
+from database import ProcessingHistory, get_table_version
+from history_cache import HISTORY_DELETIONS
+from storage import processed_file_path, file_sha256, media_type_for
+
+# Cargar variables de entorno
+load_dotenv()
+
+DOWNLOAD_CACHE_SIZE = int(os.getenv("DOWNLOAD_CACHE_SIZE", "1024"))
+# Ruta interna de nginx que apunta a PROCESSED_FILES_DIR, p. ej. "/protected_files/"
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = os.getenv("DOWNLOAD_ACCEL_REDIRECT_PREFIX", "")
+
+# Segundos entre consultas de HISTORY_DELETIONS; los aciertos dentro de ese lapso no tocan la base
+DOWNLOAD_VERSION_CHECK_SECONDS = float(os.getenv("DOWNLOAD_VERSION_CHECK_SECONDS", "10"))
+
+download_cache = LRUCache(DOWNLOAD_CACHE_SIZE)
+_deletions = {"version": None, "checked_at": None}
+_deletions_lock = threading.Lock()
+
+def _stat_or_404(file_path: str):
+    try:
+        return os.stat(file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado en el sistema")
+
+def _check_deletions(db: Session):
+    """Vacía el caché si archive.py eliminó registros desde la última consulta"""
+    now = time.monotonic()
+    checked_at = _deletions["checked_at"]
+    if checked_at is not None and now - checked_at < DOWNLOAD_VERSION_CHECK_SECONDS:
+        return
+    version = get_table_version(db, HISTORY_DELETIONS)
+    with _deletions_lock:
+        if _deletions["version"] is not None and version != _deletions["version"]:
+            download_cache.clear()
+        _deletions["version"] = version
+        _deletions["checked_at"] = now
+
+def _load_metadata(processing_id: str, db: Session):
+    processing_record = db.query(ProcessingHistory).filter(
+        ProcessingHistory.id == processing_id
+    ).first()
+
+    if not processing_record:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+
+    file_path = processed_file_path(processing_id, processing_record.filename)
+    stat_result = _stat_or_404(file_path)
+
+    # Registros anteriores a output_hash: se calcula una vez y queda en caché
+    output_hash = processing_record.output_hash or file_sha256(file_path)
+    return {
+        "path": file_path,
+        "filename": processing_record.filename,
+        "media_type": media_type_for(processing_record.filename),
+        "etag": f'"{output_hash}"',
+        "last_modified": datetime.fromtimestamp(int(stat_result.st_mtime), timezone.utc),
+        "stat_result": stat_result,
+    }
+
+def _still_valid(metadata: dict):
+    """Valida una entrada del caché contra el disco"""
+    try:
+        stat_result = os.stat(metadata["path"])
+    except FileNotFoundError:
+        return False
+    cached = metadata["stat_result"]
+    return (stat_result.st_size, stat_result.st_mtime_ns) == (cached.st_size, cached.st_mtime_ns)
+
+def get_download_metadata(processing_id: str, db: Session):
+    _check_deletions(db)
+    metadata = download_cache.get(processing_id)
+    if metadata is not None and not _still_valid(metadata):
+        download_cache.invalidate(processing_id)
+        metadata = None
+    if metadata is None:
+        metadata = _load_metadata(processing_id, db)
+        download_cache.set(processing_id, metadata)
+    return metadata
+
+def _etag_matches(if_none_match: str, etag: str):
+    if if_none_match.strip() == "*":
+        return True
+    # Comparación débil, como pide RFC 9110 para If-None-Match
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+def _not_modified(request: Request, metadata: dict):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, metadata["etag"])
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return metadata["last_modified"] <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def download_response(request: Request, processing_id: str, db: Session):
+    """Respuesta 200/206/304 para el archivo procesado de processing_id"""
+    metadata = get_download_metadata(processing_id, db)
+    headers = {
+        "ETag": metadata["etag"],
+        "Last-Modified": formatdate(metadata["last_modified"].timestamp(), usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+
+    if _not_modified(request, metadata):
+        return Response(status_code=304, headers=headers)
+
+    if DOWNLOAD_ACCEL_REDIRECT_PREFIX:
+        # nginx atiende el Range y envía el archivo con sendfile
+        headers["X-Accel-Redirect"] = DOWNLOAD_ACCEL_REDIRECT_PREFIX + os.path.basename(metadata["path"])
+        headers["Content-Disposition"] = f'attachment; filename="{metadata["filename"]}"'
+        return Response(status_code=200, headers=headers, media_type=metadata["media_type"])
+
+    return FileResponse(
+        path=metadata["path"],
+        filename=metadata["filename"],
+        media_type=metadata["media_type"],
+        headers=headers,
+        stat_result=metadata["stat_result"]
+    )
@@ -0,0 +1,226 @@
+"""Detección de pagos duplicados entre archivos procesados.
+
+Cada fila de una plantilla generada se registra en payment_index como
+(CLABE, monto en centavos, periodo "AAAA-MM"), con un índice compuesto sobre
+esas tres columnas.
+
+Al procesar un archivo nuevo, sus llaves se cargan en una tabla temporal y
+se cruzan con payment_index usando el índice, limitado a los periodos de la
+ventana: el actual y los DUPLICATE_LOOKBACK_PERIODS - 1 anteriores. No hay
+una consulta por fila, y el cruce se agrega en SQL (conteo y monto, filas
+por archivo anterior y una muestra con LIMIT): solo viajan a Python los
+totales y DUPLICATE_SAMPLE_ROWS llaves.
+
+La revisión es informativa: los posibles duplicados se reportan en la
+respuesta y en el historial, pero el archivo se procesa igual.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import bindparam, text
+from dotenv import load_dotenv
+
+from database import PaymentIndex, ProcessingHistory
+
+# Cargar variables de entorno
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_CHECK_ENABLED = os.getenv("DUPLICATE_CHECK_ENABLED", "true").lower() == "true"
+# Periodos mensuales que se revisan, incluyendo el actual
+DUPLICATE_LOOKBACK_PERIODS = int(os.getenv("DUPLICATE_LOOKBACK_PERIODS", "1"))
+# Filas de ejemplo que se guardan en el resumen
+DUPLICATE_SAMPLE_ROWS = int(os.getenv("DUPLICATE_SAMPLE_ROWS", "20"))
+
+_TEMP_TABLE = "tmp_payment_keys"
+
+def period_key(value: datetime):
+    return f"{value:%Y-%m}"
+
+def lookback_periods(now: datetime):
+    """Periodos "AAAA-MM" de la ventana de revisión, del actual hacia atrás"""
+    index = now.year * 12 + now.month - 1
+    return [f"{(i // 12):04d}-{(i % 12 + 1):02d}" for i in range(index, index - max(DUPLICATE_LOOKBACK_PERIODS, 1), -1)]
+
+def payment_keys(payments):
+    """Llaves (clabe, amount_cents) de las filas de la plantilla, más nombre y monto"""
+    keys = pd.DataFrame({
+        "nombre": payments["Nombre"].astype(str).values,
+        "clabe": payments["Clabe"].astype(str).values,
+        "monto": pd.to_numeric(payments["Monto"], errors="coerce").values,
+    })
+    keys = keys[(keys["clabe"] != "") & keys["monto"].notna()]
+    keys["amount_cents"] = (keys["monto"] * 100).round().astype("int64")
+    return keys
+
+def _is_mysql(connection):
+    return connection.dialect.name == "mysql"
+
+def _executemany(connection, statement: str, rows):
+    """executemany directo del driver: sin compilar parámetros por fila en SQLAlchemy"""
+    marker = "?" if connection.dialect.paramstyle == "qmark" else "%s"
+    connection.exec_driver_sql(statement.replace("?", marker), rows)
+
+def load_keys(connection, keys):
+    """Carga las llaves del archivo en la tabla temporal de la conexión"""
+    # Una tabla que quedó de un intento fallido en esta conexión del pool
+    drop_keys(connection)
+    connection.execute(text(
+        f"CREATE TEMPORARY TABLE {_TEMP_TABLE} (clabe VARCHAR(18) NOT NULL, amount_cents BIGINT NOT NULL)"
+    ))
+    if not keys.empty:
+        _executemany(
+            connection, f"INSERT INTO {_TEMP_TABLE} (clabe, amount_cents) VALUES (?, ?)",
+            list(zip(keys["clabe"], keys["amount_cents"].tolist()))
+        )
+
+def drop_keys(connection):
+    drop = "DROP TEMPORARY TABLE" if _is_mysql(connection) else "DROP TABLE"
+    connection.execute(text(f"{drop} IF EXISTS {_TEMP_TABLE}"))
+
+# Condición de cruce de una llave t con payment_index p dentro de la ventana
+_MATCH = ("p.clabe = t.clabe AND p.amount_cents = t.amount_cents "
+          "AND p.period IN :periods AND p.processing_id <> :processing_id")
+
+def _query(connection, sql: str, params: dict):
+    return connection.execute(text(sql).bindparams(bindparam("periods", expanding=True)), params)
+
+def find_matches(connection, periods, processing_id: str, sample_rows: int = DUPLICATE_SAMPLE_ROWS):
+    """Agrega en SQL el cruce de las llaves cargadas con payment_index.
+
+    Regresa (filas del archivo ya pagadas, su monto en centavos,
+    [(processing_id, filas)] de los archivos anteriores con más coincidencias,
+    DataFrame con hasta sample_rows llaves coincidentes y un procesamiento y
+    periodo de ejemplo).
+    """
+    params = {"periods": periods, "processing_id": processing_id, "limit": sample_rows}
+    # EXISTS recorre la tabla temporal y busca cada llave en ix_payment_index_lookup
+    rows, cents = _query(connection, (
+        f"SELECT COUNT(*), COALESCE(SUM(t.amount_cents), 0) FROM {_TEMP_TABLE} t "
+        f"WHERE EXISTS (SELECT 1 FROM payment_index p WHERE {_MATCH})"
+    ), params).one()
+    if not rows:
+        return 0, 0, [], pd.DataFrame(columns=["clabe", "amount_cents", "processing_id", "period"])
+
+    # CROSS JOIN fija el mismo orden en SQLite (tabla temporal primero)
+    distinct_keys = f"(SELECT DISTINCT clabe, amount_cents FROM {_TEMP_TABLE})"
+    per_file = _query(connection, (
+        f"SELECT p.processing_id, COUNT(*) AS matched FROM {distinct_keys} t CROSS JOIN payment_index p ON {_MATCH} "
+        f"GROUP BY p.processing_id ORDER BY matched DESC LIMIT :limit"
+    ), params).all()
+    # La muestra se detiene en las primeras llaves con coincidencia
+    first = "(SELECT p.{} FROM payment_index p WHERE " + _MATCH + " LIMIT 1)"
+    sample = _query(connection, (
+        f"SELECT DISTINCT t.clabe, t.amount_cents, {first.format('processing_id')}, {first.format('period')} "
+        f"FROM {_TEMP_TABLE} t WHERE EXISTS (SELECT 1 FROM payment_index p WHERE {_MATCH}) LIMIT :limit"
+    ), params).all()
+    return int(rows), int(cents), [(pid, int(count)) for pid, count in per_file], \
+        pd.DataFrame(sample, columns=["clabe", "amount_cents", "processing_id", "period"])
+
+def record_payments(connection, processing_id: str, period: str, now: datetime):
+    """Registra las llaves cargadas (reemplaza las de un intento anterior del mismo procesamiento)"""
+    connection.execute(PaymentIndex.__table__.delete().where(PaymentIndex.processing_id == processing_id))
+    # Ordenadas por la llave, las inserciones en el índice son casi secuenciales
+    connection.execute(text(
+        f"INSERT INTO payment_index (processing_id, clabe, amount_cents, period, created_at) "
+        f"SELECT :processing_id, clabe, amount_cents, :period, :now FROM {_TEMP_TABLE} "
+        f"ORDER BY clabe, amount_cents"
+    ), {"processing_id": processing_id, "period": period, "now": now})
+
+def _summarize(db, keys, matched, periods):
+    rows, cents, per_file, sample = matched
+    summary = {
+        "rows": rows,
+        "amount": round(cents / 100, 2),
+        "within_file_rows": int(keys.duplicated(["clabe", "amount_cents"], keep="first").sum()),
+        "lookback_periods": periods,
+        "previous": [],
+        "sample": [],
+    }
+    if not rows:
+        return summary
+
+    # Procesamientos anteriores que ya incluían esas llaves
+    names = dict(
+        db.query(ProcessingHistory.id, ProcessingHistory.original_filename)
+        .filter(ProcessingHistory.id.in_([pid for pid, _ in per_file])).all()
+    )
+    summary["previous"] = [
+        {"processing_id": pid, "original_filename": names.get(pid), "rows": count}
+        for pid, count in per_file
+    ]
+
+    # Filas del archivo (en su orden) de las llaves de la muestra
+    flagged = keys.merge(sample, on=["clabe", "amount_cents"]).head(DUPLICATE_SAMPLE_ROWS)
+    summary["sample"] = [
+        {
+            "nombre": row.nombre,
+            "clabe": row.clabe,
+            "monto": round(float(row.monto), 2),
+            "processing_id": row.processing_id,
+            "period": row.period,
+        }
+        for row in flagged.itertuples(index=False)
+    ]
+    return summary
+
+def check_and_record(db, processing_id: str, payments, now: datetime = None):
+    """Busca duplicados de payments en la ventana y registra sus llaves en payment_index.
+
+    Se ejecuta dentro de la transacción de db (el llamador hace commit y
+    guarda el resumen en el historial con apply_summary).
+    """
+    if not DUPLICATE_CHECK_ENABLED or payments is None:
+        return None
+    now = now or datetime.utcnow()
+    started = time.perf_counter()
+    keys = payment_keys(payments)
+    periods = lookback_periods(now)
+    connection = db.connection()
+
+    try:
+        load_keys(connection, keys)
+        # Primero la escritura: en SQLite una transacción que lee y luego escribe
+        # se bloquea con otra igual; find_matches excluye las filas propias
+        record_payments(connection, processing_id, period_key(now), now)
+        record_done = time.perf_counter()
+
+        matched = find_matches(connection, periods, processing_id)
+        summary = _summarize(db, keys, matched, periods)
+        check_done = time.perf_counter()
+    finally:
+        drop_keys(connection)
+
+    summary["timings"] = {
+        "record": round(record_done - started, 4),
+        "check": round(check_done - record_done, 4),
+    }
+    if summary["rows"]:
+        logger.warning(f"Posibles pagos duplicados en {processing_id}: {summary['rows']} filas "
+                       f"(${summary['amount']:,.2f}) ya procesadas en {len(summary['previous'])} archivo(s)")
+    return summary
+
+def safe_check_and_record(db, processing_id: str, payments, now: datetime = None):
+    """check_and_record sin propagar errores: la revisión no debe fallar el procesamiento"""
+    try:
+        return check_and_record(db, processing_id, payments, now)
+    except Exception as e:
+        logger.warning(f"No se pudo revisar duplicados de {processing_id}: {e}")
+        return None
+
+def apply_summary(record, summary):
+    """Guarda el resumen de la revisión en el registro de ProcessingHistory"""
+    if summary is None:
+        return
+    record.duplicate_rows = summary["rows"]
+    record.duplicate_summary = json.dumps(summary)
+
+def prune(db, before_period: str):
+    """Elimina del índice los periodos anteriores a before_period ("AAAA-MM")"""
+    deleted = db.query(PaymentIndex).filter(PaymentIndex.period < before_period).delete(synchronize_session=False)
+    db.commit()
+    return deleted
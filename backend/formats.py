@@ -0,0 +1,106 @@
+"""Detección del formato de los archivos de entrada por su contenido.
+
+La extensión del archivo no se usa para decidir cómo leerlo:
+
+- "xlsx": ZIP (PK\\x03\\x04), libro de Excel 2007+.
+- "xls": contenedor OLE2 (D0 CF 11 E0 A1 B1 1A E1), Excel 97-2003.
+- "csv": texto; la codificación y el separador (coma, punto y coma,
+  tabulador o barra) se detectan con sniff_text.
+
+Cualquier otro contenido solo se acepta como CSV si la muestra es texto:
+sin bytes nulos, decodificable sin errores en la codificación detectada y
+casi sin caracteres de control. Un PDF o una imagen regresan None (400 en
+la API) en lugar de llegar al parser de CSV.
+"""
+import codecs
+import csv
+import zipfile
+
+ZIP_MAGIC = b"PK\x03\x04"
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+# Bytes que lee la API para detect_format: firma binaria o muestra de texto
+MAGIC_BYTES = 8 * 1024
+TEXT_SAMPLE_BYTES = 64 * 1024
+# Firmas de formatos binarios comunes que no deben tratarse como texto
+BINARY_MAGICS = (b"%PDF-", b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"\x1f\x8b", b"Rar!", b"7z\xbc\xaf")
+# Caracteres de control tolerados en texto (\x1a: fin de archivo de exportaciones DOS)
+_TEXT_CONTROLS = set("\t\n\r\f\x1a")
+# Fracción máxima de otros caracteres de control en una muestra de texto
+MAX_CONTROL_RATIO = 0.01
+DELIMITERS = ",;\t|"
+
+SUPPORTED_FORMATS = ("xlsx", "xls", "csv")
+
+def _is_text(sample: bytes):
+    """La muestra se decodifica sin errores y casi no tiene caracteres de control"""
+    encoding = _detect_encoding(sample)
+    if not encoding.startswith("utf-16") and b"\x00" in sample:
+        # Un byte nulo fuera de UTF-16 indica un archivo binario
+        return False
+    try:
+        # final=False tolera un carácter multibyte cortado al final de la muestra
+        text = codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return False
+    if "\x00" in text:
+        return False
+    controls = sum(1 for char in text if (char < " " or char == "\x7f") and char not in _TEXT_CONTROLS)
+    return controls <= len(text) * MAX_CONTROL_RATIO
+
+def detect_format(head: bytes):
+    """Formato a partir de los primeros bytes del archivo, o None si no se reconoce"""
+    if head.startswith(ZIP_MAGIC):
+        return "xlsx"
+    if head.startswith(OLE2_MAGIC):
+        return "xls"
+    if not head or head.startswith(BINARY_MAGICS):
+        return None
+    return "csv" if _is_text(head) else None
+
+def sniff_format(path: str):
+    """Formato de un archivo en disco; valida que un ZIP sea de verdad un libro de Excel"""
+    with open(path, "rb") as f:
+        head = f.read(TEXT_SAMPLE_BYTES)
+    file_format = detect_format(head)
+    if file_format is None:
+        raise ValueError("Formato de archivo no reconocido: se esperaba Excel (.xlsx, .xls) o CSV")
+    if file_format == "xlsx":
+        try:
+            with zipfile.ZipFile(path) as archive:
+                is_workbook = "xl/workbook.xml" in archive.namelist()
+        except zipfile.BadZipFile:
+            is_workbook = False
+        if not is_workbook:
+            raise ValueError("El archivo no es un libro de Excel válido")
+    return file_format
+
+def _detect_encoding(sample: bytes):
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        # final=False tolera un carácter multibyte cortado al final de la muestra
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        # Exportaciones "ANSI" de Excel en Windows
+        return "cp1252"
+
+def _detect_delimiter(text: str):
+    lines = [line for line in text.splitlines()[:50] if line.strip()]
+    try:
+        return csv.Sniffer().sniff("\n".join(lines), delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        # Sin patrón consistente: el separador más frecuente
+        counts = {d: sum(line.count(d) for line in lines) for d in DELIMITERS}
+        best = max(counts, key=counts.get)
+        return best if counts[best] else ","
+
+def sniff_text(path: str):
+    """Regresa (codificación, separador, muestra decodificada) de un archivo de texto"""
+    with open(path, "rb") as f:
+        sample = f.read(TEXT_SAMPLE_BYTES)
+    encoding = _detect_encoding(sample)
+    text = sample.decode(encoding, errors="replace")
+    return encoding, _detect_delimiter(text), text
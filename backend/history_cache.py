@@ -0,0 +1,45 @@
+"""Respuestas cacheables del historial de procesamiento.
+
+El ETag de cada respuesta combina la versión de processing_history (tabla
+table_versions, una lectura por llave primaria) con los parámetros de la
+consulta. Si el cliente manda un If-None-Match vigente se responde 304 sin
+ejecutar la consulta; si no, se sirve desde un caché LRU en memoria y solo
+se consulta la base de datos cuando la versión cambió.
+"""
+import hashlib
+import json
+import os
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from cache import LRUCache
+from database import get_table_version
+
+# Cargar variables de entorno
+load_dotenv()
+
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "256"))
+HISTORY_TABLE = "processing_history"
+# Versión que solo cambia cuando se eliminan registros de la tabla viva (archive.py)
+HISTORY_DELETIONS = "processing_history_deletions"
+
+history_cache = LRUCache(HISTORY_CACHE_SIZE)
+
+def cached_history_response(request: Request, db: Session, build):
+    """Regresa 304, la respuesta en caché o la construye llamando build()"""
+    version = get_table_version(db, HISTORY_TABLE)
+    key = f"{request.url.path}?{request.url.query}"
+    etag = f'"{version}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    body = history_cache.get((key, version))
+    if body is None:
+        body = json.dumps(jsonable_encoder(build()), ensure_ascii=False).encode("utf-8")
+        history_cache.set((key, version), body)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,142 @@
+"""Intermedios columnares del DataFrame limpio, por processing_id.
+
+process_excel_file guarda aquí el resultado de la limpieza para que
+/processing/{id}/render genere otras salidas (concepto, anchos, formato)
+sin volver a leer el Excel de origen.
+
+El formato es Feather (Arrow IPC comprimido con zstd). Las columnas object
+(p. ej. nombres numéricos y de texto mezclados) se guardan como texto, que
+es como las escribe cualquier salida. Sin pyarrow, o si Arrow no puede
+escribir el DataFrame, no se guarda intermedio y el render lo reconstruye
+desde la plantilla generada: nunca se usa pickle, que no es columnar y no
+es seguro de leer desde un directorio compartido. Los archivos viven en
+INTERMEDIATES_DIR, que puede compartirse entre réplicas y workers. La fecha
+de modificación hace de marca de último uso: al guardar se desalojan los
+menos usados hasta quedar dentro de INTERMEDIATES_MAX_BYTES e
+INTERMEDIATES_MAX_FILES.
+"""
+import logging
+import os
+import threading
+import pandas as pd
+from dotenv import load_dotenv
+
+try:
+    import pyarrow
+except ImportError:  # pyarrow es opcional: sin él no hay intermedios
+    pyarrow = None
+
+FORMAT_EXTENSION = ".arrow"
+# Intermedios de versiones anteriores: no se leen y el desalojo los elimina
+LEGACY_EXTENSIONS = (".pkl",)
+
+# Cargar variables de entorno
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INTERMEDIATES_DIR = os.getenv("INTERMEDIATES_DIR", "intermediates")
+INTERMEDIATES_MAX_BYTES = int(os.getenv("INTERMEDIATES_MAX_BYTES", str(1024 * 1024 * 1024)))
+INTERMEDIATES_MAX_FILES = int(os.getenv("INTERMEDIATES_MAX_FILES", "500"))
+
+def intermediate_path(processing_id: str):
+    return os.path.join(INTERMEDIATES_DIR, f"{processing_id}{FORMAT_EXTENSION}")
+
+def _columnar(df):
+    """Copia de df que Arrow puede escribir: índice simple y columnas object como texto"""
+    df = df.reset_index(drop=True)
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].astype(str)
+    return df
+
+def save_intermediate(processing_id: str, df):
+    """Guarda el DataFrame limpio y desaloja los intermedios menos usados.
+
+    Regresa la ruta, o None si no se guardó (sin pyarrow o si Arrow falló).
+    """
+    if pyarrow is None:
+        return None
+    os.makedirs(INTERMEDIATES_DIR, exist_ok=True)
+    path = intermediate_path(processing_id)
+    # Temporal único: dos escritores del mismo id (p. ej. un worker que perdió el lease) no se pisan
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        _columnar(df).to_feather(temp_path, compression="zstd")
+        os.replace(temp_path, path)
+    except BaseException as e:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        if isinstance(e, (pyarrow.ArrowException, TypeError, ValueError)):
+            logger.warning(f"No se guardó el intermedio de {processing_id}: {e}")
+            return None
+        raise
+    evict()
+    return path
+
+def load_intermediate(processing_id: str):
+    """Regresa el DataFrame limpio de processing_id, o None si no existe"""
+    if pyarrow is None:
+        return None
+    path = intermediate_path(processing_id)
+    try:
+        df = pd.read_feather(path)
+        # Marca de uso para el desalojo LRU
+        os.utime(path)
+    except FileNotFoundError:
+        # No existe o se desalojó mientras se leía: se trata como ausente
+        return None
+    return df
+
+def _entries():
+    """(mtime, tamaño, ruta) de los intermedios; ignora los que desaparecen al leerlos"""
+    entries = []
+    with os.scandir(INTERMEDIATES_DIR) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(FORMAT_EXTENSION):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Desalojado por otro proceso
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def evict():
+    """Elimina los intermedios menos usados hasta respetar los límites"""
+    with os.scandir(INTERMEDIATES_DIR) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(LEGACY_EXTENSIONS):
+                _remove(entry.path)
+    entries = sorted(_entries())
+    total_bytes = sum(size for _, size, _ in entries)
+    count = len(entries)
+    for _, size, path in entries:
+        if total_bytes <= INTERMEDIATES_MAX_BYTES and count <= INTERMEDIATES_MAX_FILES:
+            break
+        _remove(path)
+        total_bytes -= size
+        count -= 1
+        logger.debug(f"Intermedio desalojado: {path}")
+
+def stats():
+    enabled = pyarrow is not None
+    if not os.path.isdir(INTERMEDIATES_DIR):
+        return {"files": 0, "bytes": 0, "format": FORMAT_EXTENSION, "enabled": enabled}
+    sizes = [size for _, size, _ in _entries()]
+    return {
+        "files": len(sizes),
+        "bytes": sum(sizes),
+        "max_bytes": INTERMEDIATES_MAX_BYTES,
+        "max_files": INTERMEDIATES_MAX_FILES,
+        "format": FORMAT_EXTENSION,
+        "enabled": enabled,
+    }
@@ -0,0 +1,152 @@
+"""Procesos hijos para los trabajos inline de la API.
+
+Con PROCESSING_MODE=inline la API procesa las subidas ella misma. El RSS que
+mide MemoryBudget es del proceso, así que en el pool de hilos de la API no
+se puede abortar un trabajo sin afectar a los demás. Por eso cada trabajo
+corre en un proceso hijo propio (max_tasks_per_child=1) con
+enforce_budgets() activo: JOB_MEMORY_LIMIT_MB se mide y se aplica por
+trabajo, igual que en el worker y en el watcher, y la memoria del trabajo se
+devuelve al sistema cuando el hijo termina.
+
+Los hijos salen de un forkserver que ya importó pipeline, así que arrancar
+un trabajo cuesta un fork y no una importación de pandas. El progreso vuelve
+por una cola y un hilo de la API lo entrega al callback de cada trabajo. Si
+un hijo muere sin responder (p. ej. el OOM killer antes del siguiente
+muestreo), el pool se recrea y fallan solo los trabajos en curso.
+
+Con INLINE_JOB_PROCESSES=0 los trabajos corren en hilos de la API, sin
+límite de memoria.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+
+from memory_budget import enforce_budgets
+from logging_config import setup_logging
+
+# Cargar variables de entorno
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Procesos hijos simultáneos; 0 procesa en hilos de la API
+INLINE_JOB_PROCESSES = int(os.getenv("INLINE_JOB_PROCESSES", os.getenv("MAX_CONCURRENT_JOBS", "2")))
+
+# Cola de progreso en el proceso hijo (la fija _init_child)
+_progress_queue = None
+
+class JobProcessDied(Exception):
+    """El proceso hijo del trabajo terminó sin regresar un resultado"""
+
+def _init_child(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+    setup_logging()
+    enforce_budgets()
+
+class QueueProgress:
+    """Callback de progreso que viaja al hijo y reporta por la cola del pool"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+
+    def __call__(self, stage: str, **counts):
+        _progress_queue.put((self.job_id, stage, counts))
+
+def _get_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["pipeline", "profiling"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+class JobProcessPool:
+    """Ejecuta cada trabajo en un proceso hijo nuevo, con límite de memoria.
+
+        progress = pool.progress(job_id, job_registry.progress_callback(job_id))
+        result = pool.run(job_id, process_excel_file, input_path, output_path, progress)
+
+    run es bloqueante (usar run_in_threadpool) y sus argumentos deben poder
+    serializarse con pickle.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._context = None
+        self._queue = None
+        # job_id -> callback de progreso en la API
+        self._callbacks = {}
+
+    @property
+    def isolated(self):
+        return self.max_workers > 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self._context is None:
+                    self._context = _get_context()
+                    self._queue = self._context.SimpleQueue()
+                    threading.Thread(target=self._deliver_progress, daemon=True, name="job-progress").start()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=self._context,
+                    initializer=_init_child,
+                    initargs=(self._queue,),
+                    max_tasks_per_child=1,
+                )
+            return self._executor
+
+    def _deliver_progress(self):
+        while True:
+            job_id, stage, counts = self._queue.get()
+            # Bajo el candado: después de que run termina ya no llega progreso viejo
+            with self._lock:
+                callback = self._callbacks.get(job_id)
+                if callback is None:
+                    continue
+                try:
+                    callback(stage, **counts)
+                except Exception as e:
+                    logger.warning(f"No se pudo reportar el progreso de {job_id}: {e}")
+
+    def progress(self, job_id: str, callback):
+        """Callback de progreso para pasar a la función del trabajo"""
+        if not self.isolated:
+            return callback
+        with self._lock:
+            self._callbacks[job_id] = callback
+        return QueueProgress(job_id)
+
+    def run(self, job_id: str, func, *args):
+        """Ejecuta func(*args) en un proceso hijo y regresa su resultado"""
+        if not self.isolated:
+            return func(*args)
+        try:
+            executor = self._get_executor()
+            try:
+                return executor.submit(func, *args).result()
+            except BrokenProcessPool as e:
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False)
+                logger.error(f"El proceso del trabajo {job_id} terminó inesperadamente: {e}")
+                raise JobProcessDied(
+                    "El proceso del trabajo terminó inesperadamente; es posible que el archivo "
+                    "haya agotado la memoria disponible"
+                ) from e
+        finally:
+            with self._lock:
+                self._callbacks.pop(job_id, None)
+
+    def stats(self):
+        return {"processes": self.max_workers, "isolated": self.isolated}
+
+inline_jobs = JobProcessPool(INLINE_JOB_PROCESSES)
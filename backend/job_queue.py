@@ -0,0 +1,200 @@
+"""Cola de trabajos de procesamiento respaldada por la base de datos.
+
+Cualquier número de workers (worker.py) puede reclamar trabajos de la tabla
+processing_jobs. En MySQL el reclamo usa SELECT ... FOR UPDATE SKIP LOCKED;
+en SQLite, que no tiene bloqueo de filas, la actualización condicional del
+reclamo garantiza que solo un worker gane cada trabajo.
+
+Cada trabajo reclamado tiene un lease que el worker renueva con heartbeats.
+Si el worker muere, el lease expira y otro worker lo vuelve a tomar. Los
+fallos se reintentan con backoff exponencial y, al agotar los intentos, el
+trabajo queda en estado "dead".
+
+Las transiciones finales (complete, fail, dead_letter) están cercadas por el
+lease: solo se aplican si el trabajo sigue en "running" con locked_by del
+mismo worker. Un worker que perdió el lease recibe LeaseLost y no toca el
+estado del nuevo dueño.
+"""
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_, func
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import ProcessingJob, ProcessingHistory, bump_table_version
+from history_cache import HISTORY_TABLE
+from duplicates import safe_check_and_record, apply_summary
+
+# Cargar variables de entorno
+load_dotenv()
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+
+class LeaseLost(Exception):
+    """El trabajo ya no pertenece al worker (su lease expiró y otro lo reclamó)"""
+
+def enqueue(db: Session, processing_id: str, input_path: str, original_filename: str, output_filename: str,
+            output_mode: str = "single", output_format: str = "xlsx", profile: bool = False):
+    """Agrega un trabajo a la cola; el commit queda a cargo del llamador"""
+    job = ProcessingJob(
+        id=processing_id,
+        status="queued",
+        input_path=input_path,
+        original_filename=original_filename,
+        output_filename=output_filename,
+        output_mode=output_mode,
+        output_format=output_format,
+        profile=profile,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        available_at=datetime.utcnow(),
+    )
+    db.add(job)
+    return job
+
+def _claimable(now: datetime):
+    return or_(
+        and_(ProcessingJob.status == "queued", ProcessingJob.available_at <= now),
+        # Trabajos de un worker que dejó de enviar heartbeats
+        and_(ProcessingJob.status == "running", ProcessingJob.lease_expires_at < now),
+    )
+
+def claim_next(db: Session, worker_id: str):
+    """Reclama el siguiente trabajo disponible para worker_id, o regresa None"""
+    now = datetime.utcnow()
+    candidate = db.query(ProcessingJob.id).filter(_claimable(now)) \
+        .order_by(ProcessingJob.available_at) \
+        .limit(1) \
+        .with_for_update(skip_locked=True) \
+        .first()
+    if candidate is None:
+        db.rollback()
+        return None
+
+    claimed = db.query(ProcessingJob).filter(
+        ProcessingJob.id == candidate.id,
+        _claimable(now)
+    ).update({
+        ProcessingJob.status: "running",
+        ProcessingJob.locked_by: worker_id,
+        ProcessingJob.attempts: ProcessingJob.attempts + 1,
+        ProcessingJob.lease_expires_at: now + timedelta(seconds=JOB_LEASE_SECONDS),
+        ProcessingJob.heartbeat_at: now,
+    }, synchronize_session=False)
+    db.commit()
+    if not claimed:
+        # Otro worker lo reclamó primero
+        return None
+
+    job = db.query(ProcessingJob).filter(ProcessingJob.id == candidate.id).first()
+    if job.attempts > job.max_attempts:
+        # Reclamado por lease expirado después de agotar los intentos
+        try:
+            dead_letter(db, job, worker_id, job.last_error or "El worker dejó de responder")
+        except LeaseLost:
+            pass
+        return None
+    return job
+
+def heartbeat(db: Session, job_id: str, worker_id: str):
+    """Extiende el lease; regresa False si el trabajo ya no pertenece al worker"""
+    now = datetime.utcnow()
+    renewed = db.query(ProcessingJob).filter(
+        ProcessingJob.id == job_id,
+        ProcessingJob.locked_by == worker_id,
+        ProcessingJob.status == "running"
+    ).update({
+        ProcessingJob.lease_expires_at: now + timedelta(seconds=JOB_LEASE_SECONDS),
+        ProcessingJob.heartbeat_at: now,
+    }, synchronize_session=False)
+    db.commit()
+    return bool(renewed)
+
+def _release(db: Session, job: ProcessingJob, worker_id: str, values: dict):
+    """Aplica values al trabajo solo si worker_id aún tiene su lease; si no, LeaseLost.
+
+    La actualización queda en la transacción de db: el llamador hace commit
+    (o rollback) junto con los cambios al historial.
+    """
+    released = db.query(ProcessingJob).filter(
+        ProcessingJob.id == job.id,
+        ProcessingJob.locked_by == worker_id,
+        ProcessingJob.status == "running"
+    ).update(values, synchronize_session=False)
+    if not released:
+        db.rollback()
+        raise LeaseLost(f"El trabajo {job.id} ya no pertenece a {worker_id}")
+    db.refresh(job)
+
+def complete(db: Session, job: ProcessingJob, worker_id: str, result: dict, processing_time: float, publish=None):
+    """Marca el trabajo como completado y actualiza el historial.
+
+    publish() se llama con el lease ya cercado y antes del commit (p. ej. para
+    mover la salida a su ruta final); si falla, no se hace commit.
+    """
+    _release(db, job, worker_id, {
+        ProcessingJob.status: "completed",
+        ProcessingJob.locked_by: None,
+        ProcessingJob.lease_expires_at: None,
+    })
+    if publish is not None:
+        try:
+            publish()
+        except Exception:
+            db.rollback()
+            raise
+    record = db.query(ProcessingHistory).filter(ProcessingHistory.id == job.id).first()
+    if record:
+        record.processed_filename = job.output_filename
+        record.rows_processed = result["rows"]
+        record.total_amount = result["total_amount"]
+        record.output_hash = result.get("output_hash")
+        record.profile_filename = result.get("profile_filename")
+        record.processing_time = processing_time
+        record.processing_status = "completed"
+        record.error_message = None
+        apply_summary(record, safe_check_and_record(db, job.id, result.get("payments")))
+        bump_table_version(db, HISTORY_TABLE)
+    db.commit()
+
+def retry_delay(attempts: int):
+    """Backoff exponencial: base, 2*base, 4*base... hasta JOB_RETRY_MAX_SECONDS"""
+    return min(JOB_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), JOB_RETRY_MAX_SECONDS)
+
+def fail(db: Session, job: ProcessingJob, worker_id: str, error: str):
+    """Programa un reintento o manda el trabajo a dead-letter si agotó sus intentos"""
+    if job.attempts >= job.max_attempts:
+        dead_letter(db, job, worker_id, error)
+        return
+    _release(db, job, worker_id, {
+        ProcessingJob.status: "queued",
+        ProcessingJob.locked_by: None,
+        ProcessingJob.lease_expires_at: None,
+        ProcessingJob.last_error: error,
+        ProcessingJob.available_at: datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts)),
+    })
+    record = db.query(ProcessingHistory).filter(ProcessingHistory.id == job.id).first()
+    if record:
+        record.error_message = error
+    db.commit()
+
+def dead_letter(db: Session, job: ProcessingJob, worker_id: str, error: str):
+    _release(db, job, worker_id, {
+        ProcessingJob.status: "dead",
+        ProcessingJob.locked_by: None,
+        ProcessingJob.lease_expires_at: None,
+        ProcessingJob.last_error: error,
+    })
+    record = db.query(ProcessingHistory).filter(ProcessingHistory.id == job.id).first()
+    if record:
+        record.processing_status = "failed"
+        record.error_message = error
+        bump_table_version(db, HISTORY_TABLE)
+    db.commit()
+
+def queue_stats(db: Session):
+    """Número de trabajos por estado"""
+    rows = db.query(ProcessingJob.status, func.count(ProcessingJob.id)).group_by(ProcessingJob.status).all()
+    return {status: count for status, count in rows}
@@ -0,0 +1,119 @@
+"""Registro en memoria del avance de los trabajos de procesamiento.
+
+El pipeline corre en un hilo del threadpool y reporta su avance con
+JobRegistry.report; el endpoint SSE /jobs/{id}/events espera cambios con
+JobRegistry.wait sin bloquear el event loop.
+"""
+import asyncio
+import threading
+import time
+
+# Segundos que se conserva el estado de un trabajo terminado
+JOB_RETENTION_SECONDS = 300
+
+FINAL_STAGES = ("completed", "failed")
+
+class JobState:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.data = {"job_id": job_id, "stage": "pending", "rows_read": 0, "rows_written": 0}
+        self.version = 0
+        self.created_at = time.monotonic()
+        self.finished_at = None
+        self.waiters = set()
+
+class JobRegistry:
+    def __init__(self):
+        self._jobs = {}
+        # job_id líder -> ids que reciben sus mismas actualizaciones
+        self._links = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, job_id: str):
+        state = self._jobs.get(job_id)
+        if state is None:
+            state = self._jobs[job_id] = JobState(job_id)
+        return state
+
+    def _purge(self):
+        now = time.monotonic()
+        for job_id, state in list(self._jobs.items()):
+            # Terminados hace tiempo, o consultados pero nunca iniciados
+            reference = state.finished_at or (state.created_at if state.version == 0 else None)
+            if reference and now - reference > JOB_RETENTION_SECONDS and not state.waiters:
+                del self._jobs[job_id]
+
+    def report(self, job_id: str, stage: str, **fields):
+        """Actualiza el estado del trabajo; se puede llamar desde cualquier hilo"""
+        waiters = []
+        with self._lock:
+            linked = self._links.pop(job_id, set()) if stage in FINAL_STAGES else self._links.get(job_id, ())
+            for target in (job_id, *linked):
+                state = self._get_or_create(target)
+                state.data.update(fields, stage=stage)
+                state.version += 1
+                if stage in FINAL_STAGES:
+                    state.finished_at = time.monotonic()
+                waiters.extend(state.waiters)
+            if stage in FINAL_STAGES:
+                self._purge()
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def reserve(self, job_id: str):
+        """Marca job_id como recibido; False si ya tiene un trabajo reportado"""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is not None and state.version > 0:
+                return False
+        self.report(job_id, "received")
+        return True
+
+    def link(self, job_id: str, leader_id: str):
+        """job_id recibe desde ahora el avance de leader_id (subidas combinadas)"""
+        if job_id == leader_id:
+            return
+        with self._lock:
+            leader = self._get_or_create(leader_id)
+            state = self._get_or_create(job_id)
+            state.data.update({k: v for k, v in leader.data.items() if k != "job_id"}, coalesced_with=leader_id)
+            state.version += 1
+            waiters = list(state.waiters)
+            if leader.finished_at is None:
+                self._links.setdefault(leader_id, set()).add(job_id)
+            else:
+                state.finished_at = time.monotonic()
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def progress_callback(self, job_id: str):
+        """Callback para pipeline.process_excel_file asociado a job_id"""
+        def callback(stage: str, **counts):
+            self.report(job_id, stage, **counts)
+        return callback
+
+    def snapshot(self, job_id: str):
+        with self._lock:
+            if job_id not in self._jobs:
+                self._purge()
+            state = self._get_or_create(job_id)
+            return state.version, dict(state.data)
+
+    async def wait(self, job_id: str, version: int, timeout: float):
+        """Espera a que el trabajo cambie después de version o a que pase timeout"""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            state = self._get_or_create(job_id)
+            if state.version != version:
+                return
+            state.waiters.add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                state.waiters.discard(waiter)
+
+job_registry = JobRegistry()
@@ -0,0 +1,194 @@
+"""Formatos de salida de texto para bancos: CSV y ancho fijo (estilo SPEI).
+
+Cada formato se define de forma declarativa en LAYOUTS: campos con su
+origen (columna del DataFrame limpio, consecutivo o valor fijo), ancho,
+relleno, alineación y formato de monto, más registros de encabezado y de
+cierre que pueden usar {count}, {total}, {total_cents} y {date}.
+
+Los campos se calculan sobre columnas completas con operaciones
+vectorizadas de pandas y el archivo se escribe por bloques de
+WRITE_CHUNK_ROWS filas, sin pasar por openpyxl.
+
+Los campos numéricos ("numeric": true: consecutivo, CLABE, centavos,
+conteos) nunca se recortan: un valor negativo, con caracteres no numéricos o
+más largo que el campo lanza LayoutValidationError en lugar de generar un
+archivo de banco con montos alterados. Los campos de texto sí se recortan.
+
+OUTPUT_LAYOUTS_FILE puede apuntar a un JSON con formatos adicionales (o que
+reemplacen a los incluidos) con la misma estructura.
+"""
+import json
+import os
+from datetime import datetime
+import pandas as pd
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+OUTPUT_LAYOUTS_FILE = os.getenv("OUTPUT_LAYOUTS_FILE", "")
+WRITE_CHUNK_ROWS = 50000
+
+# Relleno numérico: consecutivos, CLABE y montos en centavos
+_ZERO_RIGHT = {"align": "right", "pad": "0", "numeric": True}
+
+class LayoutValidationError(ValueError):
+    """Un valor no cabe en su campo numérico de ancho fijo o es inválido"""
+
+LAYOUTS = {
+    "csv": {
+        "type": "delimited",
+        "extension": ".csv",
+        "encoding": "utf-8",
+        "line_ending": "\r\n",
+        "delimiter": ",",
+        "header": ["Nombre", "Clabe", "Monto", "Concepto"],
+        "fields": [
+            {"source": "Nombre"},
+            {"source": "Clabe"},
+            {"source": "Monto", "format": "amount"},
+            {"source": "Concepto"},
+        ],
+    },
+    # Lote de ancho fijo: H (fecha, registros, total), D por pago, T de control
+    "spei_fixed": {
+        "type": "fixed",
+        "extension": ".txt",
+        "encoding": "ascii",
+        "line_ending": "\r\n",
+        "header": [
+            {"value": "H"},
+            {"value": "{date}", "width": 8},
+            {"value": "{count}", "width": 7, **_ZERO_RIGHT},
+            {"value": "{total_cents}", "width": 18, **_ZERO_RIGHT},
+        ],
+        "fields": [
+            {"value": "D"},
+            {"source": "_seq", "width": 7, **_ZERO_RIGHT},
+            {"source": "Clabe", "width": 18, **_ZERO_RIGHT},
+            {"source": "Monto", "format": "cents", "width": 15, **_ZERO_RIGHT},
+            {"source": "Nombre", "width": 40, "transform": "upper_ascii"},
+            {"source": "Concepto", "width": 40, "transform": "upper_ascii"},
+        ],
+        "trailer": [
+            {"value": "T"},
+            {"value": "{count}", "width": 7, **_ZERO_RIGHT},
+            {"value": "{total_cents}", "width": 18, **_ZERO_RIGHT},
+        ],
+    },
+}
+
+def _load_layouts_file(path: str):
+    with open(path, encoding="utf-8") as f:
+        extra = json.load(f)
+    for name, layout in extra.items():
+        if layout.get("type") not in ("delimited", "fixed") or not layout.get("fields"):
+            raise ValueError(f"Formato de salida inválido en {path}: {name}")
+    LAYOUTS.update(extra)
+
+if OUTPUT_LAYOUTS_FILE:
+    _load_layouts_file(OUTPUT_LAYOUTS_FILE)
+
+def layout_extension(name: str):
+    return LAYOUTS[name]["extension"]
+
+def _upper_ascii(values):
+    return values.str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii").str.upper()
+
+def _field_label(field):
+    return field.get("source") or str(field.get("value")).strip("{}")
+
+def _check_numeric(values, field, width):
+    """Valida un campo numérico de ancho fijo: solo dígitos y sin exceder el ancho"""
+    invalid = ~values.str.fullmatch(r"\d+") | (values.str.len() > width)
+    if invalid.any():
+        examples = ", ".join(values[invalid].head(3))
+        raise LayoutValidationError(
+            f"El campo {_field_label(field)} ({width} posiciones) tiene {int(invalid.sum())} valor(es) "
+            f"negativos, no numéricos o demasiado largos: {examples}"
+        )
+
+def _fit(values, field):
+    """Rellena al ancho del campo (solo formatos de ancho fijo); recorta solo texto"""
+    width = field.get("width")
+    if not width:
+        return values
+    if field.get("numeric"):
+        _check_numeric(values, field, width)
+    else:
+        values = values.str[:width]
+    pad = field.get("pad", " ")
+    if field.get("align", "left") == "right":
+        return values.str.rjust(width, pad)
+    return values.str.ljust(width, pad)
+
+def _column_values(chunk, field, first_seq: int):
+    source = field["source"]
+    if source == "_seq":
+        values = pd.Series(range(first_seq, first_seq + len(chunk)), index=chunk.index).astype(str)
+    else:
+        column = chunk[source]
+        number_format = field.get("format", "text")
+        if number_format == "cents":
+            values = (column * 100).round().astype("int64").astype(str)
+        elif number_format == "amount":
+            values = column.map(f"{{:.{field.get('decimals', 2)}f}}".format)
+        else:
+            values = column.astype(str)
+    if field.get("transform") == "upper_ascii":
+        values = _upper_ascii(values)
+    return values
+
+def _quote(values, delimiter: str):
+    needs_quotes = values.str.contains(f'["\\n\\r{delimiter}]', regex=True)
+    if needs_quotes.any():
+        values = values.where(~needs_quotes, '"' + values.str.replace('"', '""') + '"')
+    return values
+
+def _render_record(fields, layout, context):
+    """Encabezado o cierre: una sola línea con los valores de context"""
+    if layout["type"] == "delimited":
+        return layout["delimiter"].join(str(value).format(**context) for value in fields)
+    parts = []
+    for field in fields:
+        value = pd.Series([str(field["value"]).format(**context)])
+        parts.append(_fit(value, field).iloc[0])
+    return "".join(parts)
+
+def write_layout(df_clean, output_path: str, name: str, progress=None):
+    """Escribe df_clean en output_path con el formato name, por bloques"""
+    layout = LAYOUTS[name]
+    delimiter = layout.get("delimiter", "")
+    line_ending = layout.get("line_ending", "\n")
+    amounts = df_clean["Monto"]
+    context = {
+        "count": len(df_clean),
+        "total": f"{float(amounts.sum()):.2f}",
+        "total_cents": int((amounts * 100).round().sum()),
+        "date": datetime.now().strftime("%Y%m%d"),
+    }
+
+    with open(output_path, "w", encoding=layout.get("encoding", "utf-8"), errors="replace", newline="") as f:
+        if layout.get("header"):
+            f.write(_render_record(layout["header"], layout, context) + line_ending)
+
+        for start in range(0, len(df_clean), WRITE_CHUNK_ROWS):
+            chunk = df_clean.iloc[start:start + WRITE_CHUNK_ROWS]
+            lines = None
+            for field in layout["fields"]:
+                if "source" in field:
+                    values = _column_values(chunk, field, start + 1)
+                    values = _fit(values, field) if layout["type"] == "fixed" else _quote(values, delimiter)
+                else:
+                    values = _fit(pd.Series([str(field["value"])]), field).iloc[0]
+                if lines is None:
+                    lines = values if isinstance(values, pd.Series) else pd.Series(values, index=chunk.index)
+                else:
+                    lines = lines + delimiter + values
+            if lines is not None and len(lines):
+                f.write(line_ending.join(lines) + line_ending)
+            if progress:
+                progress("writing", rows_written=min(start + WRITE_CHUNK_ROWS, len(df_clean)))
+
+        if layout.get("trailer"):
+            f.write(_render_record(layout["trailer"], layout, context) + line_ending)
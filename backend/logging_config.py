@@ -0,0 +1,134 @@
+"""Configuración de logging no bloqueante para la API y los procesos auxiliares.
+
+Los registros se encolan con un QueueHandler y un QueueListener los escribe
+desde su propio hilo, de modo que el event loop nunca espera al I/O de logs.
+
+Variables de entorno:
+    LOG_LEVEL               nivel raíz (INFO por defecto)
+    LOG_LEVELS              niveles por logger, p. ej. "sqlalchemy.engine=WARNING,pipeline=DEBUG"
+    LOG_FORMAT              "json" (por defecto) o "text"
+    LOG_DEBUG_SAMPLE_RATE   fracción de registros DEBUG que se conservan (1.0 = todos)
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+# Atributos propios de LogRecord; el resto se considera contexto estructurado (extra=)
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea con el contexto pasado en extra="""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DebugSamplingFilter(logging.Filter):
+    """Conserva solo una fracción de los registros DEBUG de alto volumen"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+class _StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no formatea en el hilo que registra.
+
+    El QueueHandler estándar formatea el mensaje antes de encolarlo; aquí solo
+    se resuelven los argumentos y el formateo JSON queda en el listener. Como
+    en el estándar, se modifica una copia: otros handlers del mismo registro
+    conservan exc_info y los argumentos.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def parse_levels(spec: str):
+    """Convierte "a=INFO,b.c=DEBUG" en {"a": "INFO", "b.c": "DEBUG"}"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+_listener = None
+
+def setup_logging():
+    """Instala el handler asíncrono en el logger raíz; llamar una vez por proceso"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    # SQLAlchemy registra cada sentencia en INFO; por defecto solo advertencias,
+    # salvo que ya tenga nivel (SQL_ECHO=true) o que LOG_LEVELS indique otro
+    sqlalchemy_logger = logging.getLogger("sqlalchemy.engine")
+    if sqlalchemy_logger.level == logging.NOTSET:
+        sqlalchemy_logger.setLevel(logging.WARNING)
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Vacía la cola de logs; se llama automáticamente al salir"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
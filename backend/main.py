@@ -1,30 +1,52 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, Response, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-import pandas as pd
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
 from datetime import datetime, timedelta
 import tempfile
 import os
 import shutil
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 # Removed JWT and password context imports
 from pydantic import BaseModel
 from sqlalchemy import or_, desc, asc
 import logging
+import json
+import asyncio
 import uuid 
 import time
 from sqlalchemy.orm import Session
-from database import get_db, create_tables, test_connection, User, ProcessingHistory
+from database import get_db, SessionLocal, create_tables, test_connection, bump_table_version, User, ProcessingHistory, ProcessingJob
+from layouts import LayoutValidationError
+from pipeline import process_excel_file, render_output, output_formats, output_extension, OUTPUT_MODES, OUTPUT_HEADERS, AMOUNT_FORMAT, DEFAULT_OUTPUT_FORMAT
+from storage import PROCESSED_FILES_DIR, UPLOADS_DIR, processed_file_path, upload_file_path, reconciliation_file_path, save_stream, file_sha256, UploadTooLarge
+from admission import upload_admission
+from singleflight import upload_flights
+from jobs import job_registry, FINAL_STAGES
+import job_queue
+from profiling import PROFILES_DIR, profiling_requested, run_profiled
+from downloads import download_response, download_cache
+from history_cache import cached_history_response, history_cache, HISTORY_TABLE
+from compression import CompressionMiddleware
+import archive
+from bundles import select_bundle_records, stream_bundle
+from reconciliation import reconcile_files, read_dispersion
+from intermediates import load_intermediate, save_intermediate
+from formats import detect_format, MAGIC_BYTES
+from duplicates import safe_check_and_record, apply_summary
+from memory_budget import MemoryBudgetExceeded, run_with_budget
+from job_processes import inline_jobs
+from read_routing import get_read_db, mark_recent_write, retry_on_primary, read_router
+import intermediates
+from logging_config import setup_logging
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 
 # Configuración de logging
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Configuración de la aplicación
@@ -49,9 +71,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compresión gzip/brotli de respuestas JSON grandes (historial)
+app.add_middleware(CompressionMiddleware)
+
 # Security configuration removed - no authentication needed
 
+# Modo de procesamiento: "inline" procesa en esta réplica; "queue" encola el
+# trabajo en la base de datos para que lo tome cualquier worker (worker.py)
+PROCESSING_MODE = os.getenv("PROCESSING_MODE", "inline")
+# Tiempo máximo que /upload-process espera a que un worker termine el trabajo
+QUEUE_WAIT_SECONDS = float(os.getenv("QUEUE_WAIT_SECONDS", "120"))
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "0.5"))
+
 # Modelos Pydantic
+class BankSummary(BaseModel):
+    bank_code: str
+    bank_name: str
+    filename: str
+    rows: int
+    total_amount: float
+
 class ProcessingResult(BaseModel):
     id: str
     filename: str
@@ -60,6 +99,11 @@ class ProcessingResult(BaseModel):
     rows_processed: int
     created_at: datetime
     status: str
+    banks: Optional[List[BankSummary]] = None  # Solo con output_mode=by_bank
+    duplicate_rows: Optional[int] = None  # Filas ya pagadas en la ventana de duplicates.py
+    duplicates: Optional[Dict[str, Any]] = None  # Detalle de la revisión, solo al procesar
+    excluded_rows: Optional[Dict[str, int]] = None  # Filas excluidas por regla (row_rules.py), solo al procesar
+    excluded_names: Optional[Dict[str, List[str]]] = None  # Nombres de ejemplo de las filas excluidas por regla
 
 class PaginatedProcessingResult(BaseModel):
     items: List[ProcessingResult]
@@ -68,6 +112,31 @@ class PaginatedProcessingResult(BaseModel):
     size: int
     pages: int
 
+class RenderOptions(BaseModel):
+    concepto: Optional[str] = None  # Por defecto el de la plantilla original
+    column_widths: Optional[Dict[str, float]] = None  # Por encabezado: Nombre, Clabe, Monto, Concepto
+    amount_format: str = AMOUNT_FORMAT
+    output_mode: str = "single"
+    output_format: str = DEFAULT_OUTPUT_FORMAT
+
+class ReconciliationResult(BaseModel):
+    processing_id: str
+    reconciled_at: datetime
+    summary: Dict[str, Any]  # matched/rejected/missing/unexpected con filas y montos
+
+class DuplicateCheckResult(BaseModel):
+    processing_id: str
+    duplicate_rows: int
+    summary: Dict[str, Any]  # Filas y monto marcados, archivos anteriores y ejemplos
+
+class ArchiveInfo(BaseModel):
+    month: str
+    row_count: int
+    total_amount: Optional[float]
+    period_start: datetime
+    period_end: datetime
+    archived_at: Optional[datetime]
+
 # Inicializar base de datos MySQL
 def init_db():
     try:
@@ -103,318 +172,801 @@ async def root():
 
 # Login endpoint removed - no authentication needed
 
-# Funciones de procesamiento de Excel
-def find_col(df, keywords):
-    """Encuentra la columna que contiene las palabras clave (adaptado del script original)"""
-    for kw in keywords:
-        for c in df.columns:
-            if kw in str(c):
-                return c
-    return None
-
-def process_excel_file(file_path: str, output_path: str):
-    """Procesa el archivo Excel y genera la plantilla de dispersión"""
+def get_upload_size(file: UploadFile):
+    """Tamaño del archivo subido sin leerlo a memoria"""
+    if file.size is not None:
+        return file.size
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
+def processing_exists(processing_id: str):
+    """Si ya hay un registro con ese id en el historial (se consulta el primario)"""
+    db = SessionLocal()
     try:
-        # Leer el archivo Excel con header en la fila 8 (index 7) como en el script original
-        try:
-            df = pd.read_excel(file_path, sheet_name="ADMON. PENSION", header=7)
-            logger.info(f"Archivo leído con header en fila 8, {len(df)} filas")
-        except Exception:
-            # Si no funciona con sheet específica, intentar con la primera hoja
-            try:
-                df = pd.read_excel(file_path, header=7)
-                logger.info(f"Archivo leído con header en fila 8 (primera hoja), {len(df)} filas")
-            except Exception:
-                # Último intento: leer normalmente
-                df = pd.read_excel(file_path)
-                logger.info(f"Archivo leído normalmente, {len(df)} filas")
-        
-        # Normalizar columnas como en el script original
-        df.columns = [str(c).strip().upper().replace("Á","A").replace("É","E").replace("Í","I").replace("Ó","O").replace("Ú","U").replace("Ñ","N") for c in df.columns]
-        logger.info(f"Columnas normalizadas: {list(df.columns)}")
-        
-        # Buscar columnas específicas usando la misma lógica del script original
-        name_col = find_col(df, ["NOMBRE","NOMBRE COMPLETO","NOMBRECOMPLETO","APELLIDO","EMPLEADO"])
-        clabe_col = find_col(df, ["CLABE","CLABEINTERBANCARIA","CLABE INTERBANCARIA","CUENTA","BANCO"])
-        amount_col = find_col(df, ["NETO","NETO A DEPOSITAR","MONTO","IMPORTE","PENSION","PAGO","CANTIDAD"])
-        
-        if not all([name_col, clabe_col, amount_col]):
-            missing = []
-            if not name_col: missing.append('nombre')
-            if not clabe_col: missing.append('CLABE')
-            if not amount_col: missing.append('importe')
-            logger.error(f"Columnas encontradas - Nombre: {name_col}, CLABE: {clabe_col}, Importe: {amount_col}")
-            raise ValueError(f"No se encontraron las columnas: {', '.join(missing)}")
-        
-        # Crear DataFrame de salida como en el script original
-        df_out = pd.DataFrame()
-        df_out["Nombre"] = df[name_col] if name_col else ""
-        df_out["Clabe"] = df[clabe_col] if clabe_col else ""
-        df_out["Monto"] = df[amount_col] if amount_col else ""
-        df_out["Concepto"] = "PENSION POR RENTA VITALICIA"
-        
-        # Limpieza básica como en el script original
-        # Convertir CLABEs de notación científica a formato correcto
-        df_out["Clabe"] = df_out["Clabe"].apply(lambda x: f"{int(float(x)):018d}" if pd.notna(x) and str(x) != 'nan' else "")
-        df_out["Monto"] = pd.to_numeric(df_out["Monto"], errors="coerce").round(2)
-        
-        # Filtrar filas válidas
-        df_out = df_out.dropna(subset=["Nombre","Clabe","Monto"])
-        
-        # Filtrar filas de totales que no queremos
-        totales_keywords = ['NETO A DEPOSITAR', 'COMISION', 'SUBTOTAL', 'IVA', 'TOTAL']
-        df_out = df_out[~df_out['Nombre'].astype(str).str.upper().isin([k.upper() for k in totales_keywords])]
-        
-        df_clean = df_out  # Para mantener compatibilidad con el resto del código
-        
-        logger.info(f"Datos procesados: {len(df_clean)} filas válidas")
-        
-        # Crear archivo de salida con formato específico como en el script original
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Sheet1"
-        
-        # Definir estilos como en el script original
-        header_font = Font(bold=True)
-        header_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-        border = Border(
-            top=Side(style='thin'),
-            bottom=Side(style='thin'),
-            left=Side(style='thin'),
-            right=Side(style='thin')
-        )
-        center_alignment = Alignment(horizontal='center')
-        
-        # Escribir encabezados en la primera fila
-        headers = ['Nombre', 'Clabe', 'Monto', 'Concepto']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.border = border
-            cell.alignment = center_alignment
-        
-        # Los datos ahora comienzan desde la fila 2, no necesitamos celda vacía
-        
-        # Escribir los datos a partir de la fila 2
-        for row_idx, (_, row_data) in enumerate(df_clean.iterrows(), start=2):
-            ws.cell(row=row_idx, column=1, value=row_data['Nombre'])
-            ws.cell(row=row_idx, column=2, value=row_data['Clabe'])
-            
-            # Aplicar formato de número con separadores de miles a los montos
-            monto_cell = ws.cell(row=row_idx, column=3, value=row_data['Monto'])
-            monto_cell.number_format = '#,##0.00'
-            
-            # Escribir el concepto en la columna 4
-            ws.cell(row=row_idx, column=4, value=row_data['Concepto'])
-            
-            # Aplicar bordes a todas las celdas de datos
-            for col in range(1, 5):
-                ws.cell(row=row_idx, column=col).border = border
-        
-        # Ajustar ancho de columnas con espaciado mejorado
-        ws.column_dimensions['A'].width = 35  # Nombre
-        ws.column_dimensions['B'].width = 25  # Clabe
-        ws.column_dimensions['C'].width = 18  # Monto
-        ws.column_dimensions['D'].width = 40  # Concepto
-        ws.column_dimensions['E'].width = 5   # Columna vacía
-        
-        # Guardar archivo
-        wb.save(output_path)
-        logger.info(f"Archivo guardado en: {output_path}")
-        
-        return len(df_clean)
-        
-    except Exception as e:
-        logger.error(f"Error procesando archivo: {str(e)}")
-        raise
+        return db.query(ProcessingHistory.id).filter(ProcessingHistory.id == processing_id).first() is not None
+    finally:
+        db.close()
+
+def validate_output_options(output_mode: str, output_format: str):
+    if output_mode not in OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"output_mode debe ser uno de: {', '.join(OUTPUT_MODES)}")
+    if output_format not in output_formats():
+        raise HTTPException(status_code=400, detail=f"output_format debe ser uno de: {', '.join(output_formats())}")
+
+def output_filename_for(output_mode: str, output_format: str = DEFAULT_OUTPUT_FORMAT):
+    extension = ".zip" if output_mode == "by_bank" else output_extension(output_format)
+    return f"plantilla_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}{extension}"
+
+async def enqueue_upload(saved_path: str, original_filename: str, file_size: int, file_hash: str,
+                         processing_id: str, output_mode: str, output_format: str, profile_requested: bool,
+                         db: Session):
+    """Mueve el archivo a UPLOADS_DIR y lo encola para los workers"""
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    input_path = upload_file_path(processing_id, original_filename)
+    await run_in_threadpool(shutil.move, saved_path, input_path)
+    output_filename = output_filename_for(output_mode, output_format)
+    
+    processing_record = ProcessingHistory(
+        id=processing_id,
+        filename=output_filename,
+        original_filename=original_filename,
+        rows_processed=0,
+        file_size=file_size,
+        file_hash=file_hash,
+        user_id=None,  # Sin autenticación
+        processing_status="queued"
+    )
+    db.add(processing_record)
+    job_queue.enqueue(db, processing_id, input_path, original_filename, output_filename, output_mode, output_format,
+                      profile=profile_requested)
+    bump_table_version(db, HISTORY_TABLE)
+    db.commit()
+    history_cache.clear()
+
+async def wait_for_job(processing_id: str, db: Session):
+    """Espera hasta QUEUE_WAIT_SECONDS a que un worker termine el trabajo encolado"""
+    # El avance se refleja en /jobs/{id}/events
+    status = "queued"
+    deadline = time.monotonic() + QUEUE_WAIT_SECONDS
+    while status not in ("completed", "dead") and time.monotonic() < deadline:
+        await asyncio.sleep(QUEUE_POLL_INTERVAL)
+        db.expire_all()
+        current = db.query(ProcessingJob.status).filter(ProcessingJob.id == processing_id).scalar()
+        if current != status:
+            status = current
+            if status == "running":
+                job_registry.report(processing_id, "running")
+    
+    processing_record = db.query(ProcessingHistory).filter(ProcessingHistory.id == processing_id).first()
+    if processing_record.processing_status == "failed":
+        job_registry.report(processing_id, "failed", error=processing_record.error_message)
+        raise HTTPException(status_code=500, detail=f"Error procesando archivo: {processing_record.error_message}")
+    if processing_record.processing_status == "completed":
+        job_registry.report(processing_id, "completed", rows_written=processing_record.rows_processed)
+    
+    # Si se agotó la espera el cliente recibe status "queued" y puede consultar el historial
+    return ProcessingResult(
+        id=processing_id,
+        filename=processing_record.filename,
+        original_filename=processing_record.original_filename,
+        processed_filename=processing_record.processed_filename,
+        rows_processed=processing_record.rows_processed,
+        created_at=processing_record.created_at,
+        status=processing_record.processing_status,
+        duplicate_rows=processing_record.duplicate_rows,
+        duplicates=json.loads(processing_record.duplicate_summary) if processing_record.duplicate_summary else None
+    )
 
 @app.post("/upload-process", response_model=ProcessingResult)
 async def upload_and_process(
+    response: Response,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    job_id: Optional[str] = None,
+    profile: bool = False,
+    output_mode: str = "single",
+    output_format: str = DEFAULT_OUTPUT_FORMAT,
+    x_profile: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    """Subir y procesar archivo Excel"""
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Solo se permiten archivos Excel (.xlsx, .xls)")
+    """Subir y procesar archivo Excel o CSV.
+
+    job_id (UUID generado por el cliente) permite seguir el avance en
+    /jobs/{job_id}/events y se usa como id del procesamiento.
+    Con PROFILING_ENABLED, el header X-Profile o ?profile=true guardan un
+    perfil de la ejecución descargable en /profiles/{id}.
+    output_mode=by_bank genera un .zip con una plantilla por banco destino.
+    output_format elige la plantilla xlsx o un formato de texto para bancos
+    (csv, spei_fixed o los definidos en OUTPUT_LAYOUTS_FILE).
+    Una subida con el mismo contenido, opciones e Idempotency-Key que otra
+    en curso recibe el resultado de esa, sin procesar de nuevo.
+    """
+    # El formato se detecta por los primeros bytes, no por la extensión
+    head = await file.read(MAGIC_BYTES)
+    await file.seek(0)
+    if detect_format(head) is None:
+        raise HTTPException(status_code=400, detail="Formato de archivo no reconocido: se permiten Excel (.xlsx, .xls) o CSV")
+    validate_output_options(output_mode, output_format)
+    # Un archivo que nunca cabría en la admisión se rechaza (413) antes de copiarlo
+    upload_admission.check_size(get_upload_size(file))
     
-    processing_id = str(uuid.uuid4())
+    if job_id:
+        try:
+            processing_id = str(uuid.UUID(job_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="job_id debe ser un UUID válido")
+        # El id es la llave primaria del historial: uno repetido fallaría al guardar, ya procesado
+        if await run_in_threadpool(processing_exists, processing_id) or not job_registry.reserve(processing_id):
+            raise HTTPException(status_code=409, detail="job_id ya corresponde a otro procesamiento")
+    else:
+        processing_id = str(uuid.uuid4())
     
+    # Guardar archivo subido por bloques, sin cargarlo completo en memoria. Se
+    # guarda antes de la admisión: el procesamiento del líder puede seguir
+    # después de que termine esta petición y no debe depender de su UploadFile
+    temp_dir = tempfile.mkdtemp()
+    input_path = os.path.join(temp_dir, os.path.basename(file.filename))
     try:
-        # Leer contenido del archivo para obtener el tamaño
-        file_content = await file.read()
-        file_size = len(file_content)
+        file_size, file_hash = await run_in_threadpool(
+            save_stream, file.file, input_path, max_bytes=upload_admission.max_bytes
+        )
+    except UploadTooLarge:
+        # El tamaño declarado no coincidía: se corta la copia al pasar el límite
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        job_registry.report(processing_id, "failed", error="El archivo excede el tamaño máximo permitido")
+        upload_admission.reject_too_large()
+    except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        job_registry.report(processing_id, "failed", error=str(e))
+        raise
+    
+    # Subidas idénticas en curso comparten un solo procesamiento (singleflight.py)
+    profile_requested = profiling_requested(x_profile, profile)
+    flight_key = (idempotency_key or "", file_hash, output_mode, output_format, profile_requested)
+    leader_id = upload_flights.leader_for(flight_key)
+    if leader_id:
+        logger.info(f"Subida idéntica a {leader_id}; se combina con ese procesamiento")
+        job_registry.link(processing_id, leader_id)
+    # Las lecturas siguientes de este cliente ven su propia subida (read_routing.py)
+    mark_recent_write(response)
+    
+    leading = False
+    def lead():
+        nonlocal leading
+        leading = True
+        return process_upload(input_path, file.filename, file_size, file_hash, processing_id, output_mode,
+                              output_format, profile_requested)
+    try:
+        return await upload_flights.run(
+            flight_key, processing_id, lead,
+            keep=lambda result: result.status == "completed"
+        )
+    finally:
+        # La copia de una subida combinada no se usa; la del líder la borra process_upload
+        if not leading:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+async def process_upload(input_path: str, original_filename: str, file_size: int, file_hash: str,
+                         processing_id: str, output_mode: str, output_format: str, profile_requested: bool):
+    """Admisión, procesamiento y registro de una subida ya guardada en input_path.
+
+    Es la tarea del líder de su llave en upload_flights y puede seguir después
+    de que termine la petición que la inició: usa su propia sesión de base de
+    datos y borra el directorio temporal de input_path al terminar.
+    """
+    temp_dir = os.path.dirname(input_path)
+    
+    # Esperar lugar en la cola de procesamiento (429/503 si está saturada)
+    job_registry.report(processing_id, "queued")
+    try:
+        await upload_admission.acquire(file_size)
+    except HTTPException as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        job_registry.report(processing_id, "failed", error=e.detail)
+        raise
+    admitted = True
+    output_filename = output_filename_for(output_mode, output_format)
+    db = SessionLocal()
+    try:
+        if PROCESSING_MODE == "queue":
+            await enqueue_upload(input_path, original_filename, file_size, file_hash, processing_id,
+                                 output_mode, output_format, profile_requested, db)
+            # El trabajo lo hace un worker: la espera no ocupa lugar en la admisión
+            admitted = False
+            await upload_admission.release(file_size)
+            return await wait_for_job(processing_id, db)
         
-        # Crear directorio temporal
-        temp_dir = tempfile.mkdtemp()
-        input_path = os.path.join(temp_dir, file.filename)
-        output_filename = f"plantilla_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.xlsx"
         output_path = os.path.join(temp_dir, output_filename)
         
-        # Guardar archivo subido
-        with open(input_path, "wb") as buffer:
-            buffer.write(file_content)
-        
-        # Procesar archivo
-        rows_processed = process_excel_file(input_path, output_path)
+        # Procesar archivo fuera del event loop, en un proceso hijo con límite de memoria (job_processes.py)
+        progress = inline_jobs.progress(processing_id, job_registry.progress_callback(processing_id))
+        profile_filename = None
+        if profile_requested:
+            result, profile_file = await run_in_threadpool(
+                inline_jobs.run, processing_id, run_profiled, processing_id, process_excel_file, input_path,
+                output_path, progress, output_mode, processing_id, output_format
+            )
+            profile_filename = os.path.basename(profile_file)
+        else:
+            result = await run_in_threadpool(
+                inline_jobs.run, processing_id, process_excel_file, input_path, output_path, progress, output_mode,
+                processing_id, output_format
+            )
+        rows_processed = result["rows"]
+        job_registry.report(processing_id, "saving")
+        output_hash = await run_in_threadpool(file_sha256, output_path)
         
         # Guardar en base de datos MySQL
         processing_record = ProcessingHistory(
             id=processing_id,
             filename=output_filename,
-            original_filename=file.filename,
+            original_filename=original_filename,
             processed_filename=output_filename,
             rows_processed=rows_processed,
+            total_amount=result["total_amount"],
             file_size=file_size,
+            file_hash=file_hash,
+            output_hash=output_hash,
+            processing_time=result["timings"]["total"],
+            profile_filename=profile_filename,
             user_id=None,  # Sin autenticación
             processing_status="completed"
         )
         db.add(processing_record)
+        # Cruce con los pagos de los archivos anteriores en la ventana
+        duplicates = await run_in_threadpool(safe_check_and_record, db, processing_id, result["payments"])
+        apply_summary(processing_record, duplicates)
+        bump_table_version(db, HISTORY_TABLE)
         db.commit()
+        history_cache.clear()
         
         # Mover archivo procesado a directorio permanente
-        os.makedirs('processed_files', exist_ok=True)
-        final_output_path = os.path.join('processed_files', f"{processing_id}_{output_filename}")
+        os.makedirs(PROCESSED_FILES_DIR, exist_ok=True)
+        final_output_path = processed_file_path(processing_id, output_filename)
         shutil.move(output_path, final_output_path)
         
-        # Limpiar directorio temporal
-        shutil.rmtree(temp_dir)
-        
+        job_registry.report(processing_id, "completed", rows_written=rows_processed)
+        logger.info("Archivo procesado", extra={
+            "processing_id": processing_id,
+            "rows": rows_processed,
+            "file_size": file_size,
+            "timings": result["timings"],
+        })
         return ProcessingResult(
             id=processing_id,
             filename=output_filename,
-            original_filename=file.filename,
+            original_filename=original_filename,
             processed_filename=output_filename,
             rows_processed=rows_processed,
             created_at=datetime.now(),
-            status="completed"
+            status="completed",
+            banks=result["banks"],
+            duplicate_rows=processing_record.duplicate_rows,
+            duplicates=duplicates,
+            excluded_rows=result["excluded"],
+            excluded_names=result["excluded_names"]
         )
         
+    except HTTPException:
+        raise
+    except MemoryBudgetExceeded as e:
+        # El proceso hijo abortó el trabajo antes de agotar la memoria del contenedor
+        await run_in_threadpool(record_failure, db, processing_id, output_filename, original_filename,
+                                file_size, file_hash, str(e))
+        job_registry.report(processing_id, "failed", error=str(e))
+        raise HTTPException(status_code=413, detail=str(e))
+    except LayoutValidationError as e:
+        # Un valor que no cabe en el formato del banco: no se genera un archivo alterado
+        await run_in_threadpool(record_failure, db, processing_id, output_filename, original_filename,
+                                file_size, file_hash, str(e))
+        job_registry.report(processing_id, "failed", error=str(e))
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        # Limpiar en caso de error
-        if 'temp_dir' in locals():
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        
         logger.error(f"Error procesando archivo: {str(e)}")
+        await run_in_threadpool(record_failure, db, processing_id, output_filename, original_filename,
+                                file_size, file_hash, str(e))
+        job_registry.report(processing_id, "failed", error=str(e))
         raise HTTPException(status_code=500, detail=f"Error procesando archivo: {str(e)}")
+    finally:
+        # Limpiar directorio temporal
+        db.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if admitted:
+            await upload_admission.release(file_size)
+
+def record_failure(db: Session, processing_id: str, output_filename: str, original_filename: str,
+                   file_size: int, file_hash: str, error_message: str):
+    """Deja el procesamiento como fallido en el historial, con el motivo"""
+    try:
+        db.rollback()
+        # merge: si el registro ya se había guardado (falló un paso posterior) se actualiza
+        db.merge(ProcessingHistory(
+            id=processing_id,
+            filename=output_filename,
+            original_filename=original_filename,
+            rows_processed=0,
+            file_size=file_size,
+            file_hash=file_hash,
+            user_id=None,  # Sin autenticación
+            processing_status="failed",
+            error_message=error_message
+        ))
+        bump_table_version(db, HISTORY_TABLE)
+        db.commit()
+        history_cache.clear()
+    except Exception as e:
+        # El error original es el que se reporta al cliente
+        db.rollback()
+        logger.error(f"No se pudo registrar el fallo de {processing_id}: {e}")
+
+def load_clean_frame(processing_id: str, processing_record: ProcessingHistory):
+    """DataFrame limpio desde el intermedio; si fue desalojado, desde la plantilla generada"""
+    df_clean = load_intermediate(processing_id)
+    if df_clean is not None:
+        return df_clean
+    output_path = processed_file_path(processing_id, processing_record.filename)
+    if not os.path.exists(output_path):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado en el sistema")
+    if not processing_record.filename.endswith((".xlsx", ".zip")):
+        raise HTTPException(status_code=409, detail="Los datos de este procesamiento ya no están disponibles; vuelve a subir el archivo")
+    logger.info(f"Intermedio de {processing_id} no disponible, se reconstruye desde la plantilla")
+    df_clean = read_dispersion(output_path)
+    if df_clean.empty and processing_record.rows_processed:
+        # Paquete por banco en un formato de texto: no se puede reconstruir
+        raise HTTPException(status_code=409, detail="Los datos de este procesamiento ya no están disponibles; vuelve a subir el archivo")
+    df_clean = df_clean[OUTPUT_HEADERS]
+    try:
+        save_intermediate(processing_id, df_clean)
+    except Exception as e:
+        # El intermedio es una optimización: el render sigue con los datos reconstruidos
+        logger.warning(f"No se pudo guardar el intermedio de {processing_id}: {e}")
+    return df_clean
+
+@app.post("/processing/{processing_id}/render", response_model=ProcessingResult)
+async def render_processing(
+    processing_id: str,
+    options: RenderOptions,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    """Generar otra salida (concepto, anchos, formato) desde el intermedio, sin leer el Excel.
+
+    La nueva salida queda como un registro más del historial y se descarga en
+    /download/{id}.
+    """
+    validate_output_options(options.output_mode, options.output_format)
+    unknown = set(options.column_widths or {}) - set(OUTPUT_HEADERS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Columnas desconocidas: {', '.join(sorted(unknown))}")
+    
+    source_record = db.query(ProcessingHistory).filter(
+        ProcessingHistory.id == processing_id
+    ).first()
+    if not source_record or source_record.processing_status != "completed":
+        raise HTTPException(status_code=404, detail="Procesamiento no encontrado o sin completar")
+    
+    render_id = str(uuid.uuid4())
+    output_filename = output_filename_for(options.output_mode, options.output_format)
+    await upload_admission.acquire(0)
+    try:
+        started = time.perf_counter()
+        df_clean = await run_in_threadpool(load_clean_frame, processing_id, source_record)
+        os.makedirs(PROCESSED_FILES_DIR, exist_ok=True)
+        output_path = processed_file_path(render_id, output_filename)
+        banks = await run_in_threadpool(
+            run_with_budget, f"la salida de {processing_id}", render_output, df_clean, output_path, options.output_mode,
+            concepto=options.concepto, column_widths=options.column_widths, amount_format=options.amount_format,
+            output_format=options.output_format
+        )
+        output_hash = await run_in_threadpool(file_sha256, output_path)
+        
+        processing_record = ProcessingHistory(
+            id=render_id,
+            filename=output_filename,
+            original_filename=source_record.original_filename,
+            processed_filename=output_filename,
+            rows_processed=len(df_clean),
+            total_amount=source_record.total_amount,
+            file_size=source_record.file_size,
+            file_hash=source_record.file_hash,
+            output_hash=output_hash,
+            processing_time=round(time.perf_counter() - started, 4),
+            user_id=None,  # Sin autenticación
+            processing_status="completed"
+        )
+        db.add(processing_record)
+        bump_table_version(db, HISTORY_TABLE)
+        db.commit()
+        history_cache.clear()
+        mark_recent_write(response)
+        
+        return ProcessingResult(
+            id=render_id,
+            filename=output_filename,
+            original_filename=source_record.original_filename,
+            processed_filename=output_filename,
+            rows_processed=len(df_clean),
+            created_at=processing_record.created_at,
+            status="completed",
+            banks=banks
+        )
+    except HTTPException:
+        raise
+    except LayoutValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error generando salida de {processing_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error generando salida: {str(e)}")
+    finally:
+        await upload_admission.release(0)
+
+@app.post("/reconcile/{processing_id}", response_model=ReconciliationResult)
+async def reconcile_processing(
+    processing_id: str,
+    response: Response,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """Conciliar el archivo de respuesta del banco (CSV/XLSX) contra la dispersión"""
+    if not file.filename.lower().endswith(('.csv', '.txt', '.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="Solo se permiten archivos CSV o Excel")
+    
+    processing_record = db.query(ProcessingHistory).filter(
+        ProcessingHistory.id == processing_id
+    ).first()
+    if not processing_record or processing_record.processing_status != "completed":
+        raise HTTPException(status_code=404, detail="Procesamiento no encontrado o sin completar")
+    
+    upload_size = get_upload_size(file)
+    await upload_admission.acquire(upload_size)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        bank_path = os.path.join(temp_dir, os.path.basename(file.filename))
+        await run_in_threadpool(save_stream, file.file, bank_path)
+        # El intermedio evita volver a leer la plantilla (y sirve para salidas de texto)
+        dispersion = await run_in_threadpool(load_clean_frame, processing_id, processing_record)
+        os.makedirs(PROCESSED_FILES_DIR, exist_ok=True)
+        summary = await run_in_threadpool(
+            reconcile_files, dispersion, bank_path, reconciliation_file_path(processing_id)
+        )
+        summary["bank_filename"] = file.filename
+        
+        processing_record.reconciliation_summary = json.dumps(summary)
+        processing_record.reconciled_at = datetime.utcnow()
+        db.commit()
+        mark_recent_write(response)
+        
+        return ReconciliationResult(
+            processing_id=processing_id,
+            reconciled_at=processing_record.reconciled_at,
+            summary=summary
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error conciliando {processing_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error conciliando archivo: {str(e)}")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        await upload_admission.release(upload_size)
+
+def reconciliation_result(processing_id: str, db: Session):
+    processing_record = db.query(ProcessingHistory).filter(
+        ProcessingHistory.id == processing_id
+    ).first()
+    if not processing_record or not processing_record.reconciliation_summary:
+        raise HTTPException(status_code=404, detail="Conciliación no encontrada")
+    
+    return ReconciliationResult(
+        processing_id=processing_id,
+        reconciled_at=processing_record.reconciled_at,
+        summary=json.loads(processing_record.reconciliation_summary)
+    )
+
+@app.get("/reconciliation/{processing_id}", response_model=ReconciliationResult)
+async def get_reconciliation(
+    processing_id: str,
+    db: Session = Depends(get_read_db)
+):
+    """Resumen de la última conciliación de un procesamiento"""
+    # Una conciliación recién guardada puede no haber llegado aún a la réplica
+    return await run_in_threadpool(
+        retry_on_primary, db, lambda session: reconciliation_result(processing_id, session)
+    )
+
+def duplicate_check_result(processing_id: str, db: Session):
+    processing_record = db.query(ProcessingHistory).filter(
+        ProcessingHistory.id == processing_id
+    ).first()
+    if not processing_record or not processing_record.duplicate_summary:
+        raise HTTPException(status_code=404, detail="Revisión de duplicados no encontrada")
+    
+    return DuplicateCheckResult(
+        processing_id=processing_id,
+        duplicate_rows=processing_record.duplicate_rows or 0,
+        summary=json.loads(processing_record.duplicate_summary)
+    )
+
+@app.get("/processing/{processing_id}/duplicates", response_model=DuplicateCheckResult)
+async def get_duplicate_check(
+    processing_id: str,
+    db: Session = Depends(get_read_db)
+):
+    """Resultado de la revisión de pagos duplicados de un procesamiento"""
+    # Un procesamiento recién registrado puede no haber llegado aún a la réplica
+    return await run_in_threadpool(
+        retry_on_primary, db, lambda session: duplicate_check_result(processing_id, session)
+    )
+
+@app.get("/reconciliation/{processing_id}/download")
+async def download_reconciliation(processing_id: str):
+    """Detalle CSV de la última conciliación (una fila por registro y su resultado)"""
+    file_path = reconciliation_file_path(processing_id)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Conciliación no encontrada")
+    
+    return FileResponse(
+        path=file_path,
+        filename=f"conciliacion_{processing_id}.csv",
+        media_type="text/csv"
+    )
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Stream SSE con el avance (etapa, filas leídas y escritas) de un procesamiento"""
+    async def event_stream():
+        version = -1
+        while not await request.is_disconnected():
+            current, data = job_registry.snapshot(job_id)
+            if current != version:
+                version = current
+                yield f"event: progress\ndata: {json.dumps(data, default=str)}\n\n"
+                if data["stage"] in FINAL_STAGES:
+                    break
+            else:
+                # Comentario para mantener viva la conexión a través de proxies
+                yield ": keep-alive\n\n"
+            await job_registry.wait(job_id, version, timeout=15)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/download/{processing_id}")
 async def download_file(
     processing_id: str,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: Session = Depends(get_read_db)
+):
+    """Descargar archivo procesado (soporta ETag, If-Modified-Since y Range)"""
+    # Un registro recién creado puede no haber llegado aún a la réplica
+    return await run_in_threadpool(
+        retry_on_primary, db, lambda session: download_response(request, processing_id, session)
+    )
+
+@app.get("/download-bundle")
+async def download_bundle(
+    ids: Optional[List[str]] = Query(None),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: Session = Depends(get_read_db)
 ):
-    """Descargar archivo procesado"""
+    """Descargar varios archivos procesados en un ZIP generado al vuelo, con manifiesto CSV"""
+    entries = select_bundle_records(db, ids, date_from, date_to)
+    bundle_name = f"plantillas_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip"
+    return StreamingResponse(
+        stream_bundle(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{bundle_name}"'}
+    )
+
+def profile_response(processing_id: str, db: Session):
     processing_record = db.query(ProcessingHistory).filter(
         ProcessingHistory.id == processing_id
     ).first()
     
-    if not processing_record:
-        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    if not processing_record or not processing_record.profile_filename:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
     
-    file_path = os.path.join('processed_files', f"{processing_id}_{processing_record.filename}")
+    file_path = os.path.join(PROFILES_DIR, processing_record.profile_filename)
     
     if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Archivo no encontrado en el sistema")
+        raise HTTPException(status_code=404, detail="Perfil no encontrado en el sistema")
     
     return FileResponse(
         path=file_path,
-        filename=processing_record.filename,
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        filename=f"{processing_id}.folded",
+        media_type='text/plain'
+    )
+
+@app.get("/profiles/{processing_id}")
+async def download_profile(
+    processing_id: str,
+    db: Session = Depends(get_read_db)
+):
+    """Descargar el perfil de un procesamiento en formato folded (flamegraph)"""
+    # Un perfil recién generado puede no haber llegado aún a la réplica
+    return await run_in_threadpool(
+        retry_on_primary, db, lambda session: profile_response(processing_id, session)
     )
 
 @app.get("/history", response_model=List[ProcessingResult])
 async def get_processing_history(
-    db: Session = Depends(get_db)
+    request: Request,
+    db: Session = Depends(get_read_db)
 ):
     """Obtener historial de procesamiento"""
-    processing_records = db.query(ProcessingHistory).order_by(ProcessingHistory.created_at.desc()).all()
+    def build():
+        processing_records = db.query(ProcessingHistory).order_by(ProcessingHistory.created_at.desc()).all()
+        
+        return [
+            ProcessingResult(
+                id=record.id,
+                filename=record.filename,
+                original_filename=record.original_filename,
+                processed_filename=record.processed_filename,
+                rows_processed=record.rows_processed,
+                created_at=record.created_at,
+                status=record.processing_status,
+                duplicate_rows=record.duplicate_rows
+            )
+            for record in processing_records
+        ]
     
-    return [
-        ProcessingResult(
-            id=record.id,
-            filename=record.filename,
-            original_filename=record.original_filename,
-            processed_filename=record.processed_filename,
-            rows_processed=record.rows_processed,
-            created_at=record.created_at,
-            status=record.processing_status
-        )
-        for record in processing_records
-    ]
+    return cached_history_response(request, db, build)
 
 @app.get("/history/paginated", response_model=PaginatedProcessingResult)
 async def get_paginated_processing_history(
+    request: Request,
     page: int = 1,
     size: int = 10,
     search: Optional[str] = None,
     sort_by: str = "created_at",
     sort_order: str = "desc",
-    db: Session = Depends(get_db)
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: Session = Depends(get_read_db)
 ):
     """Obtener historial de procesamiento con paginación, filtrado y ordenamiento"""
+    def build():
+        nonlocal page, size, sort_by, sort_order
+        # Validar parámetros
+        if page < 1:
+            page = 1
+        if size < 1 or size > 100:
+            size = 10
+        if sort_by not in ["created_at", "filename", "original_filename", "processed_filename", "rows_processed", "processing_status"]:
+            sort_by = "created_at"
+        if sort_order not in ["asc", "desc"]:
+            sort_order = "desc"
     
-    # Validar parámetros
-    if page < 1:
-        page = 1
-    if size < 1 or size > 100:
-        size = 10
-    if sort_by not in ["created_at", "filename", "original_filename", "processed_filename", "rows_processed", "processing_status"]:
-        sort_by = "created_at"
-    if sort_order not in ["asc", "desc"]:
-        sort_order = "desc"
-    
-    # Construir query base
-    query = db.query(ProcessingHistory)
+        # Construir query base
+        query = db.query(ProcessingHistory)
     
-    # Aplicar filtro de búsqueda si se proporciona
-    if search:
-        search_filter = f"%{search}%"
-        query = query.filter(
-            or_(
-                ProcessingHistory.filename.like(search_filter),
-                ProcessingHistory.processing_status.like(search_filter)
+        # Aplicar filtro de búsqueda si se proporciona
+        if search:
+            search_filter = f"%{search}%"
+            query = query.filter(
+                or_(
+                    ProcessingHistory.filename.like(search_filter),
+                    ProcessingHistory.processing_status.like(search_filter)
+                )
             )
-        )
     
-    # Aplicar ordenamiento
-    sort_column = getattr(ProcessingHistory, sort_by)
-    if sort_order == "desc":
-        query = query.order_by(desc(sort_column))
-    else:
-        query = query.order_by(asc(sort_column))
+        # Filtro por fecha: en MySQL solo se leen las particiones del rango
+        if date_from:
+            query = query.filter(ProcessingHistory.created_at >= date_from)
+        if date_to:
+            query = query.filter(ProcessingHistory.created_at <= date_to)
     
-    # Obtener total de registros
-    total = query.count()
+        # Aplicar ordenamiento
+        sort_column = getattr(ProcessingHistory, sort_by)
+        if sort_order == "desc":
+            query = query.order_by(desc(sort_column))
+        else:
+            query = query.order_by(asc(sort_column))
     
-    # Aplicar paginación
-    offset = (page - 1) * size
-    processing_records = query.offset(offset).limit(size).all()
+        # Obtener total de registros
+        total = query.count()
     
-    # Calcular número total de páginas
-    pages = (total + size - 1) // size
+        # Aplicar paginación
+        offset = (page - 1) * size
+        processing_records = query.offset(offset).limit(size).all()
     
-    # Convertir a modelo de respuesta
-    items = [
-        ProcessingResult(
-            id=record.id,
-            filename=record.filename,
-            original_filename=record.original_filename,
-            processed_filename=record.processed_filename,
-            rows_processed=record.rows_processed,
-            created_at=record.created_at,
-            status=record.processing_status
+        # Calcular número total de páginas
+        pages = (total + size - 1) // size
+    
+        # Convertir a modelo de respuesta
+        items = [
+            ProcessingResult(
+                id=record.id,
+                filename=record.filename,
+                original_filename=record.original_filename,
+                processed_filename=record.processed_filename,
+                rows_processed=record.rows_processed,
+                created_at=record.created_at,
+                status=record.processing_status,
+                duplicate_rows=record.duplicate_rows
+            )
+            for record in processing_records
+        ]
+    
+        return PaginatedProcessingResult(
+            items=items,
+            total=total,
+            page=page,
+            size=size,
+            pages=pages
         )
-        for record in processing_records
-    ]
     
-    return PaginatedProcessingResult(
-        items=items,
-        total=total,
-        page=page,
-        size=size,
-        pages=pages
+    return cached_history_response(request, db, build)
+
+@app.get("/archive", response_model=List[ArchiveInfo])
+async def list_history_archives(db: Session = Depends(get_read_db)):
+    """Meses del historial movidos a archivo frío"""
+    return [
+        ArchiveInfo(
+            month=entry.month,
+            row_count=entry.row_count,
+            total_amount=entry.total_amount,
+            period_start=entry.period_start,
+            period_end=entry.period_end,
+            archived_at=entry.archived_at
+        )
+        for entry in archive.list_archives(db)
+    ]
+
+@app.get("/archive/search", response_model=List[ProcessingResult])
+async def search_history_archive(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    search: Optional[str] = None,
+    status: Optional[str] = None,
+    processing_id: Optional[str] = None,
+    limit: int = 100,
+    db: Session = Depends(get_read_db)
+):
+    """Buscar en el historial archivado; solo se leen los meses del rango"""
+    if limit < 1 or limit > 1000:
+        limit = 100
+    entries = await run_in_threadpool(
+        archive.search_archive, db, date_from, date_to, search, status, processing_id, limit
     )
+    return [
+        ProcessingResult(
+            id=entry["id"],
+            filename=entry["filename"],
+            original_filename=entry["original_filename"],
+            processed_filename=entry["processed_filename"],
+            rows_processed=entry["rows_processed"],
+            created_at=entry["created_at"],
+            status=entry["processing_status"],
+            duplicate_rows=entry.get("duplicate_rows")
+        )
+        for entry in entries
+    ]
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now()}
\ No newline at end of file
+    return {"status": "healthy", "timestamp": datetime.now()}
+
+@app.get("/metrics")
+async def metrics(db: Session = Depends(get_db)):
+    """Contadores de admisión y de la cola para dimensionar el despliegue"""
+    result = {
+        "upload_admission": upload_admission.stats(),
+        "upload_coalescing": upload_flights.stats(),
+        "download_cache": download_cache.stats(),
+        "history_cache": history_cache.stats(),
+        "intermediates": intermediates.stats(),
+        "read_routing": read_router.stats(),
+        "inline_jobs": inline_jobs.stats(),
+    }
+    if PROCESSING_MODE == "queue":
+        result["job_queue"] = job_queue.queue_stats(db)
+    return result
\ No newline at end of file
@@ -0,0 +1,181 @@
+"""Presupuesto de memoria por trabajo de procesamiento.
+
+Un libro malformado (p. ej. un millón de filas vacías con formato) puede
+inflar la memoria de pd.read_excel/openpyxl hasta que el kernel mate el
+contenedor con todos los trabajos en curso. MemoryBudget muestrea el RSS del
+proceso en un hilo mientras dura el trabajo; si el crecimiento desde el
+inicio supera JOB_MEMORY_LIMIT_MB, lanza MemoryBudgetExceeded en el hilo del
+trabajo (PyThreadState_SetAsyncExc), que se desenrolla como cualquier otra
+excepción: se cierran archivos, se libera el DataFrame y el proceso sigue
+atendiendo otros trabajos.
+
+La excepción se entrega entre instrucciones de Python: una llamada larga en
+C (el parser de CSV, una operación de numpy) termina antes de abortar. La
+lectura de openpyxl es Python puro, por lo que el corte es inmediato.
+
+El RSS es del proceso, así que el límite solo se aplica donde hay un
+trabajo por proceso: el worker, los procesos del watcher y los procesos
+hijos de los trabajos inline de la API (job_processes.py) llaman
+enforce_budgets() al arrancar. Donde varios trabajos comparten el proceso
+(la API con INLINE_JOB_PROCESSES=0, el render de /processing/{id}/render)
+el crecimiento de uno abortaría a otro más pequeño, por lo que ahí solo se
+mide y se registra una advertencia al pasar el límite.
+
+Sin /proc (fuera de Linux) se usa tracemalloc.
+"""
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+import threading
+import tracemalloc
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 0 desactiva el límite
+JOB_MEMORY_LIMIT_MB = int(os.getenv("JOB_MEMORY_LIMIT_MB", "1536"))
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", "0.1"))
+
+# Solo los procesos de un trabajo a la vez abortan al pasar el límite
+_enforced = False
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_STATM_PATH = "/proc/self/statm"
+
+class MemoryBudgetExceeded(Exception):
+    """El trabajo superó su presupuesto de memoria y fue abortado"""
+
+def enforce_budgets():
+    """Activa el aborto por memoria en este proceso: solo para procesos de un trabajo a la vez"""
+    global _enforced
+    _enforced = True
+
+def current_rss():
+    """RSS del proceso en bytes, o None si /proc no está disponible"""
+    try:
+        with open(_STATM_PATH) as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+def _release_memory():
+    """Devuelve al sistema la memoria liberada tras abortar (glibc no lo hace solo)"""
+    gc.collect()
+    libc_name = ctypes.util.find_library("c")
+    if libc_name:
+        try:
+            ctypes.CDLL(libc_name).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+def _set_async_exc(thread_id: int, exc_type):
+    return ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(exc_type) if exc_type else None)
+
+class MemoryBudget:
+    """Context manager que aborta el hilo actual si su trabajo excede limit_mb.
+
+        with MemoryBudget("lectura de anexo.xlsx"):
+            df = pd.read_excel(...)
+    """
+
+    def __init__(self, label: str, limit_mb: int = None, interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.label = label
+        self.limit_mb = JOB_MEMORY_LIMIT_MB if limit_mb is None else limit_mb
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self.exceeded = False
+        self.over_limit = False
+        self._thread_id = None
+        self._sampler = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._use_tracemalloc = False
+        self._started_tracemalloc = False
+
+    def _usage(self):
+        if self._use_tracemalloc:
+            return tracemalloc.get_traced_memory()[0]
+        return current_rss() or 0
+
+    def _sample(self):
+        limit = self.limit_mb * 1024 * 1024
+        while not self._stopped.wait(self.interval):
+            growth = self._usage() - self.baseline
+            self.peak = max(self.peak, growth)
+            if growth > limit:
+                if not _enforced:
+                    if not self.over_limit:
+                        self.over_limit = True
+                        logger.warning(f"{self.label} superó el límite de memoria ({self.limit_mb} MB); "
+                                       f"no se aborta porque el proceso atiende varios trabajos")
+                    continue
+                # Se repite mientras siga excedido: un except Exception del código
+                # que se ejecuta (p. ej. los reintentos de read_source) no lo detiene
+                with self._lock:
+                    if not self._stopped.is_set():
+                        self.exceeded = True
+                        _set_async_exc(self._thread_id, MemoryBudgetExceeded)
+
+    def __enter__(self):
+        if self.limit_mb <= 0:
+            return self
+        self._thread_id = threading.get_ident()
+        if current_rss() is None:
+            self._use_tracemalloc = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+        self.baseline = self._usage()
+        self._sampler = threading.Thread(target=self._sample, daemon=True, name=f"memory-budget-{self._thread_id}")
+        self._sampler.start()
+        return self
+
+    def _stop(self):
+        """Detiene el muestreo; desde aquí el muestreador ya no lanza excepciones"""
+        with self._lock:
+            self._stopped.set()
+            if self.exceeded:
+                # Cancela la excepción si aún no se entregó (el trabajo terminó justo antes)
+                _set_async_exc(self._thread_id, None)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._sampler is None:
+            return False
+        try:
+            # Una excepción pendiente puede entregarse aquí mismo, antes de
+            # detener el muestreo: se repite hasta que _stop termine
+            stopped = False
+            while not stopped:
+                try:
+                    self._stop()
+                    stopped = True
+                except MemoryBudgetExceeded as e:
+                    exc_type, exc = MemoryBudgetExceeded, e
+        finally:
+            self._sampler.join()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+        if not self.exceeded:
+            return False
+        if exc_type is None:
+            # El trabajo terminó antes de recibir la excepción
+            logger.warning(f"{self.label} terminó por encima del límite de memoria ({self.limit_mb} MB)")
+            return False
+
+        _release_memory()
+        message = (f"El procesamiento excedió el límite de memoria por trabajo ({self.limit_mb} MB) durante "
+                   f"{self.label}. Verifica que el archivo no tenga filas o columnas vacías con formato.")
+        logger.error(f"{message} Pico observado: {self.peak / (1024 * 1024):.0f} MB")
+        # Cualquier error posterior al corte (p. ej. de un reintento) se reporta como exceso de memoria
+        raise MemoryBudgetExceeded(message) from (None if issubclass(exc_type, MemoryBudgetExceeded) else exc)
+
+def run_with_budget(label: str, func, *args, **kwargs):
+    """Ejecuta func(*args, **kwargs) en el hilo actual dentro de un MemoryBudget"""
+    with MemoryBudget(label):
+        return func(*args, **kwargs)
@@ -0,0 +1,420 @@
+"""Pipeline de procesamiento de archivos ANEXO a plantillas de dispersión.
+
+Lo usan tanto la API (main.py) como el CLI por lotes (rellenar_plantilla.py),
+por lo que no debe depender de la base de datos ni de FastAPI.
+"""
+import pandas as pd
+import openpyxl
+from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+import zipfile
+
+from banks import bank_name
+from intermediates import save_intermediate
+from layouts import LAYOUTS, layout_extension, write_layout
+from formats import sniff_format, sniff_text
+from memory_budget import MemoryBudget
+from row_rules import apply_rules
+
+logger = logging.getLogger(__name__)
+
+# Concepto fijo de la plantilla de dispersión
+CONCEPTO_DEFAULT = "PENSION POR RENTA VITALICIA"
+
+# Palabras clave para detectar columnas (en orden de prioridad)
+NAME_KEYWORDS = ["NOMBRE", "NOMBRE COMPLETO", "NOMBRECOMPLETO", "APELLIDO", "EMPLEADO"]
+CLABE_KEYWORDS = ["CLABE", "CLABEINTERBANCARIA", "CLABE INTERBANCARIA", "CUENTA", "BANCO"]
+AMOUNT_KEYWORDS = ["NETO", "NETO A DEPOSITAR", "MONTO", "IMPORTE", "PENSION", "PAGO", "CANTIDAD"]
+
+# Filas a revisar buscando el encabezado en archivos CSV
+CSV_HEADER_SEARCH_ROWS = 30
+
+
+OUTPUT_HEADERS = ['Nombre', 'Clabe', 'Monto', 'Concepto']
+
+# Ancho de cada columna de la plantilla; se puede cambiar al re-generar la salida
+DEFAULT_COLUMN_WIDTHS = {'Nombre': 35, 'Clabe': 25, 'Monto': 18, 'Concepto': 40}
+AMOUNT_FORMAT = '#,##0.00'
+
+# Cada cuántas filas el ciclo de escritura reporta avance
+PROGRESS_EVERY_ROWS = 500
+
+# "single": una plantilla; "by_bank": un .zip con una plantilla por banco destino
+OUTPUT_MODES = ("single", "by_bank")
+# "xlsx" (plantilla con estilos de openpyxl) o un formato de texto de layouts.py
+DEFAULT_OUTPUT_FORMAT = "xlsx"
+
+def output_formats():
+    return (DEFAULT_OUTPUT_FORMAT,) + tuple(LAYOUTS)
+
+def output_extension(output_format: str):
+    if output_format == DEFAULT_OUTPUT_FORMAT:
+        return ".xlsx"
+    return layout_extension(output_format)
+# Por debajo de estas filas, escribir por banco en paralelo no compensa arrancar procesos
+BANK_PARALLEL_MIN_ROWS = 5000
+
+class ThrottledProgress:
+    """Envuelve un callback de progreso y limita la frecuencia de sus llamadas.
+
+    Los cambios de etapa siempre se reportan; las actualizaciones dentro de una
+    misma etapa se descartan si llegan antes de min_interval segundos.
+    """
+
+    def __init__(self, callback, min_interval: float = 0.25):
+        self.callback = callback
+        self.min_interval = min_interval
+        self._stage = None
+        self._last = 0.0
+
+    def __call__(self, stage: str, **counts):
+        now = time.monotonic()
+        if stage == self._stage and now - self._last < self.min_interval:
+            return
+        self._stage = stage
+        self._last = now
+        self.callback(stage, **counts)
+
+def _no_progress(stage: str, **counts):
+    pass
+
+def find_col(df, keywords):
+    """Encuentra la columna que contiene las palabras clave (adaptado del script original)"""
+    for kw in keywords:
+        for c in df.columns:
+            if kw in str(c):
+                return c
+    return None
+
+def normalize_column_name(column):
+    """Normaliza un encabezado: sin espacios extremos, mayúsculas y sin acentos"""
+    return str(column).strip().upper().replace("Á","A").replace("É","E").replace("Í","I").replace("Ó","O").replace("Ú","U").replace("Ñ","N")
+
+def _csv_header_row(sample: str, delimiter: str):
+    """Índice de la primera fila que tiene al menos dos de las columnas buscadas"""
+    lines = sample.splitlines()[:CSV_HEADER_SEARCH_ROWS]
+    for index, values in enumerate(csv.reader(lines, delimiter=delimiter)):
+        columns = pd.Index([normalize_column_name(v) for v in values])
+        found = [find_col(pd.DataFrame(columns=columns), keywords) for keywords in (NAME_KEYWORDS, CLABE_KEYWORDS, AMOUNT_KEYWORDS)]
+        if sum(col is not None for col in found) >= 2:
+            return index
+    return 0
+
+def read_csv_source(file_path: str):
+    """Lee un CSV/TSV con el parser columnar de pandas (pyarrow si está instalado).
+
+    Todo se lee como texto para no perder dígitos de las CLABE; la limpieza
+    convierte después los montos.
+    """
+    encoding, delimiter, sample = sniff_text(file_path)
+    header_row = _csv_header_row(sample, delimiter)
+    options = {"sep": delimiter, "skiprows": header_row, "header": 0, "dtype": str, "encoding": encoding}
+    try:
+        df = pd.read_csv(file_path, engine="pyarrow", **options)
+    except (ImportError, ValueError):
+        # Sin pyarrow, o un archivo que su parser no acepta
+        df = pd.read_csv(file_path, engine="c", encoding_errors="replace", **options)
+    logger.info(f"CSV leído (codificación {encoding}, separador {delimiter!r}, header en fila {header_row + 1}), {len(df)} filas")
+    return df
+
+def read_source(file_path: str):
+    """Lee la hoja de datos del ANEXO con header en la fila 8 (index 7).
+
+    El formato se detecta por contenido: los CSV van por read_csv_source.
+    """
+    if sniff_format(file_path) == "csv":
+        return read_csv_source(file_path)
+    try:
+        df = pd.read_excel(file_path, sheet_name="ADMON. PENSION", header=7)
+        logger.info(f"Archivo leído con header en fila 8, {len(df)} filas")
+    except Exception:
+        # Si no funciona con sheet específica, intentar con la primera hoja
+        try:
+            df = pd.read_excel(file_path, header=7)
+            logger.info(f"Archivo leído con header en fila 8 (primera hoja), {len(df)} filas")
+        except Exception:
+            # Último intento: leer normalmente
+            df = pd.read_excel(file_path)
+            logger.info(f"Archivo leído normalmente, {len(df)} filas")
+    return df
+
+def clean_dataframe(df, stats=None):
+    """Detecta las columnas de nombre, CLABE e importe y genera el DataFrame de salida.
+
+    Si se pasa stats (dict), en stats["excluded"] quedan las filas excluidas
+    por datos incompletos y por cada regla de row_rules.py, y en
+    stats["excluded_names"] nombres de ejemplo de cada regla.
+    """
+    # Normalizar columnas como en el script original
+    df.columns = [normalize_column_name(c) for c in df.columns]
+    logger.debug("Columnas normalizadas: %s", list(df.columns))
+
+    # Buscar columnas específicas usando la misma lógica del script original
+    name_col = find_col(df, NAME_KEYWORDS)
+    clabe_col = find_col(df, CLABE_KEYWORDS)
+    amount_col = find_col(df, AMOUNT_KEYWORDS)
+
+    if not all([name_col, clabe_col, amount_col]):
+        missing = []
+        if not name_col: missing.append('nombre')
+        if not clabe_col: missing.append('CLABE')
+        if not amount_col: missing.append('importe')
+        logger.error(f"Columnas encontradas - Nombre: {name_col}, CLABE: {clabe_col}, Importe: {amount_col}")
+        raise ValueError(f"No se encontraron las columnas: {', '.join(missing)}")
+
+    # Crear DataFrame de salida como en el script original
+    df_out = pd.DataFrame()
+    df_out["Nombre"] = df[name_col]
+    df_out["Clabe"] = df[clabe_col]
+    df_out["Monto"] = df[amount_col]
+    df_out["Concepto"] = CONCEPTO_DEFAULT
+
+    # Limpieza básica como en el script original
+    # Convertir CLABEs de notación científica a formato correcto
+    # Las que ya son dígitos (texto de CSV o celdas de texto) se rellenan sin pasar
+    # por float, que pierde precisión con 18 dígitos
+    clabe_text = df_out["Clabe"].astype(str).str.strip()
+    is_digits = clabe_text.str.fullmatch(r"\d{1,18}")
+    clabes = clabe_text.str.zfill(18)
+    # Texto no numérico ("N/A", vacío) queda como CLABE vacía para la regla clabe_vacia
+    numeric_clabes = pd.to_numeric(df_out.loc[~is_digits, "Clabe"], errors="coerce")
+    clabes[~is_digits] = numeric_clabes.map(lambda x: f"{int(x):018d}" if pd.notna(x) else "")
+    df_out["Clabe"] = clabes
+    monto = df_out["Monto"]
+    if not pd.api.types.is_numeric_dtype(monto):
+        # Montos como texto ("$1,234.56")
+        monto = monto.astype(str).str.replace(r"[$,\s]", "", regex=True)
+    df_out["Monto"] = pd.to_numeric(monto, errors="coerce").round(2)
+
+    # Filtrar filas válidas
+    rows_before = len(df_out)
+    df_out = df_out.dropna(subset=["Nombre","Clabe","Monto"])
+    excluded = {"datos_incompletos": rows_before - len(df_out)}
+
+    # Filas de totales y basura (reglas configurables de row_rules.py)
+    df_out, rule_counts, excluded_names = apply_rules(df_out)
+    excluded.update(rule_counts)
+    if stats is not None:
+        stats["excluded"] = excluded
+        stats["excluded_names"] = excluded_names
+
+    logger.info(f"Datos procesados: {len(df_out)} filas válidas",
+                extra={"excluded": {rule: count for rule, count in excluded.items() if count}})
+    return df_out
+
+def write_workbook(df_clean, output_path: str, progress=_no_progress, column_widths=None, amount_format: str = AMOUNT_FORMAT):
+    """Escribe la plantilla de dispersión con el formato del script original"""
+    widths = {**DEFAULT_COLUMN_WIDTHS, **(column_widths or {})}
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Sheet1"
+
+    # Definir estilos como en el script original
+    header_font = Font(bold=True)
+    header_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
+    border = Border(
+        top=Side(style='thin'),
+        bottom=Side(style='thin'),
+        left=Side(style='thin'),
+        right=Side(style='thin')
+    )
+    center_alignment = Alignment(horizontal='center')
+
+    # Escribir encabezados en la primera fila
+    for col, header in enumerate(OUTPUT_HEADERS, 1):
+        cell = ws.cell(row=1, column=col, value=header)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.border = border
+        cell.alignment = center_alignment
+
+    # Escribir los datos a partir de la fila 2
+    for row_idx, (_, row_data) in enumerate(df_clean.iterrows(), start=2):
+        ws.cell(row=row_idx, column=1, value=row_data['Nombre'])
+        ws.cell(row=row_idx, column=2, value=row_data['Clabe'])
+
+        # Aplicar formato de número con separadores de miles a los montos
+        monto_cell = ws.cell(row=row_idx, column=3, value=row_data['Monto'])
+        monto_cell.number_format = amount_format
+
+        # Escribir el concepto en la columna 4
+        ws.cell(row=row_idx, column=4, value=row_data['Concepto'])
+
+        # Aplicar bordes a todas las celdas de datos
+        for col in range(1, 5):
+            ws.cell(row=row_idx, column=col).border = border
+
+        if row_idx % PROGRESS_EVERY_ROWS == 0:
+            progress("writing", rows_written=row_idx - 1)
+
+    # Ajustar ancho de columnas con espaciado mejorado
+    ws.column_dimensions['A'].width = widths['Nombre']
+    ws.column_dimensions['B'].width = widths['Clabe']
+    ws.column_dimensions['C'].width = widths['Monto']
+    ws.column_dimensions['D'].width = widths['Concepto']
+    ws.column_dimensions['E'].width = 5   # Columna vacía
+
+    wb.save(output_path)
+    logger.info(f"Archivo guardado en: {output_path}")
+
+def split_by_bank(df_clean):
+    """Agrupa las filas por código de banco (3 primeros dígitos de la CLABE) en una pasada"""
+    codes = df_clean["Clabe"].str[:3]
+    return [
+        (code, bank_name(code), group)
+        for code, group in df_clean.groupby(codes, sort=True)
+    ]
+
+def bank_filename(code: str, name: str, extension: str = ".xlsx"):
+    safe_name = re.sub(r"[^A-Z0-9]+", "_", name.upper()).strip("_")
+    return f"{code or '000'}_{safe_name}{extension}"
+
+def write_output(df_clean, output_path: str, output_format: str = DEFAULT_OUTPUT_FORMAT, progress=_no_progress, **options):
+    """Escribe una salida en output_format; las opciones de estilo solo aplican a xlsx"""
+    if output_format == DEFAULT_OUTPUT_FORMAT:
+        write_workbook(df_clean, output_path, progress, **options)
+    else:
+        write_layout(df_clean, output_path, output_format, progress)
+        logger.info(f"Archivo {output_format} guardado en: {output_path}")
+
+def _write_bank_file(task):
+    group, path, output_format, options = task
+    write_output(group, path, output_format, **options)
+    return len(group)
+
+def write_bank_bundle(df_clean, output_path: str, progress=_no_progress, max_workers: int = None,
+                      output_format: str = DEFAULT_OUTPUT_FORMAT, **options):
+    """Escribe un .zip con un archivo por banco y un resumen.csv con filas y totales.
+
+    Las plantillas xlsx se generan en paralelo (un proceso por banco, hasta
+    max_workers) cuando el archivo es grande. Regresa el resumen por banco.
+    """
+    groups = split_by_bank(df_clean)
+    summaries = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tasks = []
+        for code, name, group in groups:
+            filename = bank_filename(code, name, output_extension(output_format))
+            tasks.append((group, os.path.join(temp_dir, filename), output_format, options))
+            summaries.append({
+                "bank_code": code,
+                "bank_name": name,
+                "filename": filename,
+                "rows": len(group),
+                "total_amount": round(float(group["Monto"].sum()), 2),
+            })
+
+        workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+        rows_written = 0
+        # Los formatos de texto son rápidos: no vale la pena arrancar procesos
+        if workers > 1 and output_format == DEFAULT_OUTPUT_FORMAT and len(df_clean) >= BANK_PARALLEL_MIN_ROWS:
+            # spawn: el proceso padre puede tener hilos (API, watcher)
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                for rows in executor.map(_write_bank_file, tasks):
+                    rows_written += rows
+                    progress("writing", rows_written=rows_written)
+        else:
+            for task in tasks:
+                rows_written += _write_bank_file(task)
+                progress("writing", rows_written=rows_written)
+
+        manifest = io.StringIO()
+        writer = csv.writer(manifest)
+        writer.writerow(["codigo_banco", "banco", "archivo", "filas", "monto_total"])
+        for summary in summaries:
+            writer.writerow([summary["bank_code"], summary["bank_name"], summary["filename"],
+                             summary["rows"], f"{summary['total_amount']:.2f}"])
+        writer.writerow(["", "TOTAL", "", len(df_clean), f"{float(df_clean['Monto'].sum()):.2f}"])
+
+        # Los .xlsx ya vienen comprimidos: se guardan sin recomprimir
+        compress_type = zipfile.ZIP_STORED if output_format == DEFAULT_OUTPUT_FORMAT else zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(output_path, "w") as bundle:
+            for summary, (_, path, _, _) in zip(summaries, tasks):
+                bundle.write(path, summary["filename"], compress_type=compress_type)
+            bundle.writestr("resumen.csv", manifest.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+
+    logger.info(f"Paquete por banco guardado en: {output_path} ({len(summaries)} bancos)")
+    return summaries
+
+def render_output(df_clean, output_path: str, output_mode: str = "single", progress=_no_progress,
+                  concepto: str = None, column_widths=None, amount_format: str = AMOUNT_FORMAT,
+                  output_format: str = DEFAULT_OUTPUT_FORMAT):
+    """Genera la salida a partir del DataFrame limpio; regresa el resumen por banco o None"""
+    if concepto:
+        df_clean = df_clean.assign(Concepto=concepto)
+    options = {"column_widths": column_widths, "amount_format": amount_format}
+    if output_mode == "by_bank":
+        return write_bank_bundle(df_clean, output_path, progress, output_format=output_format, **options)
+    write_output(df_clean, output_path, output_format, progress, **options)
+    return None
+
+def process_excel_file(file_path: str, output_path: str, progress=None, output_mode: str = "single",
+                       intermediate_id: str = None, output_format: str = DEFAULT_OUTPUT_FORMAT):
+    """Procesa el archivo Excel y genera la plantilla de dispersión.
+
+    progress, si se indica, recibe (etapa, **contadores) con frecuencia limitada.
+    Con output_mode="by_bank" output_path es un .zip con una plantilla por banco.
+    output_format elige entre la plantilla xlsx y los formatos de texto de layouts.py.
+    Con intermediate_id se guarda el DataFrame limpio para re-generar la salida
+    sin volver a leer el Excel (ver intermediates.py).
+    Regresa un diccionario con filas, monto total y tiempos por etapa (y el
+    resumen por banco en "banks", las filas excluidas por regla en "excluded",
+    nombres de ejemplo de esas filas en "excluded_names" y las filas de la
+    plantilla en "payments").
+    """
+    progress = ThrottledProgress(progress) if progress else _no_progress
+    filename = os.path.basename(file_path)
+    try:
+        # Presupuesto de memoria del trabajo: aborta con MemoryBudgetExceeded (worker, watcher e hijos de la API)
+        with MemoryBudget(f"la lectura de {filename}") as budget:
+            started = time.perf_counter()
+            progress("reading")
+            df = read_source(file_path)
+            read_done = time.perf_counter()
+
+            budget.label = f"la limpieza de {filename}"
+            progress("cleaning", rows_read=len(df))
+            clean_stats = {}
+            df_clean = clean_dataframe(df, clean_stats)
+            if intermediate_id:
+                try:
+                    save_intermediate(intermediate_id, df_clean)
+                except Exception as e:
+                    # El intermedio es una optimización: no debe fallar el procesamiento
+                    logger.warning(f"No se pudo guardar el intermedio de {intermediate_id}: {e}")
+            clean_done = time.perf_counter()
+
+            budget.label = f"la escritura de la plantilla de {filename}"
+            progress("writing", rows_read=len(df), rows_written=0)
+            banks = render_output(df_clean, output_path, output_mode, progress, output_format=output_format)
+            write_done = time.perf_counter()
+            progress("written", rows_read=len(df), rows_written=len(df_clean))
+
+        return {
+            "rows": len(df_clean),
+            "banks": banks,
+            "total_amount": round(float(df_clean["Monto"].sum()), 2),
+            "excluded": clean_stats["excluded"],
+            "excluded_names": clean_stats["excluded_names"],
+            # Filas de la plantilla para la revisión de duplicados (duplicates.py)
+            "payments": df_clean[["Nombre", "Clabe", "Monto"]],
+            "timings": {
+                "read": round(read_done - started, 4),
+                "clean": round(clean_done - read_done, 4),
+                "write": round(write_done - clean_done, 4),
+                "total": round(write_done - started, 4),
+            },
+        }
+
+    except Exception as e:
+        logger.error(f"Error procesando archivo: {str(e)}")
+        raise
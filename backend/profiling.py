@@ -0,0 +1,81 @@
+"""Perfilado bajo demanda de /upload-process.
+
+Con PROFILING_ENABLED=true, una petición con el header X-Profile (o
+?profile=true) se procesa bajo un profiler de muestreo. El resultado se guarda
+en formato "folded stacks" (una pila por línea con su número de muestras),
+que aceptan flamegraph.pl, speedscope e inferno.
+
+Si el switch está apagado no se crea ningún hilo ni se toca el código del
+pipeline: el costo es cero.
+"""
+import os
+import sys
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# Si se define, el header X-Profile debe traer este valor
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILES_DIR = os.getenv("PROFILES_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+def profiling_requested(header_value, query_value: bool):
+    """Indica si la petición pidió perfilado y la configuración lo permite"""
+    if not PROFILING_ENABLED:
+        return False
+    if PROFILING_TOKEN:
+        return header_value == PROFILING_TOKEN
+    return bool(header_value) or query_value
+
+def profile_path(processing_id: str):
+    return os.path.join(PROFILES_DIR, f"{processing_id}.folded")
+
+class SamplingProfiler(threading.Thread):
+    """Muestrea periódicamente la pila de un hilo y acumula pilas "folded" """
+
+    def __init__(self, target_thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+def run_profiled(processing_id: str, func, *args):
+    """Ejecuta func(*args) en el hilo actual bajo el profiler y guarda el perfil.
+
+    Regresa el resultado de func y la ruta del perfil.
+    """
+    profiler = SamplingProfiler(threading.get_ident())
+    profiler.start()
+    try:
+        result = func(*args)
+    finally:
+        profiler.stop()
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        path = profile_path(processing_id)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.folded())
+    return result, path
@@ -0,0 +1,100 @@
+"""Ruteo de consultas de solo lectura a la réplica (READ_REPLICA_URL).
+
+El historial, el historial paginado y las búsquedas de descargas usan
+get_read_db: con réplica configurada se ejecutan en ella, con su propio pool
+(READ_POOL_SIZE), y no compiten con las escrituras del procesamiento en el
+primario. Sin réplica todo usa el primario.
+
+Lee-tus-escrituras: los endpoints que escriben llaman mark_recent_write, que
+deja la cookie READ_PRIMARY_COOKIE con la hora hasta la que ese navegador
+lee del primario (READ_YOUR_WRITES_SECONDS, más que el retraso normal de la
+réplica). Así el historial que se refresca justo después de una subida ya
+la incluye. Las consultas por id (descarga, duplicados, perfil y
+conciliación) que responden 404 en la réplica se reintentan en el primario
+(p. ej. un enlace recién compartido).
+
+El caché de historial (history_cache.py) sigue siendo consistente: su llave
+incluye la versión de la tabla, leída de la misma base que arma la respuesta.
+"""
+import os
+import time
+from fastapi import HTTPException, Request, Response
+from dotenv import load_dotenv
+
+from database import SessionLocal, ReadSessionLocal, replica_enabled
+
+# Cargar variables de entorno
+load_dotenv()
+
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", "30"))
+READ_PRIMARY_COOKIE = "read_primary_until"
+
+class ReadRouter:
+    """Elige la base de cada lectura y cuenta a dónde se enviaron"""
+
+    def __init__(self):
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.primary_fallbacks = 0
+
+    def reads_from_primary(self, request: Request):
+        if not replica_enabled():
+            return True
+        try:
+            return int(request.cookies.get(READ_PRIMARY_COOKIE, "0")) > time.time()
+        except ValueError:
+            return False
+
+    def session(self, request: Request):
+        if self.reads_from_primary(request):
+            self.primary_reads += 1
+            return SessionLocal()
+        self.replica_reads += 1
+        session = ReadSessionLocal()
+        session.info["replica"] = True
+        return session
+
+    def stats(self):
+        return {
+            "replica_enabled": replica_enabled(),
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "primary_fallbacks": self.primary_fallbacks,
+            "read_your_writes_seconds": READ_YOUR_WRITES_SECONDS,
+        }
+
+read_router = ReadRouter()
+
+def get_read_db(request: Request):
+    """Sesión para consultas de solo lectura: réplica, o primario tras una escritura propia"""
+    db = read_router.session(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+def mark_recent_write(response: Response):
+    """Las lecturas de este cliente van al primario durante READ_YOUR_WRITES_SECONDS"""
+    if not replica_enabled() or READ_YOUR_WRITES_SECONDS <= 0:
+        return
+    response.set_cookie(
+        READ_PRIMARY_COOKIE,
+        str(int(time.time()) + READ_YOUR_WRITES_SECONDS),
+        max_age=READ_YOUR_WRITES_SECONDS,
+        httponly=True,
+        samesite="lax",
+    )
+
+def retry_on_primary(db, func):
+    """Regresa func(db); si db es de la réplica y func responde 404, la repite en el primario"""
+    try:
+        return func(db)
+    except HTTPException as e:
+        if e.status_code != 404 or not db.info.get("replica"):
+            raise
+    read_router.primary_fallbacks += 1
+    primary = SessionLocal()
+    try:
+        return func(primary)
+    finally:
+        primary.close()
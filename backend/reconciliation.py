@@ -0,0 +1,242 @@
+"""Conciliación del archivo de respuesta del banco contra una dispersión.
+
+El archivo del banco (CSV o XLSX) se cruza con las filas de la plantilla de
+un processing_id mediante joins hash de pandas:
+
+1. CLABE + monto en centavos.
+2. Para lo que quede sin pareja, nombre normalizado + monto.
+
+Las llaves repetidas (misma persona y monto dos veces) se emparejan una a
+una numerando cada ocurrencia. Las parejas cuyo estatus del banco indica
+rechazo o devolución quedan como "rejected"; el resto de nuestras filas son
+"missing" y las del banco sin pareja, "unexpected".
+
+Como pipeline.py, no depende de la base de datos ni de FastAPI.
+"""
+import csv
+import io
+import logging
+import os
+import time
+import zipfile
+import pandas as pd
+
+from pipeline import find_col, normalize_column_name
+
+logger = logging.getLogger(__name__)
+
+# Columnas del archivo del banco (en orden de prioridad)
+BANK_CLABE_KEYWORDS = ["CLABE", "CUENTA DESTINO", "CUENTA BENEFICIARIO", "CUENTA"]
+BANK_AMOUNT_KEYWORDS = ["MONTO", "IMPORTE", "CANTIDAD", "NETO"]
+BANK_NAME_KEYWORDS = ["BENEFICIARIO", "NOMBRE", "TITULAR"]
+BANK_STATUS_KEYWORDS = ["ESTATUS", "STATUS", "ESTADO", "RESULTADO"]
+BANK_REASON_KEYWORDS = ["MOTIVO", "CAUSA", "DESCRIPCION", "OBSERVACION", "DETALLE"]
+
+# Estatus del banco que significan que el pago no se aplicó
+REJECTED_STATUS_KEYWORDS = ["RECHAZ", "DEVUEL", "DEVOL", "CANCEL", "ERROR", "FALLID", "NO APLICAD"]
+
+# Filas a revisar buscando el encabezado del archivo del banco
+HEADER_SEARCH_ROWS = 20
+
+RESULT_SETS = ("matched", "rejected", "missing", "unexpected")
+
+# Columnas auxiliares presentes de ambos lados del join
+_JOIN_KEYS = ["clabe", "name_key", "cents"]
+
+def _locate_header(raw):
+    """Usa como encabezado la primera fila que contenga una columna de CLABE"""
+    for index in range(min(HEADER_SEARCH_ROWS, len(raw))):
+        values = [normalize_column_name(v) for v in raw.iloc[index].fillna("")]
+        if any(kw in value for value in values for kw in BANK_CLABE_KEYWORDS):
+            df = raw.iloc[index + 1:].reset_index(drop=True)
+            df.columns = values
+            return df
+    raise ValueError("No se encontró la columna de CLABE en el archivo del banco")
+
+def _read_csv_text(path: str):
+    for encoding in ("utf-8-sig", "latin-1"):
+        try:
+            with open(path, encoding=encoding, newline="") as f:
+                sample = f.read(64 * 1024)
+            break
+        except UnicodeDecodeError:
+            continue
+    try:
+        delimiter = csv.Sniffer().sniff(sample, delimiters=",;|\t").delimiter
+    except csv.Error:
+        delimiter = ","
+    return pd.read_csv(path, sep=delimiter, header=None, dtype=str, encoding=encoding,
+                       keep_default_na=False, skip_blank_lines=True)
+
+def read_bank_file(path: str):
+    """Lee el archivo del banco (CSV/TXT o Excel) sin convertir tipos"""
+    if path.lower().endswith((".csv", ".txt")):
+        raw = _read_csv_text(path)
+    else:
+        raw = pd.read_excel(path, header=None, dtype=str)
+    return _locate_header(raw)
+
+def read_dispersion(path: str):
+    """Filas de la plantilla generada (.xlsx o paquete .zip por banco)"""
+    if path.lower().endswith(".zip"):
+        frames = []
+        with zipfile.ZipFile(path) as bundle:
+            for name in bundle.namelist():
+                if name.lower().endswith(".xlsx"):
+                    with bundle.open(name) as member:
+                        frames.append(pd.read_excel(io.BytesIO(member.read()), dtype={"Clabe": str}))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["Nombre", "Clabe", "Monto"])
+    return pd.read_excel(path, dtype={"Clabe": str})
+
+def normalize_clabe(series):
+    values = series.fillna("").astype(str).str.strip()
+    # Solo las que no son ya 18 dígitos pasan por la limpieza con regex
+    dirty = ~values.str.fullmatch(r"\d{18}")
+    if dirty.any():
+        values = values.copy()
+        part = values[dirty]
+        # CLABEs que Excel convirtió a notación científica
+        scientific = part.str.fullmatch(r"\d(?:\.\d+)?E\+\d+", case=False)
+        if scientific.any():
+            part = part.copy()
+            part[scientific] = part[scientific].map(lambda x: f"{int(float(x)):018d}")
+        digits = part.str.replace(r"\D", "", regex=True)
+        values[dirty] = digits.where(digits == "", digits.str.zfill(18))
+    return values
+
+def normalize_name(series):
+    return (
+        series.fillna("").astype(str)
+        .str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+        .str.upper()
+        .str.replace(r"[^A-Z0-9]+", " ", regex=True)
+        .str.strip()
+    )
+
+def amount_cents(series):
+    # pandas 3 lee el texto con dtype str, no object
+    if pd.api.types.is_string_dtype(series) or series.dtype == object:
+        series = series.astype(str).str.replace(r"[$,\s]", "", regex=True)
+    amounts = pd.to_numeric(series, errors="coerce")
+    return (amounts * 100).round().astype("Int64")
+
+def _with_occurrence(df, key_columns, name):
+    """Numera las repeticiones de cada llave para emparejar una a una"""
+    df = df.copy()
+    df[name] = df.groupby(key_columns, sort=False).cumcount()
+    return df
+
+def _join(ours, bank, key_columns):
+    """Join hash 1:1 sobre key_columns; regresa (parejas, ours restantes, bank restantes)"""
+    ours_k = _with_occurrence(ours[(ours[key_columns[0]] != "") & ours["cents"].notna()], key_columns, "_occ")
+    bank_k = _with_occurrence(bank[(bank[key_columns[0]] != "") & bank["cents"].notna()], key_columns, "_occ")
+    bank_k = bank_k.drop(columns=[c for c in _JOIN_KEYS if c not in key_columns and c in bank_k.columns])
+    pairs = ours_k.merge(bank_k, on=key_columns + ["_occ"], how="inner")
+    ours_left = ours[~ours["_row"].isin(pairs["_row"])]
+    bank_left = bank[~bank["_bank_row"].isin(pairs["_bank_row"])]
+    return pairs, ours_left, bank_left
+
+def reconcile(dispersion, bank_df):
+    """Cruza la dispersión con el archivo del banco.
+
+    Regresa (resultado, resumen): un DataFrame con una fila por registro y su
+    conjunto ("resultado"), y los conteos y montos por conjunto.
+    """
+    clabe_col = find_col(bank_df, BANK_CLABE_KEYWORDS)
+    amount_col = find_col(bank_df, BANK_AMOUNT_KEYWORDS)
+    if not clabe_col or not amount_col:
+        raise ValueError("El archivo del banco debe tener columnas de CLABE y monto")
+    name_col = find_col(bank_df, BANK_NAME_KEYWORDS)
+    status_col = find_col(bank_df, BANK_STATUS_KEYWORDS)
+    reason_col = find_col(bank_df, BANK_REASON_KEYWORDS)
+
+    ours = pd.DataFrame({
+        "_row": range(len(dispersion)),
+        "nombre": dispersion["Nombre"].astype(str).values,
+        "clabe": normalize_clabe(dispersion["Clabe"]).values,
+        "monto": pd.to_numeric(dispersion["Monto"], errors="coerce").values,
+    })
+    ours["cents"] = amount_cents(ours["monto"])
+
+    bank = pd.DataFrame({
+        "_bank_row": range(len(bank_df)),
+        "nombre_banco": bank_df[name_col].values if name_col else "",
+        "clabe_banco": normalize_clabe(bank_df[clabe_col]).values,
+        "monto_banco": pd.to_numeric(bank_df[amount_col].astype(str).str.replace(r"[$,\s]", "", regex=True), errors="coerce").values,
+        "estatus_banco": bank_df[status_col].fillna("").astype(str).values if status_col else "",
+        "motivo": bank_df[reason_col].fillna("").astype(str).values if reason_col else "",
+    })
+    # Filas vacías o de totales del archivo del banco
+    bank = bank[(bank["clabe_banco"] != "") | bank["monto_banco"].notna()]
+    bank["cents"] = amount_cents(bank["monto_banco"])
+    bank["clabe"] = bank["clabe_banco"]
+
+    by_clabe, ours_left, bank_left = _join(ours, bank, ["clabe", "cents"])
+    by_clabe["metodo"] = "clabe"
+    if name_col:
+        # Respaldo: la CLABE no coincide pero el nombre y el monto sí. Los
+        # nombres solo se normalizan para las filas que quedaron sin pareja
+        ours_left = ours_left.assign(name_key=normalize_name(ours_left["nombre"]))
+        bank_left = bank_left.assign(name_key=normalize_name(bank_left["nombre_banco"]))
+        by_name, ours_left, bank_left = _join(ours_left, bank_left, ["name_key", "cents"])
+    else:
+        by_name = by_clabe.iloc[0:0]
+    by_name = by_name.assign(metodo="nombre")
+
+    pairs = pd.concat([by_clabe, by_name], ignore_index=True)
+    rejected = pairs["estatus_banco"].astype(str).str.upper().str.contains(
+        "|".join(REJECTED_STATUS_KEYWORDS), regex=True
+    )
+    pairs["resultado"] = "matched"
+    pairs.loc[rejected, "resultado"] = "rejected"
+
+    missing = ours_left.assign(resultado="missing", metodo="")
+    unexpected = bank_left.assign(resultado="unexpected", metodo="", nombre="", clabe="", monto=float("nan"))
+
+    columns = ["resultado", "metodo", "nombre", "clabe", "monto",
+               "nombre_banco", "clabe_banco", "monto_banco", "estatus_banco", "motivo"]
+    result = pd.concat(
+        [frame.reindex(columns=columns) for frame in (pairs, missing, unexpected)],
+        ignore_index=True
+    )
+
+    summary = {}
+    for name in RESULT_SETS:
+        subset = result[result["resultado"] == name]
+        amount = subset["monto_banco"] if name == "unexpected" else subset["monto"]
+        summary[name] = {"rows": int(len(subset)), "amount": round(float(amount.sum()), 2)}
+    summary["by_method"] = {
+        "clabe": int(len(by_clabe)),
+        "nombre": int(len(by_name)),
+    }
+    summary["dispersion_rows"] = int(len(ours))
+    summary["bank_rows"] = int(len(bank))
+    return result, summary
+
+def reconcile_files(dispersion, bank_path: str, result_path: str):
+    """Lee el archivo del banco, concilia y escribe el detalle en result_path (CSV).
+
+    dispersion es el DataFrame limpio (intermedio) o la ruta de la plantilla xlsx.
+    """
+    started = time.perf_counter()
+    if isinstance(dispersion, str):
+        dispersion = read_dispersion(dispersion)
+    bank_df = read_bank_file(bank_path)
+    read_done = time.perf_counter()
+
+    result, summary = reconcile(dispersion, bank_df)
+    match_done = time.perf_counter()
+
+    result.to_csv(result_path, index=False, float_format="%.2f")
+    write_done = time.perf_counter()
+
+    summary["timings"] = {
+        "read": round(read_done - started, 4),
+        "match": round(match_done - read_done, 4),
+        "write": round(write_done - match_done, 4),
+        "total": round(write_done - started, 4),
+    }
+    logger.info(f"Conciliación: {summary['matched']['rows']} conciliadas, "
+                f"{summary['rejected']['rows']} rechazadas, {summary['missing']['rows']} faltantes, "
+                f"{summary['unexpected']['rows']} inesperadas ({os.path.basename(bank_path)})")
+    return summary
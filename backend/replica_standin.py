@@ -0,0 +1,59 @@
+"""Réplica local con dos bases SQLite para probar read_routing.py.
+
+Copia periódicamente la base de DATABASE_URL sobre la de READ_REPLICA_URL
+con la API de respaldo de sqlite3, lo que simula una réplica con un retraso
+de hasta --interval segundos.
+
+Uso:
+    export DATABASE_URL=sqlite:///./app.db
+    export READ_REPLICA_URL=sqlite:///./app_replica.db
+    python replica_standin.py [--interval 2] [--once]
+
+Con la API corriendo con las mismas variables, el historial se lee de
+app_replica.db; justo después de una subida propia se lee de app.db.
+"""
+import argparse
+import logging
+import sqlite3
+import time
+from sqlalchemy.engine import make_url
+
+from database import DATABASE_URL, READ_REPLICA_URL, create_tables
+from logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+def sqlite_path(url: str):
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or not parsed.database or parsed.database == ":memory:":
+        raise ValueError(f"Se necesita una base SQLite en archivo: {url}")
+    return parsed.database
+
+def sync(primary_path: str, replica_path: str):
+    """Copia la base primaria completa sobre la réplica"""
+    with sqlite3.connect(primary_path) as primary, sqlite3.connect(replica_path) as replica:
+        primary.backup(replica)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replica una base SQLite sobre otra cada cierto tiempo")
+    parser.add_argument("--interval", type=float, default=2.0, help="segundos entre copias (retraso simulado)")
+    parser.add_argument("--once", action="store_true", help="copiar una sola vez y salir")
+    args = parser.parse_args()
+
+    setup_logging()
+    if not READ_REPLICA_URL:
+        raise SystemExit("Define READ_REPLICA_URL con la ruta de la base réplica")
+    primary_path = sqlite_path(DATABASE_URL)
+    replica_path = sqlite_path(READ_REPLICA_URL)
+    create_tables()
+
+    while True:
+        started = time.perf_counter()
+        sync(primary_path, replica_path)
+        logger.debug(f"Réplica sincronizada en {time.perf_counter() - started:.3f} s")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
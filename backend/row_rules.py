@@ -0,0 +1,171 @@
+"""Reglas para excluir filas de totales y basura de la plantilla.
+
+Cada regla se define de forma declarativa en ROW_RULES:
+
+- "exact": el nombre normalizado es igual a uno de "values".
+- "prefix": el nombre empieza con uno de "values" como palabra completa
+  ("TOTAL GENERAL" coincide con TOTAL; "TOTALITO" no). Es amplia: TOTAL
+  también excluye a "TOTAL PLAY TELECOMUNICACIONES", así que no se usa en
+  las reglas por omisión.
+- "regex": el nombre normalizado coincide con "pattern" (re.search).
+- "numeric": el nombre solo tiene dígitos, espacios y signos de puntuación.
+- "zero": el monto es cero.
+- "blank": la CLABE está vacía.
+
+Los nombres se normalizan una sola vez (mayúsculas, sin acentos, espacios
+colapsados) y cada regla se compila en una función que regresa una máscara
+booleana vectorizada sobre el DataFrame (métodos .str de pandas). Cada fila
+excluida se atribuye a la primera regla que la cumple, así que los conteos
+por regla suman el total.
+Además de los conteos se reportan hasta EXCLUDED_NAMES_LIMIT nombres por
+regla, para revisar que no se excluyan beneficiarios reales.
+
+Las variantes de totales por omisión solo aceptan la forma completa de una
+fila de totales ("TOTAL:", "SUB TOTAL", "TOTAL GENERAL", "IVA 16%"): un
+beneficiario como "COMISION FEDERAL DE ELECTRICIDAD" o "IVA ACREDITABLE"
+no se excluye.
+
+Las reglas de filas inválidas (nombre numérico, monto cero y CLABE vacía)
+cambian lo que llega a la plantilla respecto a la limpieza original, por lo
+que no están activas por omisión: ROW_RULES_STRICT=true las agrega después
+de las de totales.
+
+ROW_RULES_FILE puede apuntar a un JSON con una lista de reglas con la misma
+estructura, que reemplaza a ROW_RULES.
+"""
+import json
+import os
+import re
+import unicodedata
+import pandas as pd
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+ROW_RULES_FILE = os.getenv("ROW_RULES_FILE", "")
+# Agrega STRICT_ROW_RULES a las reglas por omisión
+ROW_RULES_STRICT = os.getenv("ROW_RULES_STRICT", "false").lower() == "true"
+# Nombres de ejemplo que se reportan por regla
+EXCLUDED_NAMES_LIMIT = int(os.getenv("EXCLUDED_NAMES_LIMIT", "20"))
+
+ROW_RULES = [
+    {"name": "totales", "type": "exact",
+     "values": ["NETO A DEPOSITAR", "COMISION", "SUBTOTAL", "IVA", "TOTAL", "TOTALES", "GRAN TOTAL"]},
+    # Formas completas de una fila de totales, con puntuación o porcentaje al final
+    {"name": "totales_variantes", "type": "regex",
+     "pattern": r"^(?:(?:SUB ?|GRAN )?TOTAL(?:ES)?(?: GENERAL)?"
+                r"|(?:NETO A DEPOSITAR|COMISION(?:ES)?|IVA)(?: \(?\d+(?:\.\d+)? ?%\)?)?)\W*$"},
+]
+
+# Filas inválidas: solo con ROW_RULES_STRICT=true
+STRICT_ROW_RULES = [
+    {"name": "nombre_numerico", "type": "numeric"},
+    {"name": "monto_cero", "type": "zero"},
+    {"name": "clabe_vacia", "type": "blank"},
+]
+
+# Columna de la plantilla que revisa cada tipo de regla por omisión
+RULE_COLUMNS = {
+    "exact": "Nombre",
+    "prefix": "Nombre",
+    "regex": "Nombre",
+    "numeric": "Nombre",
+    "zero": "Monto",
+    "blank": "Clabe",
+}
+
+_SEPARATOR = "\x00"
+
+def _fold(value: str):
+    return unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode("ascii").upper()
+
+def normalize_text(series):
+    """Mayúsculas, sin acentos y con espacios colapsados.
+
+    Los acentos se quitan sobre todos los valores unidos en una sola cadena
+    (NFKD y encode corren en C); por valor solo queda colapsar espacios.
+    """
+    values = series.fillna("").astype(str).tolist()
+    folded = _fold(_SEPARATOR.join(values)).split(_SEPARATOR)
+    if len(folded) != len(values):
+        # Algún valor contiene el separador
+        folded = [_fold(value) for value in values]
+    return pd.Series([" ".join(value.split()) for value in folded], index=series.index, dtype=object)
+
+class _Frame:
+    """Columnas derivadas que comparten las reglas (se calculan una vez)"""
+
+    def __init__(self, df):
+        self.df = df
+        self._normalized = {}
+
+    def text(self, column: str):
+        if column not in self._normalized:
+            self._normalized[column] = normalize_text(self.df[column])
+        return self._normalized[column]
+
+def _compile(rule):
+    rule_type = rule.get("type")
+    if rule_type not in RULE_COLUMNS:
+        raise ValueError(f"Tipo de regla desconocido: {rule_type} ({rule.get('name')})")
+    column = rule.get("column", RULE_COLUMNS[rule_type])
+
+    if rule_type == "exact":
+        values = set(normalize_text(pd.Series(rule["values"])))
+        return lambda frame: frame.text(column).isin(values)
+    if rule_type == "prefix":
+        values = normalize_text(pd.Series(rule["values"]))
+        pattern = re.compile(r"(?:" + "|".join(re.escape(v) for v in values) + r")\b")
+        return lambda frame: frame.text(column).str.match(pattern, na=False)
+    if rule_type == "regex":
+        pattern = re.compile(rule["pattern"])
+        return lambda frame: frame.text(column).str.contains(pattern, regex=True, na=False)
+    if rule_type == "numeric":
+        return lambda frame: frame.text(column).str.fullmatch(r"[\d\W_]+", na=False)
+    if rule_type == "zero":
+        return lambda frame: pd.to_numeric(frame.df[column], errors="coerce").fillna(0).round(2).eq(0)
+    # blank
+    return lambda frame: frame.text(column).eq("")
+
+def compile_rules(rules):
+    """Regresa [(nombre, función de máscara)] en el orden de las reglas"""
+    compiled = []
+    for index, rule in enumerate(rules):
+        compiled.append((rule.get("name") or f"regla_{index + 1}", _compile(rule)))
+    return compiled
+
+def _load_rules_file(path: str):
+    with open(path, encoding="utf-8") as f:
+        rules = json.load(f)
+    if not isinstance(rules, list):
+        raise ValueError(f"{path} debe contener una lista de reglas")
+    return rules
+
+if ROW_RULES_FILE:
+    ROW_RULES = _load_rules_file(ROW_RULES_FILE)
+elif ROW_RULES_STRICT:
+    ROW_RULES = ROW_RULES + STRICT_ROW_RULES
+
+COMPILED_RULES = compile_rules(ROW_RULES)
+
+def apply_rules(df, rules=None, name_column: str = "Nombre"):
+    """Excluye las filas que cumplen alguna regla.
+
+    Regresa (DataFrame filtrado, {regla: filas excluidas},
+    {regla: hasta EXCLUDED_NAMES_LIMIT nombres excluidos}).
+    """
+    rules = COMPILED_RULES if rules is None else rules
+    frame = _Frame(df)
+    excluded = pd.Series(False, index=df.index)
+    counts = {}
+    names = {}
+    for name, mask_for in rules:
+        mask = mask_for(frame).fillna(False).astype(bool)
+        # Atribuir cada fila a la primera regla que la excluye
+        attributed = mask & ~excluded
+        counts[name] = int(attributed.sum())
+        if counts[name] and name_column in df.columns:
+            names[name] = df.loc[attributed, name_column].head(EXCLUDED_NAMES_LIMIT).astype(str).tolist()
+        excluded |= mask
+    return df[~excluded], counts, names
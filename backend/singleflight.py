@@ -0,0 +1,106 @@
+"""Combinación de subidas idénticas en curso (single-flight) para /upload-process.
+
+Cuando el timeout del cliente vence, el usuario suele volver a subir el mismo
+archivo mientras la primera petición sigue procesándose. Las peticiones con
+la misma llave (SHA-256 del contenido, opciones de salida, perfilado y el header
+Idempotency-Key opcional) se adjuntan al procesamiento que ya está en curso
+y reciben su mismo resultado, sin ocupar otro lugar en upload_admission.
+
+El resultado de un procesamiento completado se conserva
+UPLOAD_COALESCE_TTL segundos para los reintentos que llegan justo después.
+Los errores no se conservan: el siguiente intento vuelve a procesar.
+
+El registro es por proceso: con varias réplicas de la API cada una combina
+sus propias peticiones.
+"""
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+UPLOAD_COALESCE_TTL = float(os.getenv("UPLOAD_COALESCE_TTL", "60"))
+
+class Flight:
+    def __init__(self, leader_id: str, task):
+        self.leader_id = leader_id
+        self.task = task
+        self.followers = 0
+
+class SingleFlight:
+    """Ejecuta una sola vez el trabajo de cada llave y comparte su resultado"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._flights = {}
+        # llave -> (expira, id del líder, resultado)
+        self._recent = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.coalesced_recent = 0
+
+    def _purge_recent(self):
+        now = time.monotonic()
+        for key, (expires, _, _) in list(self._recent.items()):
+            if expires <= now:
+                del self._recent[key]
+
+    def _release(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def leader_for(self, key):
+        """id del procesamiento al que se adjuntaría una petición con esta llave, o None"""
+        self._purge_recent()
+        if key in self._flights:
+            return self._flights[key].leader_id
+        if key in self._recent:
+            return self._recent[key][1]
+        return None
+
+    async def run(self, key, leader_id: str, factory, keep=None):
+        """Regresa el resultado de factory() para key, ejecutándolo solo si no hay uno en curso.
+
+        keep(resultado) decide si el resultado se conserva para reintentos posteriores.
+        """
+        self._purge_recent()
+        if key in self._recent:
+            self.coalesced_recent += 1
+            return self._recent[key][2]
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            flight.followers += 1
+            # shield: si esta petición se cancela, el procesamiento del líder sigue
+            return await asyncio.shield(flight.task)
+
+        self.leaders += 1
+        flight = self._flights[key] = Flight(leader_id, asyncio.ensure_future(factory()))
+        try:
+            result = await asyncio.shield(flight.task)
+        finally:
+            if flight.task.done():
+                self._release(key, flight)
+            else:
+                # El líder se canceló: la llave se libera cuando termine el trabajo
+                flight.task.add_done_callback(lambda _: self._release(key, flight))
+        if self.ttl > 0 and (keep is None or keep(result)):
+            self._recent[key] = (time.monotonic() + self.ttl, leader_id, result)
+        return result
+
+    def stats(self):
+        self._purge_recent()
+        return {
+            "in_flight": len(self._flights),
+            "waiting_followers": sum(flight.followers for flight in self._flights.values()),
+            "recent_results": len(self._recent),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_recent": self.coalesced_recent,
+            "ttl_seconds": self.ttl,
+        }
+
+upload_flights = SingleFlight(UPLOAD_COALESCE_TTL)
@@ -0,0 +1,63 @@
+"""Ubicación de los archivos procesados y utilidades de archivos compartidas"""
+import hashlib
+import os
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Directorio permanente de archivos procesados (volumen compartido en Docker)
+PROCESSED_FILES_DIR = os.getenv("PROCESSED_FILES_DIR", "processed_files")
+
+# Archivos subidos pendientes de procesar por la cola de trabajos (también compartido)
+UPLOADS_DIR = os.getenv("UPLOADS_DIR", "uploads")
+
+def processed_file_path(processing_id: str, filename: str):
+    """Ruta del archivo procesado de un registro de ProcessingHistory"""
+    return os.path.join(PROCESSED_FILES_DIR, f"{processing_id}_{filename}")
+
+def reconciliation_file_path(processing_id: str):
+    """Detalle CSV de la última conciliación de un procesamiento"""
+    return os.path.join(PROCESSED_FILES_DIR, f"{processing_id}_conciliacion.csv")
+
+def upload_file_path(processing_id: str, filename: str):
+    """Ruta del archivo original guardado para la cola de trabajos"""
+    return os.path.join(UPLOADS_DIR, f"{processing_id}_{os.path.basename(filename)}")
+
+# Tipos de contenido de los archivos que genera el sistema
+MEDIA_TYPES = {
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".zip": "application/zip",
+    ".csv": "text/csv",
+    ".txt": "text/plain",
+}
+
+def media_type_for(filename: str):
+    return MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024):
+    """Hash SHA-256 del contenido de un archivo, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class UploadTooLarge(Exception):
+    """El archivo superó max_bytes mientras se copiaba"""
+
+def save_stream(source, path: str, chunk_size: int = 1024 * 1024, max_bytes: int = None):
+    """Copia un archivo abierto a path por bloques; regresa (bytes, SHA-256).
+
+    Con max_bytes, la copia se detiene con UploadTooLarge en cuanto lo supera.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as buffer:
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise UploadTooLarge(f"{path} supera {max_bytes} bytes")
+            digest.update(chunk)
+            buffer.write(chunk)
+    return size, digest.hexdigest()
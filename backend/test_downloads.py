@@ -0,0 +1,92 @@
+"""Descargas condicionales y por rangos: 200, 304, 206 y 416"""
+import hashlib
+import os
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import ProcessingHistory
+from storage import processed_file_path
+
+CONTENT = b"Nombre,Clabe,Monto,Concepto\r\n" * 100
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+@pytest.fixture
+def processed(db):
+    """Procesamiento completado con su archivo en PROCESSED_FILES_DIR"""
+    processing_id = str(uuid.uuid4())
+    filename = "plantilla.csv"
+    path = processed_file_path(processing_id, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(CONTENT)
+    db.add(ProcessingHistory(
+        id=processing_id,
+        filename=filename,
+        original_filename="nomina.xlsx",
+        processed_filename=filename,
+        rows_processed=100,
+        output_hash=hashlib.sha256(CONTENT).hexdigest(),
+        processing_status="completed",
+    ))
+    db.commit()
+    return processing_id
+
+def test_download_returns_file_with_validators(client, processed):
+    response = client.get(f"/download/{processed}")
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["ETag"] == f'"{hashlib.sha256(CONTENT).hexdigest()}"'
+    assert "Last-Modified" in response.headers
+
+def test_matching_etag_is_304(client, processed):
+    etag = client.get(f"/download/{processed}").headers["ETag"]
+
+    response = client.get(f"/download/{processed}", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+def test_stale_etag_downloads_again(client, processed):
+    response = client.get(f"/download/{processed}", headers={"If-None-Match": '"otro"'})
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+def test_if_modified_since_is_304(client, processed):
+    last_modified = client.get(f"/download/{processed}").headers["Last-Modified"]
+
+    response = client.get(f"/download/{processed}", headers={"If-Modified-Since": last_modified})
+
+    assert response.status_code == 304
+
+def test_range_is_206(client, processed):
+    response = client.get(f"/download/{processed}", headers={"Range": "bytes=0-9"})
+
+    assert response.status_code == 206
+    assert response.content == CONTENT[:10]
+    assert response.headers["Content-Range"] == f"bytes 0-9/{len(CONTENT)}"
+
+def test_range_past_end_is_416(client, processed):
+    response = client.get(f"/download/{processed}", headers={"Range": f"bytes={len(CONTENT) + 10}-"})
+
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(CONTENT)}"
+
+def test_missing_file_is_404(client, processed):
+    client.get(f"/download/{processed}")
+    os.remove(processed_file_path(processed, "plantilla.csv"))
+
+    # La entrada del caché se valida contra el disco
+    response = client.get(f"/download/{processed}")
+
+    assert response.status_code == 404
+
+def test_unknown_processing_is_404(client):
+    assert client.get(f"/download/{uuid.uuid4()}").status_code == 404
@@ -0,0 +1,103 @@
+"""Revisión de pagos duplicados entre procesamientos (SQLite)"""
+import uuid
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from database import PaymentIndex, ProcessingHistory
+from duplicates import check_and_record
+
+NOW = datetime(2026, 3, 15, 12, 0)
+
+@pytest.fixture(autouse=True)
+def empty_index(db):
+    db.query(PaymentIndex).delete()
+    db.commit()
+
+def payments(rows):
+    return pd.DataFrame(rows, columns=["Nombre", "Clabe", "Monto"])
+
+def process(db, rows, now=NOW, processing_id=None):
+    """Registra un procesamiento y regresa (id, resumen de la revisión)"""
+    processing_id = processing_id or str(uuid.uuid4())
+    if db.get(ProcessingHistory, processing_id) is None:
+        db.add(ProcessingHistory(
+            id=processing_id,
+            filename="plantilla.xlsx",
+            original_filename=f"{processing_id}.xlsx",
+            processing_status="completed",
+        ))
+    summary = check_and_record(db, processing_id, payments(rows), now)
+    db.commit()
+    return processing_id, summary
+
+def test_first_file_has_no_duplicates_and_is_indexed(db):
+    processing_id, summary = process(db, [
+        ("Juan", "012180001234567891", 1500.5),
+        ("Ana", "002180009876543210", 2300.0),
+    ])
+
+    assert summary["rows"] == 0
+    assert summary["previous"] == []
+    assert summary["lookback_periods"] == ["2026-03"]
+    indexed = db.query(PaymentIndex).filter(PaymentIndex.processing_id == processing_id).all()
+    assert sorted((row.clabe, row.amount_cents, row.period) for row in indexed) == [
+        ("002180009876543210", 230000, "2026-03"),
+        ("012180001234567891", 150050, "2026-03"),
+    ]
+
+def test_payment_repeated_in_later_file_is_flagged(db):
+    first_id, _ = process(db, [
+        ("Juan", "012180001234567891", 1500.5),
+        ("Ana", "002180009876543210", 2300.0),
+    ])
+
+    _, summary = process(db, [
+        ("Juan Pérez", "012180001234567891", 1500.50),
+        ("Ana", "002180009876543210", 2300.01),  # Otro monto: no es duplicado
+    ])
+
+    assert summary["rows"] == 1
+    assert summary["amount"] == 1500.5
+    assert summary["previous"] == [{"processing_id": first_id, "original_filename": f"{first_id}.xlsx", "rows": 1}]
+    assert summary["sample"] == [{
+        "nombre": "Juan Pérez",
+        "clabe": "012180001234567891",
+        "monto": 1500.5,
+        "processing_id": first_id,
+        "period": "2026-03",
+    }]
+
+def test_previous_period_outside_window_is_not_flagged(db):
+    process(db, [("Juan", "012180001234567891", 1500.5)], now=datetime(2026, 2, 28))
+
+    _, summary = process(db, [("Juan", "012180001234567891", 1500.5)])
+
+    assert summary["rows"] == 0
+
+def test_repeats_within_file_are_counted_separately(db):
+    _, summary = process(db, [
+        ("Juan", "012180001234567891", 1500.5),
+        ("Juan", "012180001234567891", 1500.5),
+    ])
+
+    assert summary["rows"] == 0
+    assert summary["within_file_rows"] == 1
+
+def test_retry_of_same_processing_replaces_its_keys(db):
+    processing_id, _ = process(db, [("Juan", "012180001234567891", 1500.5)])
+
+    # Un reintento del mismo trabajo no se marca como duplicado de sí mismo
+    _, summary = process(db, [("Juan", "012180001234567891", 1500.5)], processing_id=processing_id)
+
+    assert summary["rows"] == 0
+    assert db.query(PaymentIndex).filter(PaymentIndex.processing_id == processing_id).count() == 1
+
+def test_rows_without_clabe_or_amount_are_skipped(db):
+    processing_id, summary = process(db, [
+        ("Juan", "", 1500.5),
+        ("Ana", "002180009876543210", None),
+    ])
+
+    assert summary["rows"] == 0
+    assert db.query(PaymentIndex).filter(PaymentIndex.processing_id == processing_id).count() == 0
@@ -0,0 +1,133 @@
+"""Cola de trabajos: reclamo, pérdida del lease y cercado por worker"""
+import uuid
+from datetime import datetime, timedelta
+import pytest
+
+import job_queue
+from database import ProcessingHistory, ProcessingJob
+
+@pytest.fixture(autouse=True)
+def empty_queue(db):
+    # claim_next toma cualquier trabajo disponible: cada prueba empieza con la cola vacía
+    db.query(ProcessingJob).delete()
+    db.commit()
+
+def enqueue(db, max_attempts: int = None):
+    processing_id = str(uuid.uuid4())
+    db.add(ProcessingHistory(
+        id=processing_id,
+        filename="plantilla.xlsx",
+        original_filename="nomina.xlsx",
+        processing_status="queued",
+    ))
+    job = job_queue.enqueue(db, processing_id, "/tmp/nomina.xlsx", "nomina.xlsx", "plantilla.xlsx")
+    if max_attempts is not None:
+        job.max_attempts = max_attempts
+    db.commit()
+    return processing_id
+
+def expire_lease(db, job_id: str):
+    db.query(ProcessingJob).filter(ProcessingJob.id == job_id).update(
+        {ProcessingJob.lease_expires_at: datetime.utcnow() - timedelta(seconds=1)}
+    )
+    db.commit()
+
+RESULT = {"rows": 2, "total_amount": 3800.5}
+
+def test_claim_takes_job_once(db):
+    job_id = enqueue(db)
+
+    job = job_queue.claim_next(db, "worker-1")
+
+    assert job.id == job_id
+    assert job.status == "running"
+    assert job.locked_by == "worker-1"
+    assert job.attempts == 1
+    assert job.lease_expires_at > datetime.utcnow()
+    assert job_queue.claim_next(db, "worker-2") is None
+
+def test_heartbeat_extends_own_lease_only(db):
+    job_id = enqueue(db)
+    job_queue.claim_next(db, "worker-1")
+
+    assert job_queue.heartbeat(db, job_id, "worker-1")
+    assert not job_queue.heartbeat(db, job_id, "worker-2")
+
+def test_expired_lease_is_reclaimed_and_old_worker_is_fenced(db):
+    job_id = enqueue(db)
+    stale = job_queue.claim_next(db, "worker-1")
+    expire_lease(db, job_id)
+
+    job = job_queue.claim_next(db, "worker-2")
+
+    assert job.id == job_id
+    assert job.locked_by == "worker-2"
+    assert job.attempts == 2
+    # El primer worker perdió el trabajo: ni heartbeat ni resultado
+    assert not job_queue.heartbeat(db, job_id, "worker-1")
+    published = []
+    with pytest.raises(job_queue.LeaseLost):
+        job_queue.complete(db, stale, "worker-1", RESULT, 1.0, publish=lambda: published.append("worker-1"))
+    assert published == []
+
+    job_queue.complete(db, job, "worker-2", RESULT, 1.0, publish=lambda: published.append("worker-2"))
+
+    assert published == ["worker-2"]
+    db.expire_all()
+    stored = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).one()
+    assert stored.status == "completed"
+    assert stored.locked_by is None
+    record = db.query(ProcessingHistory).filter(ProcessingHistory.id == job_id).one()
+    assert record.processing_status == "completed"
+    assert record.rows_processed == 2
+
+def test_failed_publish_does_not_complete(db):
+    job_id = enqueue(db)
+    job = job_queue.claim_next(db, "worker-1")
+
+    def publish():
+        raise OSError("disco lleno")
+
+    with pytest.raises(OSError):
+        job_queue.complete(db, job, "worker-1", RESULT, 1.0, publish=publish)
+
+    db.expire_all()
+    stored = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).one()
+    assert stored.status == "running"
+    assert stored.locked_by == "worker-1"
+
+def test_fail_retries_with_backoff_then_dead_letters(db):
+    job_id = enqueue(db, max_attempts=2)
+    job = job_queue.claim_next(db, "worker-1")
+
+    job_queue.fail(db, job, "worker-1", "error temporal")
+
+    assert job.status == "queued"
+    assert job.available_at > datetime.utcnow()
+    # Con backoff pendiente no se puede reclamar todavía
+    assert job_queue.claim_next(db, "worker-1") is None
+
+    db.query(ProcessingJob).filter(ProcessingJob.id == job_id).update(
+        {ProcessingJob.available_at: datetime.utcnow() - timedelta(seconds=1)}
+    )
+    db.commit()
+    job = job_queue.claim_next(db, "worker-1")
+    job_queue.fail(db, job, "worker-1", "error persistente")
+
+    db.expire_all()
+    stored = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).one()
+    assert stored.status == "dead"
+    assert stored.last_error == "error persistente"
+    record = db.query(ProcessingHistory).filter(ProcessingHistory.id == job_id).one()
+    assert record.processing_status == "failed"
+
+def test_expired_lease_after_last_attempt_dead_letters(db):
+    job_id = enqueue(db, max_attempts=1)
+    job_queue.claim_next(db, "worker-1")
+    expire_lease(db, job_id)
+
+    assert job_queue.claim_next(db, "worker-2") is None
+
+    db.expire_all()
+    stored = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).one()
+    assert stored.status == "dead"
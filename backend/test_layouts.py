@@ -0,0 +1,80 @@
+"""Formatos de texto para bancos: anchos de campo y validación"""
+import pandas as pd
+import pytest
+
+import layouts
+from layouts import LayoutValidationError, write_layout
+
+def clean_frame(rows):
+    return pd.DataFrame(rows, columns=["Nombre", "Clabe", "Monto", "Concepto"])
+
+ROWS = [
+    ("José Núñez", "012180001234567891", 1500.5, "Nómina"),
+    ("Ana, López", "002180009876543210", 2300.0, "Nómina"),
+]
+
+def read_lines(path, encoding="ascii"):
+    with open(path, encoding=encoding, newline="") as f:
+        content = f.read()
+    assert content.endswith("\r\n")
+    return content[:-2].split("\r\n")
+
+def test_spei_fixed_record_widths(tmp_path):
+    path = tmp_path / "lote.txt"
+
+    write_layout(clean_frame(ROWS), str(path), "spei_fixed")
+
+    header, first, second, trailer = read_lines(path)
+    assert len(header) == 1 + 8 + 7 + 18
+    assert header[9:16] == "0000002"
+    assert header[16:] == "000000000000380050"
+    assert len(first) == len(second) == 1 + 7 + 18 + 15 + 40 + 40
+    assert first[:8] == "D0000001"
+    assert first[8:26] == "012180001234567891"
+    assert first[26:41] == "000000000150050"
+    # Texto sin acentos, en mayúsculas y rellenado a la derecha
+    assert first[41:81] == "JOSE NUNEZ".ljust(40)
+    assert first[81:] == "NOMINA".ljust(40)
+    assert second[:8] == "D0000002"
+    assert trailer == "T0000002000000000000380050"
+
+def test_text_fields_are_truncated(tmp_path):
+    path = tmp_path / "lote.txt"
+    long_name = "X" * 60
+
+    write_layout(clean_frame([(long_name, "012180001234567891", 1.0, "Pago")]), str(path), "spei_fixed")
+
+    detail = read_lines(path)[1]
+    assert detail[41:81] == "X" * 40
+
+@pytest.mark.parametrize("clabe, amount", [
+    ("0121800012345678912", 1.0),  # CLABE de 19 dígitos
+    ("01218000123456789A", 1.0),  # CLABE no numérica
+    ("012180001234567891", -1.0),  # Monto negativo
+    ("012180001234567891", 1e13),  # Monto que no cabe en 15 posiciones
+])
+def test_numeric_fields_are_validated_not_truncated(tmp_path, clabe, amount):
+    path = tmp_path / "lote.txt"
+
+    with pytest.raises(LayoutValidationError):
+        write_layout(clean_frame([("Ana", clabe, amount, "Pago")]), str(path), "spei_fixed")
+
+def test_sequence_continues_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(layouts, "WRITE_CHUNK_ROWS", 2)
+    path = tmp_path / "lote.txt"
+    rows = [(f"Persona {i}", "012180001234567891", 10.0, "Pago") for i in range(5)]
+
+    write_layout(clean_frame(rows), str(path), "spei_fixed")
+
+    details = read_lines(path)[1:-1]
+    assert [line[1:8] for line in details] == [f"{i:07d}" for i in range(1, 6)]
+
+def test_csv_quotes_and_formats_amounts(tmp_path):
+    path = tmp_path / "lote.csv"
+
+    write_layout(clean_frame(ROWS), str(path), "csv")
+
+    lines = read_lines(path, encoding="utf-8")
+    assert lines[0] == "Nombre,Clabe,Monto,Concepto"
+    assert lines[1] == "José Núñez,012180001234567891,1500.50,Nómina"
+    assert lines[2] == '"Ana, López",002180009876543210,2300.00,Nómina'
@@ -0,0 +1,92 @@
+"""Reglas de exclusión de filas: valores por omisión, reglas estrictas y atribución"""
+import pandas as pd
+import pytest
+
+import row_rules
+from row_rules import ROW_RULES, STRICT_ROW_RULES, apply_rules, compile_rules
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=["Nombre", "Clabe", "Monto"])
+
+CLABE = "012180001234567891"
+
+@pytest.mark.skipif(row_rules.ROW_RULES_FILE or row_rules.ROW_RULES_STRICT,
+                    reason="reglas reemplazadas por el entorno")
+def test_default_rules_only_exclude_totals():
+    df = frame([
+        ("Juan Pérez", CLABE, 100.0),
+        ("12345", CLABE, 100.0),
+        ("Ana", CLABE, 0.0),
+        ("Luis", "", 100.0),
+        ("TOTAL", CLABE, 300.0),
+    ])
+
+    kept, counts, _ = apply_rules(df)
+
+    assert kept["Nombre"].tolist() == ["Juan Pérez", "12345", "Ana", "Luis"]
+    assert counts == {"totales": 1, "totales_variantes": 0}
+
+@pytest.mark.parametrize("name", [
+    "TOTAL", "Total:", "  total   general ", "SUB TOTAL", "Subtotal", "GRAN TOTAL",
+    "Comisión", "COMISIONES", "IVA 16%", "IVA (16 %)", "Neto a depositar:",
+])
+def test_total_rows_are_excluded(name):
+    kept, _, _ = apply_rules(frame([(name, CLABE, 100.0)]), compile_rules(ROW_RULES))
+
+    assert kept.empty
+
+@pytest.mark.parametrize("name", [
+    "COMISION FEDERAL DE ELECTRICIDAD", "IVA ACREDITABLE", "TOTAL PLAY TELECOMUNICACIONES",
+    "Totalito", "Ivan Total",
+])
+def test_beneficiaries_resembling_totals_are_kept(name):
+    kept, _, _ = apply_rules(frame([(name, CLABE, 100.0)]), compile_rules(ROW_RULES))
+
+    assert kept["Nombre"].tolist() == [name]
+
+def test_strict_rules_exclude_invalid_rows():
+    rules = compile_rules(ROW_RULES + STRICT_ROW_RULES)
+    df = frame([
+        ("Juan", CLABE, 100.0),
+        ("123-456", CLABE, 100.0),
+        ("Ana", CLABE, 0.004),
+        ("Luis", "", 100.0),
+    ])
+
+    kept, counts, names = apply_rules(df, rules)
+
+    assert kept["Nombre"].tolist() == ["Juan"]
+    assert counts == {"totales": 0, "totales_variantes": 0, "nombre_numerico": 1, "monto_cero": 1, "clabe_vacia": 1}
+    assert names == {"nombre_numerico": ["123-456"], "monto_cero": ["Ana"], "clabe_vacia": ["Luis"]}
+
+def test_each_row_is_attributed_to_first_matching_rule():
+    rules = compile_rules(ROW_RULES + STRICT_ROW_RULES)
+    # Fila de totales sin CLABE: cuenta solo para la regla de totales
+    kept, counts, _ = apply_rules(frame([("TOTAL", "", 300.0)]), rules)
+
+    assert kept.empty
+    assert counts["totales"] == 1
+    assert counts["clabe_vacia"] == 0
+    assert sum(counts.values()) == 1
+
+def test_prefix_rule_matches_whole_words():
+    rules = compile_rules([{"name": "totales", "type": "prefix", "values": ["total"]}])
+    df = frame([("TOTAL GENERAL", CLABE, 1.0), ("Totalito", CLABE, 1.0), ("Total-Nómina", CLABE, 1.0)])
+
+    kept, counts, _ = apply_rules(df, rules)
+
+    assert kept["Nombre"].tolist() == ["Totalito"]
+    assert counts == {"totales": 2}
+
+def test_excluded_names_are_limited(monkeypatch):
+    monkeypatch.setattr(row_rules, "EXCLUDED_NAMES_LIMIT", 2)
+    rules = compile_rules([{"name": "totales", "type": "exact", "values": ["TOTAL"]}])
+
+    _, counts, names = apply_rules(frame([("TOTAL", CLABE, 1.0)] * 5), rules)
+
+    assert counts == {"totales": 5}
+    assert names == {"totales": ["TOTAL", "TOTAL"]}
+
+def test_unknown_rule_type_is_rejected():
+    with pytest.raises(ValueError):
+        compile_rules([{"name": "x", "type": "desconocida"}])
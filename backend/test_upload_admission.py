@@ -0,0 +1,52 @@
+"""Admisión de /upload-process: 413 por tamaño y 429 con la cola llena"""
+import os
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from admission import upload_admission
+from singleflight import upload_flights
+from database import ProcessingHistory
+
+XLSX_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+@pytest.fixture
+def client(monkeypatch):
+    # Sin resultados recientes: la misma subida de otra prueba no se combina con esta
+    monkeypatch.setattr(upload_flights, "_recent", {})
+    return TestClient(main.app)
+
+def upload(client, path):
+    with open(path, "rb") as f:
+        return client.post("/upload-process", files={"file": ("nomina.xlsx", f, XLSX_TYPE)})
+
+def test_upload_processes_file(client, payroll_xlsx):
+    response = upload(client, payroll_xlsx)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "completed"
+    assert body["rows_processed"] == 2
+    assert body["excluded_rows"]["totales"] == 1
+
+def test_upload_larger_than_budget_is_413(client, payroll_xlsx, monkeypatch, db):
+    monkeypatch.setattr(upload_admission, "max_bytes", os.path.getsize(payroll_xlsx) - 1)
+    rejected = upload_admission.rejected
+    history_before = db.query(ProcessingHistory).count()
+
+    response = upload(client, payroll_xlsx)
+
+    assert response.status_code == 413
+    assert upload_admission.rejected == rejected + 1
+    assert db.query(ProcessingHistory).count() == history_before
+
+def test_upload_with_full_queue_is_429(client, payroll_xlsx, monkeypatch):
+    # Sin lugares libres ni espacio en la cola de espera
+    monkeypatch.setattr(upload_admission, "max_jobs", 0)
+    monkeypatch.setattr(upload_admission, "max_queue", 0)
+
+    response = upload(client, payroll_xlsx)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(upload_admission.retry_after)
+    assert upload_admission.active_jobs == 0
+    assert upload_admission.inflight_bytes == 0
@@ -0,0 +1,278 @@
+"""Daemon de ingesta: vigila un directorio y procesa los ANEXO que llegan.
+
+Uso:
+    python watcher.py
+
+Los archivos nuevos se procesan con el mismo pipeline que /upload-process,
+se registran en ProcessingHistory y se mueven a las carpetas de terminados o
+fallidos. Un archivo cuyo hash ya fue procesado por el daemon no se vuelve a
+procesar, así que reiniciarlo es seguro. Si la base de datos falla al
+registrar un archivo terminado, el archivo se queda en WATCH_DIR y el
+registro se reintenta en la siguiente vuelta, sin detener el daemon: solo
+se mueve cuando su fila de historial ya está guardada.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import shutil
+import signal
+import struct
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+
+from database import SessionLocal, create_tables, bump_table_version, ProcessingHistory
+from history_cache import HISTORY_TABLE
+from pipeline import process_excel_file
+from duplicates import safe_check_and_record, apply_summary
+from memory_budget import enforce_budgets
+from logging_config import setup_logging
+from storage import PROCESSED_FILES_DIR, processed_file_path, file_sha256
+
+# Cargar variables de entorno
+load_dotenv()
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+WATCH_DIR = os.getenv("WATCH_DIR", "inbox")
+WATCH_DONE_DIR = os.getenv("WATCH_DONE_DIR", os.path.join(WATCH_DIR, "done"))
+WATCH_FAILED_DIR = os.getenv("WATCH_FAILED_DIR", os.path.join(WATCH_DIR, "failed"))
+WATCH_CONCURRENCY = int(os.getenv("WATCH_CONCURRENCY", "2"))
+# Segundos que un archivo debe permanecer sin cambios antes de procesarlo
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "5"))
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls', '.csv', '.tsv')
+
+# Constantes de inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+_EVENT_HEADER = struct.Struct("iIII")
+
+class InotifyWatch:
+    """Vigila un directorio con inotify; solo disponible en Linux"""
+
+    def __init__(self, path: str):
+        libc_name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify no disponible")
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch falló para {path}")
+
+    def wait(self, timeout: float):
+        """Espera eventos hasta timeout segundos; regresa True si hubo alguno"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # Solo interesa saber que algo cambió; se descarta el contenido
+        try:
+            while os.read(self.fd, 64 * (_EVENT_HEADER.size + 256)):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatch:
+    """Alternativa sin inotify: revisa el directorio cada cierto intervalo"""
+
+    def wait(self, timeout: float):
+        time.sleep(timeout)
+        return True
+
+    def close(self):
+        pass
+
+def create_watch(path: str):
+    try:
+        watch = InotifyWatch(path)
+        logger.info(f"Vigilando {path} con inotify")
+        return watch
+    except (OSError, AttributeError, TypeError) as e:
+        logger.info(f"inotify no disponible ({e}); usando sondeo cada {WATCH_POLL_INTERVAL}s")
+        return PollingWatch()
+
+def move_to(path: str, target_dir: str):
+    """Mueve path a target_dir sin sobrescribir archivos existentes"""
+    os.makedirs(target_dir, exist_ok=True)
+    name = os.path.basename(path)
+    target = os.path.join(target_dir, name)
+    if os.path.exists(target):
+        stem, ext = os.path.splitext(name)
+        target = os.path.join(target_dir, f"{stem}_{datetime.now().strftime('%Y%m%d%H%M%S')}{ext}")
+    shutil.move(path, target)
+    return target
+
+def run_pipeline(input_path: str, processing_id: str, output_filename: str):
+    """Se ejecuta en un proceso hijo: procesa y deja la salida en el directorio permanente"""
+    os.makedirs(PROCESSED_FILES_DIR, exist_ok=True)
+    output_path = processed_file_path(processing_id, output_filename)
+    result = process_excel_file(input_path, output_path)
+    result["output_hash"] = file_sha256(output_path)
+    return result
+
+class FolderIngestor:
+    """Detecta archivos estables en WATCH_DIR y los procesa con concurrencia limitada"""
+
+    def __init__(self):
+        # Cada proceso del pool atiende un archivo a la vez: ahí sí aplica el límite de memoria
+        self.executor = ProcessPoolExecutor(max_workers=WATCH_CONCURRENCY, initializer=enforce_budgets)
+        # ruta -> (tamaño, mtime, momento en que se vio por primera vez así)
+        self.candidates = {}
+        # ruta -> (future, processing_id, output_filename, file_hash, file_size, inicio)
+        self.in_flight = {}
+        self.running = True
+
+    def scan(self):
+        """Registra archivos nuevos y envía a procesar los que ya están estables"""
+        now = time.monotonic()
+        seen = set()
+        for entry in os.scandir(WATCH_DIR):
+            if not entry.is_file() or entry.name.startswith(("~$", ".")):
+                continue
+            if not entry.name.lower().endswith(EXCEL_EXTENSIONS):
+                continue
+            path = entry.path
+            seen.add(path)
+            if path in self.in_flight:
+                continue
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = self.candidates.get(path)
+            if previous is None or previous[:2] != signature:
+                # Archivo nuevo o todavía escribiéndose: reiniciar el debounce
+                self.candidates[path] = (*signature, now)
+            elif now - previous[2] >= WATCH_DEBOUNCE_SECONDS and len(self.in_flight) < WATCH_CONCURRENCY:
+                del self.candidates[path]
+                try:
+                    self.submit(path, stat.st_size)
+                except Exception as e:
+                    # Se reintenta en el siguiente escaneo (vuelve a pasar por el debounce)
+                    logger.error(f"No se pudo enviar {entry.name} a procesar: {e}")
+
+        for path in list(self.candidates):
+            if path not in seen:
+                del self.candidates[path]
+
+    def submit(self, path: str, file_size: int):
+        file_hash = file_sha256(path)
+        db = SessionLocal()
+        try:
+            already = db.query(ProcessingHistory.id).filter(
+                ProcessingHistory.file_hash == file_hash,
+                ProcessingHistory.processing_status == "completed",
+                # Solo lo ingerido por este daemon: una subida por la API no lo omite
+                ProcessingHistory.source == "watcher"
+            ).first()
+        finally:
+            db.close()
+
+        if already:
+            logger.info(f"{os.path.basename(path)} ya fue procesado ({already.id}); se omite")
+            move_to(path, WATCH_DONE_DIR)
+            return
+
+        processing_id = str(uuid.uuid4())
+        output_filename = f"plantilla_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.xlsx"
+        future = self.executor.submit(run_pipeline, path, processing_id, output_filename)
+        self.in_flight[path] = (future, processing_id, output_filename, file_hash, file_size, time.perf_counter())
+        logger.info(f"Procesando {os.path.basename(path)} ({processing_id})")
+
+    def collect(self):
+        """Registra en ProcessingHistory los trabajos terminados y mueve sus entradas"""
+        for path, entry in list(self.in_flight.items()):
+            if not entry[0].done():
+                continue
+            try:
+                status, rows = self.register(path, *entry)
+            except Exception as e:
+                # Un error de la base de datos no detiene el daemon: la entrada sigue
+                # en vuelo y se vuelve a registrar en la siguiente vuelta
+                logger.error(f"No se pudo registrar {os.path.basename(path)}; se reintentará: {e}")
+                continue
+            del self.in_flight[path]
+            try:
+                move_to(path, WATCH_DONE_DIR if status == "completed" else WATCH_FAILED_DIR)
+            except OSError as e:
+                logger.error(f"No se pudo mover {os.path.basename(path)}: {e}")
+            logger.info(f"{os.path.basename(path)}: {status} ({rows} filas)")
+
+    def register(self, path: str, future, processing_id: str, output_filename: str, file_hash: str, file_size: int, started: float):
+        """Guarda en ProcessingHistory un trabajo terminado; regresa (estado, filas)"""
+        original_filename = os.path.basename(path)
+        record = ProcessingHistory(
+            id=processing_id,
+            filename=output_filename,
+            original_filename=original_filename,
+            file_size=file_size,
+            file_hash=file_hash,
+            source="watcher",
+            user_id=None,
+            processing_time=round(time.perf_counter() - started, 4),
+        )
+        payments = None
+        try:
+            result = future.result()
+            payments = result.get("payments")
+            record.processed_filename = output_filename
+            record.rows_processed = result["rows"]
+            record.total_amount = result["total_amount"]
+            record.output_hash = result["output_hash"]
+            record.processing_status = "completed"
+        except Exception as e:
+            logger.error(f"Error procesando {original_filename}: {e}")
+            record.rows_processed = 0
+            record.processing_status = "failed"
+            record.error_message = str(e)
+
+        status, rows = record.processing_status, record.rows_processed
+        db = SessionLocal()
+        try:
+            db.add(record)
+            if payments is not None:
+                apply_summary(record, safe_check_and_record(db, processing_id, payments))
+            bump_table_version(db, HISTORY_TABLE)
+            db.commit()
+        finally:
+            db.close()
+        return status, rows
+
+    def stop(self, *_):
+        self.running = False
+
+    def run(self):
+        os.makedirs(WATCH_DIR, exist_ok=True)
+        watch = create_watch(WATCH_DIR)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # Con inotify se despierta para completar el debounce; sin él, cada intervalo de sondeo
+        timeout = WATCH_POLL_INTERVAL if isinstance(watch, PollingWatch) else min(WATCH_DEBOUNCE_SECONDS, 1.0)
+        try:
+            while self.running:
+                self.collect()
+                self.scan()
+                watch.wait(timeout)
+        finally:
+            watch.close()
+            self.executor.shutdown(wait=True)
+            self.collect()
+            logger.info("Daemon de ingesta detenido")
+
+if __name__ == "__main__":
+    create_tables()
+    FolderIngestor().run()
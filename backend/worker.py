@@ -0,0 +1,171 @@
+"""Worker de la cola de procesamiento.
+
+Uso:
+    python worker.py
+
+Reclama trabajos de processing_jobs, los procesa con el pipeline compartido y
+deja el resultado en PROCESSED_FILES_DIR. Se pueden ejecutar tantos workers
+como se quiera, en la misma máquina o en otras réplicas, siempre que
+compartan la base de datos y los directorios de archivos.
+
+La salida se escribe en un archivo parcial propio del worker y se mueve a su
+ruta final solo al completar con el lease vigente. Si el heartbeat pierde el
+lease, el procesamiento se aborta en el siguiente reporte de progreso y el
+archivo parcial se descarta.
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+from database import SessionLocal, create_tables
+from pipeline import process_excel_file
+from profiling import run_profiled
+from memory_budget import MemoryBudgetExceeded, enforce_budgets
+from layouts import LayoutValidationError
+from logging_config import setup_logging
+from storage import PROCESSED_FILES_DIR, processed_file_path, file_sha256
+import job_queue
+
+# Cargar variables de entorno
+load_dotenv()
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1"))
+# Heartbeats varias veces por lease para tolerar pausas breves
+HEARTBEAT_INTERVAL = job_queue.JOB_LEASE_SECONDS / 3
+
+class Heartbeat(threading.Thread):
+    """Renueva el lease del trabajo mientras se procesa"""
+
+    def __init__(self, job_id: str, worker_id: str):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            db = SessionLocal()
+            try:
+                if not job_queue.heartbeat(db, self.job_id, self.worker_id):
+                    logger.warning(f"Se perdió el lease del trabajo {self.job_id}")
+                    self.lost.set()
+                    return
+            except Exception as e:
+                logger.error(f"Error enviando heartbeat de {self.job_id}: {e}")
+            finally:
+                db.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def check(self, *_, **__):
+        """Callback de progreso del pipeline: aborta si el trabajo ya es de otro worker"""
+        if self.lost.is_set():
+            raise job_queue.LeaseLost(f"Se perdió el lease del trabajo {self.job_id}")
+
+def discard(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class Worker:
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.running = True
+
+    def stop(self, *_):
+        self.running = False
+
+    def process(self, db, job):
+        logger.info(f"Procesando trabajo {job.id} (intento {job.attempts}/{job.max_attempts})")
+        heartbeat = Heartbeat(job.id, self.worker_id)
+        heartbeat.start()
+        started = time.perf_counter()
+        output_path = processed_file_path(job.id, job.output_filename)
+        # Otro worker puede tener el mismo trabajo si este perdió el lease: cada uno escribe el suyo
+        partial_path = processed_file_path(job.id, f"parcial-{self.worker_id}-{job.output_filename}")
+        try:
+            os.makedirs(PROCESSED_FILES_DIR, exist_ok=True)
+            args = (job.input_path, partial_path, heartbeat.check, job.output_mode, job.id, job.output_format)
+            if job.profile:
+                result, profile_file = run_profiled(job.id, process_excel_file, *args)
+                result["profile_filename"] = os.path.basename(profile_file)
+            else:
+                result = process_excel_file(*args)
+            result["output_hash"] = file_sha256(partial_path)
+            heartbeat.check()
+        except job_queue.LeaseLost as e:
+            heartbeat.stop()
+            discard(partial_path)
+            logger.warning(f"{e}; se descarta la salida")
+            return
+        except (MemoryBudgetExceeded, LayoutValidationError) as e:
+            # Reintentar no cambia el resultado: directo a dead-letter, el worker sigue vivo
+            heartbeat.stop()
+            discard(partial_path)
+            logger.error(f"Trabajo {job.id} abortado: {e}")
+            self.release(job_queue.dead_letter, db, job, self.worker_id, str(e))
+            return
+        except Exception as e:
+            heartbeat.stop()
+            discard(partial_path)
+            logger.error(f"Error en trabajo {job.id}: {e}")
+            self.release(job_queue.fail, db, job, self.worker_id, str(e))
+            return
+        heartbeat.stop()
+        try:
+            job_queue.complete(db, job, self.worker_id, result, round(time.perf_counter() - started, 4),
+                               publish=lambda: os.replace(partial_path, output_path))
+        except job_queue.LeaseLost as e:
+            discard(partial_path)
+            logger.warning(f"{e}; se descarta la salida")
+            return
+        # El original ya no se necesita una vez generada la plantilla
+        try:
+            os.remove(job.input_path)
+        except OSError:
+            pass
+        logger.info(f"Trabajo {job.id} completado: {result['rows']} filas")
+
+    def release(self, transition, *args):
+        """Aplica fail o dead_letter; si el lease ya es de otro worker no hay nada que hacer"""
+        try:
+            transition(*args)
+        except job_queue.LeaseLost as e:
+            logger.warning(str(e))
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(f"Worker {self.worker_id} iniciado")
+        while self.running:
+            db = SessionLocal()
+            try:
+                job = job_queue.claim_next(db, self.worker_id)
+                if job is None:
+                    time.sleep(WORKER_POLL_INTERVAL)
+                    continue
+                self.process(db, job)
+            except Exception as e:
+                logger.error(f"Error en el worker: {e}")
+                time.sleep(WORKER_POLL_INTERVAL)
+            finally:
+                db.close()
+        logger.info(f"Worker {self.worker_id} detenido")
+
+if __name__ == "__main__":
+    create_tables()
+    # Un trabajo a la vez por proceso: el límite de memoria puede abortarlo
+    enforce_budgets()
+    Worker().run()
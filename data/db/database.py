@@ -18,8 +18,11 @@ DB_NAME = os.getenv("DB_NAME", "plantillas_db")
 # URL de conexión a MySQL
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Registrar cada sentencia SQL solo si se pide explícitamente (SQL_ECHO=true)
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+
 # Crear engine y sesión
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Base para los modelos
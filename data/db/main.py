@@ -18,6 +18,9 @@ from sqlalchemy import or_, desc, asc
 import logging
 import uuid
 import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm import Session
 from database import get_db, create_tables, test_connection, User, ProcessingHistory
 from dotenv import load_dotenv
@@ -50,9 +53,114 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Costo de bcrypt: al cambiarlo, los hashes existentes se regeneran en el siguiente login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Ejecutor dedicado para hashing y límites de admisión de logins
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+LOGIN_MAX_CONCURRENCY = int(os.getenv("LOGIN_MAX_CONCURRENCY", str(PASSWORD_HASH_WORKERS)))
+LOGIN_MAX_QUEUE = int(os.getenv("LOGIN_MAX_QUEUE", "32"))
+LOGIN_QUEUE_TIMEOUT = float(os.getenv("LOGIN_QUEUE_TIMEOUT", "5"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 security = HTTPBearer()
 
+password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+
+class LoginAdmission:
+    """Limita los logins concurrentes y encola el resto hasta un máximo"""
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = None
+        self.inflight = 0
+        self.waiting = 0
+        self.active = 0
+        self.max_waiting_seen = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=1000)
+
+    def _get_semaphore(self):
+        # El semáforo se crea dentro del event loop que lo usa
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _reject(self, detail: str):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(max(1, int(self.queue_timeout)))},
+        )
+
+    async def run(self, func, *args):
+        """Ejecuta func en el ejecutor de hashing respetando los límites de admisión"""
+        semaphore = self._get_semaphore()
+        if self.inflight >= self.max_concurrency + self.max_queue:
+            self._reject("Demasiados intentos de inicio de sesión, intenta más tarde")
+
+        started = time.perf_counter()
+        self.inflight += 1
+        try:
+            self.waiting += 1
+            self.max_waiting_seen = max(self.max_waiting_seen, self.waiting)
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject("Tiempo de espera agotado para iniciar sesión")
+            finally:
+                self.waiting -= 1
+
+            self.active += 1
+            self.accepted += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(password_executor, func, *args)
+            finally:
+                self.active -= 1
+                semaphore.release()
+                self.latencies.append(time.perf_counter() - started)
+        finally:
+            self.inflight -= 1
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting_seen,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "latency_ms": {
+                "samples": len(latencies),
+                "avg": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "max": round(latencies[-1] * 1000, 2) if latencies else None,
+            },
+        }
+
+login_admission = LoginAdmission(LOGIN_MAX_CONCURRENCY, LOGIN_MAX_QUEUE, LOGIN_QUEUE_TIMEOUT)
+
 # Modelos Pydantic
 class UserLogin(BaseModel):
     username: str
@@ -95,6 +203,7 @@ def init_db():
         try:
             existing_user = db.query(User).filter(User.username == "admin").first()
             if not existing_user:
+                # init_db es síncrono: se hashea directo, sin pasar por el ejecutor
                 hashed_password = pwd_context.hash("admin123")
                 default_user = User(
                     username="admin",
@@ -112,16 +221,21 @@ def init_db():
         return False
 
 # Funciones de autenticación
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def authenticate_user(username: str, password: str, db: Session = Depends(get_db)):
+async def authenticate_user(username: str, password: str, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == username).first()
     
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    # bcrypt se ejecuta fuera del event loop; new_hash indica que el costo cambió
+    valid, new_hash = await login_admission.run(
+        pwd_context.verify_and_update, password, user.hashed_password
+    )
+    if not valid:
         return False
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+        logger.info(f"Hash de contraseña actualizado para {user.username}")
     return {"id": user.id, "username": user.username}
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -163,7 +277,7 @@ async def root():
 
 @app.post("/auth/login", response_model=Token)
 async def login(user_data: UserLogin, db: Session = Depends(get_db)):
-    user = authenticate_user(user_data.username, user_data.password, db)
+    user = await authenticate_user(user_data.username, user_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -176,6 +290,15 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.get("/auth/metrics")
+async def login_metrics():
+    """Latencia de login y profundidad de la cola de verificación"""
+    return login_admission.stats()
+
+@app.on_event("shutdown")
+def shutdown_password_executor():
+    password_executor.shutdown(wait=False)
+
 # Funciones de procesamiento de Excel
 def find_col(df, keywords):
     """Encuentra la columna que contiene las palabras clave (adaptado del script original)"""
@@ -70,6 +70,14 @@ const DataTableView = () => {
     }
   };
 
+  const handleDownloadPage = () => {
+    const ids = data
+      .filter((item) => item.status === 'completed')
+      .map((item) => item.id);
+    if (ids.length === 0) return;
+    window.location.href = fileService.bundleUrl({ ids });
+  };
+
   const formatDate = (dateString) => {
     return new Date(dateString).toLocaleString('es-ES', {
       year: 'numeric',
@@ -120,6 +128,14 @@ const DataTableView = () => {
                 <option value={50}>50</option>
               </select>
             </label>
+            <button
+              onClick={handleDownloadPage}
+              disabled={data.length === 0}
+              className="flex items-center px-3 py-1 text-sm border border-gray-300 rounded hover:bg-gray-100 disabled:opacity-50"
+            >
+              <FiDownload className="mr-1" />
+              Descargar página (.zip)
+            </button>
           </div>
         </div>
 
@@ -200,6 +216,14 @@ const DataTableView = () => {
                         {item.status === 'completed' ? 'Completado' : 
                          item.status === 'failed' ? 'Fallido' : 'Procesando'}
                       </span>
+                      {item.duplicate_rows > 0 && (
+                        <span
+                          className="ml-2 inline-flex px-2 py-1 text-xs font-semibold rounded-full bg-orange-100 text-orange-800"
+                          title="Filas con la misma CLABE y monto que un archivo anterior del periodo"
+                        >
+                          {item.duplicate_rows} posibles duplicados
+                        </span>
+                      )}
                     </td>
                     <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-900">
                       {formatDate(item.created_at)}
@@ -10,17 +10,29 @@ import {
 const ProcessView = ({ onProcessComplete, message, setMessage }) => {
   const [file, setFile] = useState(null);
   const [processing, setProcessing] = useState(false);
+  const [progress, setProgress] = useState(null);
+  const [splitByBank, setSplitByBank] = useState(false);
+  const [outputFormat, setOutputFormat] = useState('xlsx');
+  // Una llave por archivo seleccionado: los reintentos se combinan en el servidor
+  const [idempotencyKey, setIdempotencyKey] = useState(null);
+
+  const duplicateWarning = (result) => (
+    result.duplicate_rows > 0
+      ? ` Atención: ${result.duplicate_rows} filas tienen la misma CLABE y monto que un archivo anterior del periodo.`
+      : ''
+  );
 
   const handleFileChange = (e) => {
     const selectedFile = e.target.files[0];
     if (selectedFile) {
-      if (selectedFile.name.endsWith('.xlsx') || selectedFile.name.endsWith('.xls')) {
+      if (/\.(xlsx|xls|csv)$/i.test(selectedFile.name)) {
         setFile(selectedFile);
+        setIdempotencyKey(crypto.randomUUID());
         setMessage({ type: '', text: '' });
       } else {
         setMessage({ 
           type: 'error', 
-          text: 'Por favor selecciona un archivo Excel (.xlsx o .xls)' 
+          text: 'Por favor selecciona un archivo Excel (.xlsx o .xls) o CSV' 
         });
         e.target.value = '';
       }
@@ -37,7 +49,13 @@ const ProcessView = ({ onProcessComplete, message, setMessage }) => {
     setMessage({ type: '', text: '' });
 
     try {
-      const result = await fileService.uploadAndProcess(file);
+      const result = await fileService.uploadAndProcess(
+        file,
+        setProgress,
+        splitByBank ? 'by_bank' : 'single',
+        outputFormat,
+        idempotencyKey
+      );
       
       // Descargar automáticamente el archivo procesado
       try {
@@ -53,15 +71,15 @@ const ProcessView = ({ onProcessComplete, message, setMessage }) => {
         link.remove();
         window.URL.revokeObjectURL(url);
         
-        setMessage({ 
+  setMessage({ 
           type: 'success', 
-          text: `Archivo procesado exitosamente. ${result.rows_processed} filas procesadas. Descarga iniciada automáticamente.` 
+          text: `Archivo procesado exitosamente. ${result.rows_processed} filas procesadas${result.banks ? ` en ${result.banks.length} bancos` : ''}. Descarga iniciada automáticamente.${duplicateWarning(result)}` 
         });
       } catch (downloadError) {
         console.error('Error descargando archivo:', downloadError);
         setMessage({ 
           type: 'success', 
-          text: `Archivo procesado exitosamente. ${result.rows_processed} filas procesadas. Error en descarga automática - puedes descargarlo desde la tabla de datos.` 
+          text: `Archivo procesado exitosamente. ${result.rows_processed} filas procesadas. Error en descarga automática - puedes descargarlo desde la tabla de datos.${duplicateWarning(result)}` 
         });
       }
       
@@ -80,6 +98,23 @@ const ProcessView = ({ onProcessComplete, message, setMessage }) => {
       });
     } finally {
       setProcessing(false);
+      setProgress(null);
+    }
+  };
+
+  const progressLabel = () => {
+    if (!progress) return 'Procesando archivo...';
+    switch (progress.stage) {
+      case 'queued':
+        return 'En cola de procesamiento...';
+      case 'reading':
+        return 'Leyendo archivo...';
+      case 'cleaning':
+        return `Limpiando datos (${progress.rows_read} filas leídas)...`;
+      case 'writing':
+        return `Generando plantilla (${progress.rows_written} filas escritas)...`;
+      default:
+        return 'Guardando resultado...';
     }
   };
 
@@ -116,7 +151,7 @@ const ProcessView = ({ onProcessComplete, message, setMessage }) => {
             <input
               id="file-input"
               type="file"
-              accept=".xlsx,.xls"
+              accept=".xlsx,.xls,.csv"
               onChange={handleFileChange}
               className="block w-full text-sm text-gray-500 file:mr-4 file:py-3 file:px-6 file:rounded-lg file:border-0 file:text-sm file:font-medium file:bg-blue-50 file:text-blue-700 hover:file:bg-blue-100 transition-colors cursor-pointer"
             />
@@ -132,6 +167,31 @@ const ProcessView = ({ onProcessComplete, message, setMessage }) => {
               </p>
             </div>
           )}
+
+          <label className="flex items-center text-sm text-gray-700">
+            Formato de salida:
+            <select
+              value={outputFormat}
+              onChange={(e) => setOutputFormat(e.target.value)}
+              disabled={processing}
+              className="ml-2 border border-gray-300 rounded px-2 py-1"
+            >
+              <option value="xlsx">Excel (.xlsx)</option>
+              <option value="csv">CSV (.csv)</option>
+              <option value="spei_fixed">Layout SPEI de ancho fijo (.txt)</option>
+            </select>
+          </label>
+
+          <label className="flex items-center text-sm text-gray-700">
+            <input
+              type="checkbox"
+              checked={splitByBank}
+              onChange={(e) => setSplitByBank(e.target.checked)}
+              disabled={processing}
+              className="h-4 w-4 mr-2 rounded border-gray-300 text-blue-600"
+            />
+            Separar por banco destino (un archivo por banco en un .zip)
+          </label>
           
           <button
             onClick={handleUpload}
@@ -141,7 +201,7 @@ const ProcessView = ({ onProcessComplete, message, setMessage }) => {
             {processing ? (
               <>
                 <Loader className="animate-spin h-5 w-5 mr-2" />
-                Procesando archivo...
+                {progressLabel()}
               </>
             ) : (
               <>
@@ -162,7 +222,7 @@ const ProcessView = ({ onProcessComplete, message, setMessage }) => {
             </li>
             <li className="flex items-start">
               <span className="font-medium mr-2">•</span>
-              Solo se procesan archivos Excel (.xlsx, .xls)
+              Se procesan archivos Excel (.xlsx, .xls) o CSV
             </li>
             <li className="flex items-start">
               <span className="font-medium mr-2">•</span>
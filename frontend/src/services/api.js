@@ -6,6 +6,8 @@ const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000
 const api = axios.create({
   baseURL: API_BASE_URL,
   timeout: 30000, // 30 segundos
+  // Envía la cookie de lectura desde el primario tras una subida propia
+  withCredentials: true,
   headers: {
     'Content-Type': 'application/json',
   },
@@ -23,17 +25,41 @@ api.interceptors.response.use(
 // Servicio de archivos
 export const fileService = {
   // Subir y procesar archivo
-  uploadAndProcess: async (file) => {
+  // onProgress recibe el avance del servidor ({ stage, rows_read, rows_written })
+  uploadAndProcess: async (file, onProgress, outputMode = 'single', outputFormat = 'xlsx', idempotencyKey = null) => {
     const formData = new FormData();
     formData.append('file', file);
-    
-    const response = await api.post('/upload-process', formData, {
-      headers: {
-        'Content-Type': 'multipart/form-data',
-      },
+
+    const jobId = crypto.randomUUID();
+    const events = onProgress ? fileService.subscribeToJob(jobId, onProgress) : null;
+
+    try {
+      const response = await api.post('/upload-process', formData, {
+        params: { job_id: jobId, output_mode: outputMode, output_format: outputFormat },
+        headers: {
+          'Content-Type': 'multipart/form-data',
+          ...(idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {}),
+        },
+      });
+
+      return response.data;
+    } finally {
+      events?.close();
+    }
+  },
+
+  // Escuchar el avance de un procesamiento vía Server-Sent Events
+  subscribeToJob: (jobId, onProgress) => {
+    const events = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`);
+    events.addEventListener('progress', (event) => {
+      const data = JSON.parse(event.data);
+      onProgress(data);
+      if (data.stage === 'completed' || data.stage === 'failed') {
+        events.close();
+      }
     });
-    
-    return response.data;
+    events.onerror = () => events.close();
+    return events;
   },
 
   // Descargar archivo procesado
@@ -45,6 +71,15 @@ export const fileService = {
     return response;
   },
 
+  // URL del ZIP con varios archivos procesados; el navegador lo descarga en streaming
+  bundleUrl: ({ ids = [], dateFrom, dateTo } = {}) => {
+    const params = new URLSearchParams();
+    ids.forEach((id) => params.append('ids', id));
+    if (dateFrom) params.append('date_from', dateFrom);
+    if (dateTo) params.append('date_to', dateTo);
+    return `${API_BASE_URL}/download-bundle?${params.toString()}`;
+  },
+
   // Obtener historial de procesamiento
   getHistory: async () => {
     const response = await api.get('/history');
@@ -83,6 +118,11 @@ export const handleApiError = (error) => {
       return data.detail || 'Solicitud inválida';
     } else if (status === 404) {
       return 'Recurso no encontrado';
+    } else if (status === 429 || status === 503) {
+      const retryAfter = error.response.headers?.['retry-after'];
+      return retryAfter
+        ? `Servidor ocupado. Intenta de nuevo en ${retryAfter} segundos.`
+        : 'Servidor ocupado. Intenta de nuevo más tarde.';
     } else if (status === 500) {
       return 'Error interno del servidor';
     } else {
@@ -1,104 +1,179 @@
 #!/usr/bin/env python3
 """Script: rellenar_plantilla.py
-Lee el archivo ANEXO A4 (hoja "ADMON. PENSION") y crea un Excel con las columnas:
-Nombre, Clabe, Monto, Concepto
-Adaptable a cambios menores en nombres de columnas.
+Procesa por lotes archivos ANEXO (hoja "ADMON. PENSION") y crea para cada uno
+un Excel con las columnas: Nombre, Clabe, Monto, Concepto.
+
+Usa el mismo pipeline que la API (backend/pipeline.py) y procesa los archivos
+en paralelo en varios núcleos.
+
+Ejemplos:
+    python rellenar_plantilla.py "ANEXO*.xlsx"
+    python rellenar_plantilla.py entradas/ -o salidas/ -j 4 --manifest resumen.json
 """
-import pandas as pd
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
-from pathlib import Path
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from pathlib import Path
+
+# El pipeline vive junto a la API en backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent / "backend"))
+
+from pipeline import process_excel_file  # noqa: E402
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls', '.csv', '.tsv')
+
+def collect_inputs(patterns):
+    """Expande globs y directorios en una lista ordenada de archivos Excel"""
+    files = []
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            candidates = [p for p in path.iterdir() if p.is_file()]
+        else:
+            candidates = [Path(p) for p in glob.glob(pattern, recursive=True)]
+        for candidate in candidates:
+            # Ignorar archivos temporales de Excel (~$archivo.xlsx)
+            if candidate.suffix.lower() in EXCEL_EXTENSIONS and not candidate.name.startswith("~$"):
+                files.append(candidate.resolve())
+    return sorted(set(files))
+
+def output_path_for(input_path: Path, output_dir: Path, name: str = None):
+    return output_dir / f"plantilla_{name or input_path.stem}.xlsx"
+
+def output_paths_for(inputs, output_dir: Path):
+    """Ruta de salida de cada entrada, sin colisiones entre archivos del mismo nombre.
+
+    Los archivos con el mismo nombre base (p. ej. enero/ANEXO.xlsx y
+    febrero/ANEXO.xlsx) usan su ruta relativa al directorio común:
+    plantilla_enero_ANEXO_xlsx.xlsx y plantilla_febrero_ANEXO_xlsx.xlsx.
+    """
+    groups = defaultdict(list)
+    for path in inputs:
+        groups[path.stem.lower()].append(path)
+
+    outputs = {}
+    for group in groups.values():
+        if len(group) == 1:
+            outputs[group[0]] = output_path_for(group[0], output_dir)
+            continue
+        common = Path(os.path.commonpath([path.parent for path in group]))
+        for path in group:
+            name = "_".join(path.relative_to(common).parts).replace(".", "_")
+            outputs[path] = output_path_for(path, output_dir, name)
+
+    # Nombres que solo difieren en mayúsculas chocan en sistemas de archivos sin distinción
+    seen = set()
+    for path in inputs:
+        output = outputs[path]
+        index = 2
+        while str(output).lower() in seen:
+            output = output_path_for(path, output_dir, f"{outputs[path].stem.removeprefix('plantilla_')}_{index}")
+            index += 1
+        seen.add(str(output).lower())
+        outputs[path] = output
+    return outputs
+
+def process_one(input_path: str, output_path: str):
+    """Procesa un archivo en un proceso hijo; nunca propaga la excepción"""
+    started = time.perf_counter()
+    try:
+        result = process_excel_file(input_path, output_path)
+        return {
+            "input": input_path,
+            "output": output_path,
+            "status": "completed",
+            "rows": result["rows"],
+            "total_amount": result["total_amount"],
+            # Filas excluidas por regla y sus nombres, para revisar las exclusiones
+            "excluded": {rule: count for rule, count in result["excluded"].items() if count},
+            "excluded_names": result["excluded_names"],
+            "timings": result["timings"],
+        }
+    except Exception as e:
+        return {
+            "input": input_path,
+            "output": None,
+            "status": "failed",
+            "error": str(e),
+            "timings": {"total": round(time.perf_counter() - started, 4)},
+        }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Genera plantillas de dispersión a partir de archivos ANEXO"
+    )
+    parser.add_argument("inputs", nargs="+", help="Archivos, globs o directorios de entrada")
+    parser.add_argument("-o", "--output-dir", default=".", help="Directorio de salida (por defecto el actual)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="Número de procesos en paralelo (por defecto, número de núcleos)")
+    parser.add_argument("--manifest", default=None,
+                        help="Ruta del manifiesto JSON (por defecto manifest_<fecha>.json en el directorio de salida)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print(f"No se encontraron archivos para procesar ({', '.join(EXCEL_EXTENSIONS)})", file=sys.stderr)
+        return 1
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = Path(args.manifest) if args.manifest else \
+        output_dir / f"manifest_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+
+    workers = max(1, min(args.workers, len(inputs)))
+    print(f"Procesando {len(inputs)} archivos con {workers} procesos")
+
+    outputs = output_paths_for(inputs, output_dir)
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(process_one, str(path), str(outputs[path])): path
+            for path in inputs
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results.append(result)
+            elapsed = time.perf_counter() - started
+            name = Path(result["input"]).name
+            if result["status"] == "completed":
+                detail = f"{result['rows']} filas, ${result['total_amount']:,.2f} ({result['timings']['total']:.2f}s)"
+            else:
+                detail = f"ERROR: {result['error']}"
+            print(f"[{done}/{len(inputs)}] {name}: {detail} - {done / elapsed:.2f} archivos/s")
+
+    elapsed = time.perf_counter() - started
+    completed = [r for r in results if r["status"] == "completed"]
+    failed = [r for r in results if r["status"] == "failed"]
+    total_rows = sum(r["rows"] for r in completed)
+
+    manifest = {
+        "generated_at": datetime.now().isoformat(),
+        "workers": workers,
+        "files": len(results),
+        "completed": len(completed),
+        "failed": len(failed),
+        "rows": total_rows,
+        "total_amount": round(sum(r["total_amount"] for r in completed), 2),
+        "elapsed_seconds": round(elapsed, 4),
+        "files_per_second": round(len(results) / elapsed, 4) if elapsed else None,
+        "rows_per_second": round(total_rows / elapsed, 2) if elapsed else None,
+        "results": sorted(results, key=lambda r: r["input"]),
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    print(f"Listo: {len(completed)} completados, {len(failed)} fallidos, {total_rows} filas en {elapsed:.2f}s")
+    print(f"Manifiesto: {manifest_path}")
+    return 1 if failed else 0
 
-file_datos = Path("ANEXO A4 ESFLO MKTING Q1 Agosto 2025.xlsx")
-file_plantilla = Path("plantilla-dispersion-actual.xlsx")
-out = Path(f"plantilla_{datetime.now().strftime('%Y-%m-%d')}.xlsx")
-
-# Lee con header en la fila 8 (index 7)
-df = pd.read_excel(file_datos, sheet_name="ADMON. PENSION", header=7)
-# normalizar columnas
-df.columns = [str(c).strip().upper().replace("Á","A").replace("É","E").replace("Í","I").replace("Ó","O").replace("Ú","U").replace("Ñ","N") for c in df.columns]
-
-# helper de búsqueda por palabra clave
-def find_col(df, keywords):
-    for kw in keywords:
-        for c in df.columns:
-            if kw in c:
-                return c
-    return None
-
-col_nombre = find_col(df, ["NOMBRE","NOMBRE COMPLETO","NOMBRECOMPLETO","APELLIDO","EMPLEADO"])
-col_clabe = find_col(df, ["CLABE","CLABEINTERBANCARIA","CLABE INTERBANCARIA","CUENTA","BANCO"])
-col_monto = find_col(df, ["NETO","NETO A DEPOSITAR","MONTO","IMPORTE","PENSION","PAGO","CANTIDAD"])
-
-df_out = pd.DataFrame()
-df_out["Nombre"] = df[col_nombre] if col_nombre else ""
-df_out["Clabe"] = df[col_clabe] if col_clabe else ""
-df_out["Monto"] = df[col_monto] if col_monto else ""
-df_out["Concepto"] = "PENSION POR RENTA VITALICIA"
-
-# limpieza basica
-# Convertir CLABEs de notación científica a formato correcto
-df_out["Clabe"] = df_out["Clabe"].apply(lambda x: f"{int(float(x)):018d}" if pd.notna(x) and str(x) != 'nan' else "")
-df_out["Monto"] = pd.to_numeric(df_out["Monto"], errors="coerce").round(2)
-
-df_out = df_out.dropna(subset=["Nombre","Clabe","Monto"])
-
-# Filtrar filas de totales que no queremos
-totales_keywords = ['NETO A DEPOSITAR', 'COMISION', 'SUBTOTAL', 'IVA', 'TOTAL']
-df_out = df_out[~df_out['Nombre'].astype(str).str.upper().isin([k.upper() for k in totales_keywords])]
-
-# Crear un nuevo workbook con formato similar a la plantilla
-wb = openpyxl.Workbook()
-ws = wb.active
-ws.title = "Sheet1"
-
-# Definir estilos
-header_font = Font(bold=True)
-header_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-border = Border(
-    top=Side(style='thin'),
-    bottom=Side(style='thin'),
-    left=Side(style='thin'),
-    right=Side(style='thin')
-)
-center_alignment = Alignment(horizontal='center')
-
-# Escribir encabezados en la primera fila
-headers = ['Nombre', 'Clabe', 'Monto', 'Concepto']
-for col, header in enumerate(headers, 1):
-    cell = ws.cell(row=1, column=col, value=header)
-    cell.font = header_font
-    cell.fill = header_fill
-    cell.border = border
-    cell.alignment = center_alignment
-
-# Los datos ahora comienzan desde la fila 2, no necesitamos celda vacía
-
-# Escribir los datos a partir de la fila 2
-for row_idx, (_, row_data) in enumerate(df_out.iterrows(), start=2):
-    ws.cell(row=row_idx, column=1, value=row_data['Nombre'])
-    ws.cell(row=row_idx, column=2, value=row_data['Clabe'])
-    
-    # Aplicar formato de número con separadores de miles a los montos
-    monto_cell = ws.cell(row=row_idx, column=3, value=row_data['Monto'])
-    monto_cell.number_format = '#,##0.00'
-    
-    # Escribir el concepto en la columna 4
-    ws.cell(row=row_idx, column=4, value=row_data['Concepto'])
-    
-    # Aplicar bordes a todas las celdas de datos
-    for col in range(1, 5):
-        ws.cell(row=row_idx, column=col).border = border
-
-# Ajustar ancho de columnas con espaciado mejorado
-ws.column_dimensions['A'].width = 35  # Nombre - más espacio para nombres largos
-ws.column_dimensions['B'].width = 25  # Clabe - espacio adicional para números largos
-ws.column_dimensions['C'].width = 18  # Monto - espacio para cantidades con decimales
-ws.column_dimensions['D'].width = 40  # Concepto - más espacio para texto completo
-ws.column_dimensions['E'].width = 5   # Columna vacía para separación visual
-
-# Guardar el archivo
-wb.save(out)
-print(f"Archivo generado: {out} con {len(df_out)} filas de datos")
-print("Formato aplicado: encabezados en negrita, centrados, con bordes y tabla responsiva")
+if __name__ == "__main__":
+    sys.exit(main())